@@ -0,0 +1,86 @@
+import sys
+import time
+import tracemalloc
+
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / 'src' / '5g_nr_test_project'))
+
+from configs.models import PacketRecord
+from support_scripts.pending_table import PendingPacketTable
+
+
+def make_records(count: int):
+    """
+    Ожидающие tx с уникальными pkt_id, десятком машин и тремя приложениями
+    """
+
+    apps = ('BSM', 'CAM', 'MAP')
+    return [
+        PacketRecord(
+            ts_us=i * 100, event='tx', src=f"car_{i % 10}", dst=f"car_{(i + 1) % 10}",
+            pkt_id=f"pkt_{i:09d}", app=apps[i % 3], bytes=200 + i % 1000
+        )
+        for i in range(count)
+    ]
+
+
+def measure_memory(store_factory, records) -> float:
+    """
+    Память на ожидающий пакет по tracemalloc. Сами PacketRecord и строки pkt_id создает парсер, поэтому для
+    словаря к его памяти добавляется размер хранимых записей, а таблица хранит поля записей у себя
+    """
+
+    tracemalloc.start()
+    store = store_factory()
+
+    for record in records:
+        store[record.pkt_id] = record
+
+    memory = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+
+    if isinstance(store, dict):
+        memory += sum(sys.getsizeof(record) for record in records)
+
+    return memory / len(records)
+
+
+def measure(store_factory, records, label: str) -> None:
+    """
+    Память на ожидающий пакет, а также скорость вставки, поиска и удаления (замеряется без tracemalloc)
+    """
+
+    memory = measure_memory(store_factory, records)
+    store = store_factory()
+
+    start = time.perf_counter()
+    for record in records:
+        store[record.pkt_id] = record
+    insert_time = time.perf_counter() - start
+
+    start = time.perf_counter()
+    for record in records:
+        store.get(record.pkt_id)
+    lookup_time = time.perf_counter() - start
+
+    start = time.perf_counter()
+    for record in records:
+        del store[record.pkt_id]
+    delete_time = time.perf_counter() - start
+
+    count = len(records)
+    print(
+        f"{label}: {memory:.1f} байт/пакет, "
+        f"вставка {count / insert_time / 1e6:.2f} млн/с, "
+        f"поиск {count / lookup_time / 1e6:.2f} млн/с, "
+        f"удаление {count / delete_time / 1e6:.2f} млн/с"
+    )
+
+
+if __name__ == "__main__":
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 1_000_000
+    records = make_records(count)
+
+    measure(dict, records, 'dict[str, PacketRecord]')
+    measure(PendingPacketTable, records, 'PendingPacketTable')
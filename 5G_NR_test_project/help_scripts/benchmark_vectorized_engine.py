@@ -0,0 +1,45 @@
+import sys
+import time
+import logging
+
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / 'src' / '5g_nr_test_project'))
+
+from main_scripts.parsers import NJsonParser
+from main_scripts.processor import MetricsCalculator
+from support_scripts.symbol_table import SymbolTable
+
+
+def measure(batches, engine: str) -> None:
+    """
+    Время обработки пакетов и расчета итоговых метрик для движка engine
+    """
+
+    calculator = MetricsCalculator(symbols=SymbolTable(), engine=engine)
+
+    start = time.perf_counter()
+    for batch in batches:
+        calculator.process_batch(batch)
+    process_time = time.perf_counter() - start
+
+    start = time.perf_counter()
+    calculator.get_metrics_result()
+    result_time = time.perf_counter() - start
+
+    rows = sum(batch.num_rows for batch in batches)
+    print(
+        f"{engine}: обработка {process_time:.1f} с ({rows / process_time / 1e6:.2f} млн записей/с), "
+        f"итоговые метрики {result_time:.1f} с"
+    )
+
+
+if __name__ == "__main__":
+    logging.disable(logging.CRITICAL)
+
+    file_path = Path(sys.argv[1])
+    batch_size = int(sys.argv[2]) if len(sys.argv) > 2 else 65536
+    batches = list(NJsonParser().parse_batches(file_path, batch_size=batch_size))
+
+    measure(batches, 'record')
+    measure(batches, 'vectorized')
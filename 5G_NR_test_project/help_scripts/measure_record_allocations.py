@@ -0,0 +1,62 @@
+import sys
+import json
+import tracemalloc
+
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / 'src' / '5g_nr_test_project'))
+
+from configs.models import ParseResult, PacketRecord
+from main_scripts.processor import MetricsCalculator
+
+
+def load_scaled_records(file_path: Path, scale: int):
+    """
+    Размножает записи исходного датасета scale раз со сдвигом времени и уникальными pkt_id
+    """
+
+    base_records = [json.loads(line) for line in file_path.read_text(encoding='utf-8').splitlines() if line]
+    records = []
+
+    for k in range(scale):
+        for raw in base_records:
+            scaled = ParseResult(**raw).model_dump()
+            scaled['ts_us'] = raw['ts_us'] + k * 20_000_000
+            scaled['pkt_id'] = f"{raw['pkt_id']}_{k}"
+            records.append(scaled)
+
+    return records
+
+
+def measure(raw_records, record_type, label: str) -> None:
+    """
+    Считает количество и объем блоков памяти на одну запись при помощи tracemalloc: создание записи нужного
+    типа и ее обработка калькулятором (ожидающие tx/rx, возвращенные пары и агрегаты)
+    """
+
+    calculator = MetricsCalculator()
+    results = []
+
+    tracemalloc.start()
+    before = tracemalloc.take_snapshot()
+
+    for raw in raw_records:
+        results.append(calculator.process_record(record_type(**raw)))
+
+    after = tracemalloc.take_snapshot()
+    tracemalloc.stop()
+
+    stats = after.compare_to(before, 'filename')
+    blocks = sum(stat.count_diff for stat in stats)
+    size = sum(stat.size_diff for stat in stats)
+
+    print(f"{label}: {blocks / len(raw_records):.2f} блоков/запись, {size / len(raw_records):.1f} байт/запись")
+
+
+if __name__ == "__main__":
+    scale = int(sys.argv[1]) if len(sys.argv) > 1 else 200
+    dataset = Path(__file__).resolve().parent.parent / 'tests' / 'sample_big_test.ndjson'
+    raw_records = load_scaled_records(dataset, scale)
+
+    measure(raw_records, ParseResult, 'ParseResult')
+    measure(raw_records, PacketRecord, 'PacketRecord')
@@ -0,0 +1,83 @@
+import sys
+import time
+import logging
+import tracemalloc
+
+import numpy as np
+
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / 'src' / '5g_nr_test_project'))
+
+from main_scripts.batch_validation import records_to_batch
+from main_scripts.processor import MetricsCalculator
+from support_scripts.symbol_table import SymbolTable
+
+APPS = ['BSM', 'CAM', 'DENM', 'MAP', 'SPAT', 'RSI']
+
+
+def make_batches(vehicles: int, packets: int, batch_size: int = 65536, seed: int = 0):
+    """
+    Синтетический сценарий с большим количеством машин: случайные пары src -> dst, 90% пакетов доставлено
+    """
+
+    rng = np.random.default_rng(seed)
+    src = rng.integers(0, vehicles, packets)
+    dst = (src + rng.integers(1, vehicles, packets)) % vehicles
+    app = rng.integers(0, len(APPS), packets)
+    tx_ts = np.arange(packets) * 50
+    latency = rng.integers(100, 50000, packets)
+    delivered = rng.random(packets) < 0.9
+
+    rows = []
+    for i in range(packets):
+        tx = {
+            'ts_us': int(tx_ts[i]), 'event': 'tx', 'src': f"car_{src[i]}", 'dst': f"car_{dst[i]}",
+            'pkt_id': f"pkt_{i}", 'app': APPS[app[i]], 'bytes': 300
+        }
+        rows.append(tx)
+        if delivered[i]:
+            rows.append({**tx, 'ts_us': int(tx_ts[i] + latency[i]), 'event': 'rx', 'src': tx['dst'], 'dst': tx['src']})
+
+    rows.sort(key=lambda row: row['ts_us'])
+    return [records_to_batch(rows[i:i + batch_size]) for i in range(0, len(rows), batch_size)]
+
+
+def run(batches, use_symbols: bool, window_size: int) -> float:
+    calculator = MetricsCalculator(window_size=window_size, symbols=SymbolTable() if use_symbols else None)
+
+    start = time.perf_counter()
+    for batch in batches:
+        calculator.process_batch(batch)
+    calculator.get_metrics_result()
+
+    return time.perf_counter() - start
+
+
+def measure(batches, use_symbols: bool, window_size: int, label: str) -> None:
+    """
+    Память, удерживаемая калькулятором после обработки (tracemalloc), и время обработки без tracemalloc
+    """
+
+    tracemalloc.start()
+    calculator = MetricsCalculator(window_size=window_size, symbols=SymbolTable() if use_symbols else None)
+    for batch in batches:
+        calculator.process_batch(batch)
+    memory = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+
+    del calculator
+
+    elapsed = run(batches, use_symbols, window_size)
+    print(f"{label}: {memory / 1e6:.1f} МБ, {elapsed:.1f} с")
+
+
+if __name__ == "__main__":
+    logging.disable(logging.CRITICAL)
+
+    vehicles = int(sys.argv[1]) if len(sys.argv) > 1 else 2000
+    packets = int(sys.argv[2]) if len(sys.argv) > 2 else 300000
+    batches = make_batches(vehicles, packets)
+
+    measure(batches, False, 1000000, 'строки')
+    measure(batches, True, 1000000, 'коды SymbolTable')
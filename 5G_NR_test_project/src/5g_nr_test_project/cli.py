@@ -1,17 +1,27 @@
 import os
 import sys
+import json
 import click
 import logging
 
 from pathlib import Path
 from datetime import datetime
+from typing import Optional, Tuple
 
 current_dir = os.path.dirname(os.path.abspath(__file__))
 project_root = os.path.dirname(os.path.join(current_dir, '..', '..'))
 sys.path.insert(0, project_root)
 
 from .main_scripts.parser_definition import get_parser_factory
+from .main_scripts.parallel_parsing import parse_parallel
+from .main_scripts.input_merge import collect_input_files, merge_batches
+from .main_scripts.batch_validation import DEFAULT_BATCH_SIZE
 from .main_scripts.processor import MetricsCalculator
+from .main_scripts.group_by import normalize_group_by
+from .main_scripts.partitioned_metrics import PartitionedMetricsCalculator
+from .main_scripts.external_sort import ExternalSortMetrics, parse_memory_size
+from .main_scripts.window_sinks import ParquetWindowSink, NJsonWindowSink
+from .support_scripts.symbol_table import SymbolTable
 from .visualization.plotter import Plotter
 
 
@@ -33,6 +43,120 @@ def setup_logging():
     )
 
 
+def write_batch(file, batch) -> None:
+    """
+    Записывает пакет записей в унифицированный файл в том же виде, что и ParseResult.model_dump_json()
+    :param:
+        file: - открытый на запись унифицированный файл
+        batch: - пакет записей со схемой ParseResult
+    """
+
+    file.writelines(
+        json.dumps(row, ensure_ascii=False, separators=(',', ':')) + '\n' for row in batch.to_pylist()
+    )
+
+
+def parse_window_sizes(ctx, param, value: str) -> Tuple[int, ...]:
+    """
+    Разбор одного или нескольких размеров окна вида "100000,1000000,10000000" для опции --window-size
+    """
+
+    try:
+        window_sizes = tuple(int(window_size) for window_size in str(value).split(','))
+    except ValueError:
+        raise click.BadParameter(f"Ожидается список целых чисел через запятую: {value}")
+
+    if any(window_size <= 0 for window_size in window_sizes):
+        raise click.BadParameter(f"Размер окна должен быть положительным: {value}")
+
+    if any(window_size % min(window_sizes) for window_size in window_sizes):
+        raise click.BadParameter(f"Размеры окон должны быть кратны наименьшему размеру: {value}")
+
+    return window_sizes
+
+
+def parse_percentiles(ctx, param, value: Optional[str]) -> Tuple[float, ...]:
+    """
+    Разбор списка перцентилей вида "90,99,99.9" для опции --percentiles
+    """
+
+    if not value:
+        return ()
+
+    try:
+        percentiles = tuple(float(percentile) for percentile in value.split(','))
+    except ValueError:
+        raise click.BadParameter(f"Ожидается список чисел через запятую: {value}")
+
+    if any(not 0 <= percentile <= 100 for percentile in percentiles):
+        raise click.BadParameter(f"Перцентили должны быть в диапазоне [0, 100]: {value}")
+
+    return percentiles
+
+
+def parse_memory_limit(ctx, param, value: Optional[str]) -> Optional[int]:
+    """
+    Разбор размера памяти вида "512M", "2G" или числа байт для опции --memory-limit
+    """
+
+    if not value:
+        return None
+
+    try:
+        return parse_memory_size(value)
+    except ValueError as error:
+        raise click.BadParameter(str(error))
+
+
+def parse_group_by(ctx, param, value: Optional[str]) -> Tuple[Tuple[str, ...], ...]:
+    """
+    Разбор группировок вида "src;app,window;dst,app,window" для опции --group-by: группировки разделяются точкой
+    с запятой, поля группировки - запятой
+    """
+
+    if not value:
+        return ()
+
+    try:
+        return normalize_group_by([
+            tuple(field.strip() for field in grouping.split(',')) for grouping in value.split(';') if grouping.strip()
+        ])
+    except ValueError as e:
+        raise click.BadParameter(str(e))
+
+
+def echo_processing_stats(calculator: MetricsCalculator) -> None:
+    """
+    Вывод статистики по обработке и итоговых метрик в консоль
+    :param:
+        calculator: - калькулятор после обработки всех записей
+    """
+
+    current_proc_stats = calculator.get_curr_stats()
+    current_summary = calculator.get_summary()
+
+    click.echo("\n" + "=" * 40)
+    click.echo("СТАТИСТИКА ПО ОБРАБОТКЕ")
+    click.echo("=" * 40)
+    click.echo(f"Количество обработанных записей: {current_proc_stats['processed_cnt']}")
+    click.echo(f"Количество успешно связанных записей tx и rx: {current_proc_stats['sucess_cnt']}")
+    click.echo(f"Процент связанных записей tx и rx: {current_proc_stats['matched']}")
+    click.echo(f"PDR по всему фрейму данных: {current_summary['overall_pdr']}")
+    click.echo(f"Среднее значение latency по всему датафрейму: {current_summary['overall_latency_mean']}")
+    click.echo(f"Количество уникальных пар объектов: {current_summary['unique_pairs']}")
+    for name, error_rate in current_proc_stats['anomaly_error_rates'].items():
+        click.echo(
+            f"{name}: {current_proc_stats['anomalies'][name]} (вероятность ложного срабатывания {error_rate:.2e})"
+        )
+    if 'pending_spill' in current_proc_stats:
+        spill = current_proc_stats['pending_spill']
+        click.echo(
+            f"Ожидающие записи на диске: {spill['on_disk']} (перенесено {spill['spilled']}, "
+            f"попаданий в памяти {spill['hits']}, чтений с диска {spill['misses']})"
+        )
+    click.echo("=" * 40 + "\n")
+
+
 @click.group()
 def main():
     """
@@ -46,12 +170,18 @@ def main():
 @main.command()
 @click.argument('input_file', type=click.Path(exists=True))
 @click.option('-o', '--output-file', help='Путь файла, в который нужно записать обработанные данные')
-def parse(input_file: str, output_file: str):
+@click.option('-b', '--batch-size', type=int, default=None,
+              help='Пакетный режим: количество строк источника в одном блоке, разбираемом через pyarrow')
+@click.option('--workers', type=click.IntRange(min=1), default=1,
+              help='Количество процессов для параллельного парсинга частей файла')
+def parse(input_file: str, output_file: str, batch_size: int, workers: int):
     """
     Команда для создания потока данных из источника
     :param:
         input_file: - путь входного файла
         output_file: - путь директории хранения унифицированных файлов
+        batch_size: - размер блока для пакетного режима парсинга
+        workers: - количество процессов для параллельного парсинга
     """
 
     logging.info(f"Парсинг файла: {input_file}")
@@ -84,8 +214,16 @@ def parse(input_file: str, output_file: str):
         logging.info(f"Выполняет работу парсер: {parser.parse_name}")
 
         with open(output_path, mode='w', encoding='utf-8') as file:
-            for record in parser.parse_data_stream(input_path):
-                file.write(record.model_dump_json() + '\n')
+            if workers > 1:
+                for batches in parse_parallel(parser, input_path, workers, batch_size or DEFAULT_BATCH_SIZE):
+                    for batch in batches:
+                        write_batch(file, batch)
+            elif batch_size:
+                for batch in parser.parse_batches(input_path, batch_size=batch_size):
+                    write_batch(file, batch)
+            else:
+                for record in parser.parse_data_stream(input_path):
+                    file.write(record.model_dump_json() + '\n')
 
         logging.info(f"Парсер успешно обработал источник данных: {input_file} -> {output_path}")
         logging.info(f"Парсинг данных завершен")
@@ -95,54 +233,181 @@ def parse(input_file: str, output_file: str):
 
 
 @main.command()
-@click.argument('unified_file', type=click.Path(exists=True))
+@click.argument('unified_files', nargs=-1, required=True, type=click.Path(exists=True))
 @click.option('-o', '--output-dir', default='./artifacts', help='Директория для хранения итоговых метрик')
-@click.option('-w', '--window-size', default=1000000, help='Размер временного интервала, для агрегации метрик')
-def metrics(unified_file: str, output_dir: str, window_size: int):
+@click.option('-n', '--name', default=None,
+              help='Название директории с итоговыми метриками внутри output-dir (по умолчанию - по входному пути)')
+@click.option('-w', '--window-size', callback=parse_window_sizes, default='1000000',
+              help='Размер временного интервала для агрегации метрик или несколько размеров через запятую')
+@click.option('--window-hop-us', type=click.IntRange(min=1), default=None,
+              help='Шаг скользящих окон в мкс: окна размера --window-size строятся каждые window-hop-us мкс')
+@click.option('--workers', type=click.IntRange(min=1), default=1,
+              help='Количество процессов для параллельного парсинга и расчета метрик по секциям pkt_id')
+@click.option('--latency-backend', type=click.Choice(['exact', 'sketch']), default='exact',
+              help='Хранение задержек: exact - полный список значений, sketch - скетч квантилей с ограниченной памятью')
+@click.option('--latency-accuracy', type=click.FloatRange(min=0, max=1, min_open=True, max_open=True),
+              default=0.01, help='Относительная точность p50/p95 для --latency-backend sketch')
+@click.option('--match-timeout-us', type=click.IntRange(min=0), default=None,
+              help='Время ожидания пары tx/rx в мкс, после которого ожидающие записи вытесняются')
+@click.option('--pending-store', type=click.Choice(['dict', 'array']), default='dict',
+              help='Хранилище ожидающих tx: dict - словарь записей, array - компактная хэш-таблица на массивах NumPy')
+@click.option('--engine', type=click.Choice(['record', 'vectorized']), default='record',
+              help='Обработка: record - построчная, vectorized - колоночное сопоставление пакетов записей в NumPy')
+@click.option('--save-state', type=click.Path(dir_okay=False), default=None,
+              help='Файл для сохранения состояния калькулятора (для последующего объединения командой reduce)')
+@click.option('--percentiles', callback=parse_percentiles, default=None,
+              help='Дополнительные перцентили задержки через запятую, например "90,99,99.9"')
+@click.option('--allowed-lateness-us', type=click.IntRange(min=0), default=None,
+              help='Допустимое опоздание записей в мкс: окна закрываются по watermark и сразу выгружаются')
+@click.option('--window-sink', type=click.Choice(['parquet', 'ndjson']), default='parquet',
+              help='Приемник закрытых окон: parquet - metrics_windows.parquet в директории метрик, ndjson - stdout')
+@click.option('--emit-corrections', is_flag=True, default=False,
+              help='Выгружать опоздавшие записи строками-поправками к уже закрытым окнам')
+@click.option('--group-by', callback=parse_group_by, default=None,
+              help='Дополнительные группировки через точку с запятой, поля через запятую: "src;app,window"')
+@click.option('--duplicate-filter-error-rate', type=click.FloatRange(min=0, max=1, min_open=True, max_open=True),
+              default=None, help='Вероятность ложного срабатывания фильтра Блума для поиска дубликатов tx/rx по pkt_id')
+@click.option('--sorted', 'sorted_input', is_flag=True, default=False,
+              help='Записи упорядочены по ts_us: окна закрываются сразу, записи не по порядку считаются аномалией')
+@click.option('--memory-limit', callback=parse_memory_limit, default=None,
+              help='Ограничение памяти под записи ("512M", "2G"): сопоставление tx/rx внешней сортировкой по pkt_id')
+@click.option('--pending-memory-limit', callback=parse_memory_limit, default=None,
+              help='Бюджет памяти ожидающих tx/rx ("512M", "2G") вместе с очередями --match-timeout-us: старые '
+                   'ожидающие записи переносятся в sqlite3')
+def metrics(unified_files: Tuple[str, ...], output_dir: str, name: Optional[str], window_size: Tuple[int, ...],
+            workers: int, latency_backend: str, latency_accuracy: float, match_timeout_us: Optional[int],
+            pending_store: str, engine: str, save_state: Optional[str], percentiles: Tuple[float, ...],
+            allowed_lateness_us: Optional[int], window_sink: str, emit_corrections: bool, window_hop_us: Optional[int],
+            group_by: Tuple[Tuple[str, ...], ...], duplicate_filter_error_rate: Optional[float],
+            sorted_input: bool, memory_limit: Optional[int], pending_memory_limit: Optional[int]):
     """
     Команда для расчета итоговых метрик
     :param:
-        unified_file: - путь к входному унифицированному файлу
+        unified_files: - пути к входным файлам или директориям. Несколько файлов (или директория) сливаются
+                         по ts_us без предварительной сортировки (merge_batches)
         output_dir: - путь к выходной директории
-        window_size: - размер временного интервала, для агрегации метрик
+        name: - название директории с итоговыми метриками, None - имя входного файла или директории
+        window_size: - размеры временного интервала для агрегации метрик
+        workers: - количество процессов для параллельного парсинга и расчета метрик
+        latency_backend: - способ хранения задержек (exact или sketch)
+        latency_accuracy: - относительная точность квантилей задержки для sketch
+        match_timeout_us: - время ожидания пары tx/rx, None - без вытеснения
+        pending_store: - хранилище ожидающих tx (dict или array)
+        engine: - способ обработки записей (record или vectorized)
+        save_state: - путь к файлу состояния калькулятора, None - состояние не сохраняется
+        percentiles: - дополнительные перцентили задержки к p50 и p95
+        allowed_lateness_us: - допустимое опоздание записей для закрытия окон, None - окна хранятся до конца
+        window_sink: - приемник закрытых окон (parquet или ndjson)
+        emit_corrections: - выгружать поправки к закрытым окнам по опоздавшим записям
+        window_hop_us: - шаг скользящих окон, None - окна не перекрываются
+        group_by: - дополнительные группировки по полям записи tx
+        duplicate_filter_error_rate: - вероятность ложного срабатывания фильтров увиденных pkt_id, None - без
+                                       поиска duplicate_rx
+        sorted_input: - записи упорядочены по ts_us
+        memory_limit: - ограничение памяти под записи в байтах, None - сопоставление в памяти
+        pending_memory_limit: - бюджет памяти ожидающих tx и rx в байтах (на все процессы), None - без переноса
+                                на диск
     """
 
-    logging.info(f"Старт расчета метрик из потока данных: {unified_file}")
+    logging.info(f"Старт расчета метрик из потока данных: {', '.join(unified_files)}")
+
+    if allowed_lateness_us is not None and workers > 1:
+        raise click.UsageError("--allowed-lateness-us поддерживается только с --workers 1")
+
+    if memory_limit is not None:
+        options = {
+            '--workers': workers > 1, '--match-timeout-us': match_timeout_us is not None,
+            '--allowed-lateness-us': allowed_lateness_us is not None, '--sorted': sorted_input,
+            '--save-state': save_state is not None
+        }
+        conflicts = [option for option, used in options.items() if used]
+        if conflicts:
+            raise click.UsageError(f"--memory-limit не совместим с {', '.join(conflicts)}")
 
     try:
-        unified_path = Path(unified_file)
-        if not unified_path.exists():
-            logging.error(f"Указан неверный унифицированный файл с данными: {unified_file}")
-            return
+        unified_paths = [Path(unified_file) for unified_file in unified_files]
+        for unified_path in unified_paths:
+            if not unified_path.exists():
+                logging.error(f"Указан неверный унифицированный файл с данными: {unified_path}")
+                return
+
+        unified_path = unified_paths[0]
+        merge_inputs = len(unified_paths) > 1 or unified_path.is_dir()
 
         artifacts_dir = Path(output_dir)
-        source_name = unified_path.stem
+        source_name = name or (unified_path.stem if len(unified_paths) == 1 else 'merged')
         final_output_dir = artifacts_dir / source_name
         final_output_dir.mkdir(parents=True, exist_ok=True)
 
-        calculator = MetricsCalculator(window_size=window_size)
+        symbols = SymbolTable()
+        calculator_options = dict(
+            window_size=window_size,
+            window_hop_us=window_hop_us,
+            latency_backend=latency_backend,
+            latency_accuracy=latency_accuracy,
+            match_timeout_us=match_timeout_us,
+            pending_store=pending_store,
+            engine=engine,
+            percentiles=percentiles,
+            group_by=group_by,
+            duplicate_filter_error_rate=duplicate_filter_error_rate,
+            sorted_input=sorted_input,
+            pending_memory_limit=pending_memory_limit
+        )
+
+        sink = None
+        if allowed_lateness_us is not None:
+            sink = (
+                ParquetWindowSink(final_output_dir / 'metrics_windows.parquet') if window_sink == 'parquet'
+                else NJsonWindowSink()
+            )
+
+        calculator = MetricsCalculator(
+            symbols=symbols, allowed_lateness_us=allowed_lateness_us, window_sink=sink,
+            emit_corrections=emit_corrections, **calculator_options
+        )
+
+        # Несколько файлов сливаются по ts_us, один файл разбирается параллельно (--workers) или пакетами
+        # (vectorized), а построчный расчет по одному файлу получает записи напрямую из parse_records
+        batches = None
+        if merge_inputs:
+            sources = collect_input_files(unified_paths)
+            logging.info(f"Слияние {len(sources)} файлов по ts_us")
+            batches = merge_batches(sources)
+        else:
+            parser = get_parser_factory().get_parser(unified_path)
+            if workers > 1:
+                batches = (batch for batches in parse_parallel(parser, unified_path, workers) for batch in batches)
+            elif engine == 'vectorized' or memory_limit is not None:
+                batches = parser.parse_batches(unified_path)
+
+        if memory_limit is not None:
+            external = ExternalSortMetrics(memory_limit, symbols=symbols, **calculator_options)
+            for batch in batches:
+                external.process_batch(batch)
+            calculator = external.result()
+        elif workers > 1:
+            partitioned = PartitionedMetricsCalculator(workers, symbols=symbols, **calculator_options)
+            for batch in batches:
+                partitioned.process_batch(batch)
+            calculator = partitioned.result()
+        elif batches is not None:
+            for batch in batches:
+                calculator.process_batch(batch)
+        else:
+            for record in parser.parse_records(unified_path, symbols=symbols):
+                calculator.process_record(record)
 
-        parser_factory = get_parser_factory()
-        parser = parser_factory.get_parser(unified_path)
+        if save_state:
+            calculator.save_state(save_state)
 
-        for record in parser.parse_data_stream(unified_path):
-            calculator.process_record(record)
+        calculator.flush_pending()
+        if sink is not None:
+            sink.close()
 
         calculator.export_comprehensive(final_output_dir)
 
-        current_proc_stats = calculator.get_curr_stats()
-        current_summary = calculator.get_summary()
-
-        click.echo("\n" + "=" * 40)
-        click.echo("СТАТИСТИКА ПО ОБРАБОТКЕ")
-        click.echo("=" * 40)
-        click.echo(f"Количество обработанных записей: {current_proc_stats['processed_cnt']}")
-        click.echo(f"Количество успешно связанных записей tx и rx: {current_proc_stats['sucess_cnt']}")
-        click.echo(f"Процент связанных записей tx и rx: {current_proc_stats['matched']}")
-        click.echo(f"PDR по всему фрейму данных: {current_summary['overall_pdr']}")
-        click.echo(f"Среднее значение latency по всему датафрейму: {current_summary['overall_latency_mean']}")
-        click.echo(f"Количество уникальных пар объектов: {current_summary['unique_pairs']}")
-        click.echo("=" * 40 + "\n")
+        echo_processing_stats(calculator)
 
         logging.info(f"Расчет метрик закончен. Поток данных закрыт")
         logging.info(f"Метрики сохранены в директорию: {final_output_dir}")
@@ -151,6 +416,50 @@ def metrics(unified_file: str, output_dir: str, window_size: int):
         logging.error(f"Ошибка подсчета итоговых метрик: {e}")
 
 
+@main.command()
+@click.argument('state_files', nargs=-1, required=True, type=click.Path(exists=True, dir_okay=False))
+@click.option('-o', '--output-dir', default='./artifacts', help='Директория для хранения итоговых метрик')
+@click.option('-n', '--name', default='reduced', help='Название директории с итоговыми метриками внутри output-dir')
+@click.option('--save-state', type=click.Path(dir_okay=False), default=None,
+              help='Файл для сохранения объединенного состояния (для многоуровневого объединения)')
+def reduce(state_files: Tuple[str, ...], output_dir: str, name: str, save_state: Optional[str]):
+    """
+    Команда для объединения состояний калькулятора, сохраненных командой metrics с --save-state, в итоговые
+    метрики без повторного чтения исходных логов. Состояния объединяются в порядке перечисления, ожидающие
+    tx и rx разных файлов сопоставляются между собой. Если один tx есть в нескольких файлах, rx последующих
+    файлов остаются сопоставленными с повторным tx, поэтому результат по таким pkt_id может отличаться от
+    расчета по объединенному логу (в лог пишется предупреждение)
+    :param:
+        state_files: - пути к файлам состояний
+        output_dir: - путь к выходной директории
+        name: - название директории с итоговыми метриками
+        save_state: - путь к файлу объединенного состояния, None - состояние не сохраняется
+    """
+
+    logging.info(f"Старт объединения {len(state_files)} состояний калькулятора")
+
+    try:
+        calculator = MetricsCalculator.load_state(state_files[0])
+        for state_file in state_files[1:]:
+            calculator.merge(MetricsCalculator.load_state(state_file))
+
+        if save_state:
+            calculator.save_state(save_state)
+
+        final_output_dir = Path(output_dir) / name
+        final_output_dir.mkdir(parents=True, exist_ok=True)
+
+        calculator.flush_pending()
+        calculator.export_comprehensive(final_output_dir)
+
+        echo_processing_stats(calculator)
+
+        logging.info(f"Объединение состояний закончено. Метрики сохранены в директорию: {final_output_dir}")
+
+    except Exception as e:
+        logging.error(f"Ошибка объединения состояний калькулятора: {e}")
+
+
 @main.command()
 @click.argument('metrics_dir', type=click.Path(exists=True))
 @click.option('-o', '--output-dir', default='./plots', help='Директория для графиков')
@@ -5,6 +5,8 @@ from typing import Iterator, Dict
 from pathlib import Path
 from abc import ABC, abstractmethod
 
+import pyarrow as pa
+
 current_dir = os.path.dirname(os.path.abspath(__file__))
 project_root = os.path.dirname(os.path.join(current_dir, '..', '..'))
 sys.path.insert(0, project_root)
@@ -54,6 +56,29 @@ class ParserInterface(ABC):
         pass
 
 
+class WindowSinkInterface(ABC):
+    """
+    Интерфейс приемника закрытых временных окон: калькулятор передает строки окон, как только watermark проходит
+    конец окна с учетом допустимого опоздания, и освобождает их
+    """
+
+    @abstractmethod
+    def write(self, table: pa.Table) -> None:
+        """
+        Метод приема закрытых окон
+        :param:
+            table: pa.Table - строки окон со схемой by_window и колонкой correction (True - поправка к уже
+                              переданному окну по опоздавшим записям)
+        """
+        pass
+
+    def close(self) -> None:
+        """
+        Метод завершения записи после последнего окна
+        """
+        pass
+
+
 # @runtime_checkable
 # class ParserProtocol(Protocol):
 #     """
@@ -1,8 +1,9 @@
 import statistics
 import numpy as np
+import pyarrow as pa
 
 from pydantic import BaseModel, Field, field_validator, ConfigDict
-from typing import Optional, Dict, List, Tuple
+from typing import Optional, Dict, List, Tuple, Sequence, ClassVar
 from enum import Enum
 
 
@@ -55,6 +56,90 @@ class ParseResult(BaseModel):
         return v
 
 
+class PacketRecord:
+    """
+    Компактная запись для горячего пути парсер -> калькулятор метрик. Содержит те же поля, что и ParseResult,
+    но хранится в __slots__ без словаря атрибутов и без повторной валидации: записи создаются из уже
+    провалидированных пакетов парсера
+    """
+
+    __slots__ = ('ts_us', 'event', 'src', 'dst', 'pkt_id', 'app', 'bytes', 'rssi_dbm', 'sinr_db', 'drop_reason')
+
+    def __init__(self, ts_us: int, event: str, src: str, dst: str, pkt_id: str, app: str, bytes: int,
+                 rssi_dbm: Optional[float] = None, sinr_db: Optional[float] = None,
+                 drop_reason: Optional[str] = None) -> None:
+        self.ts_us = ts_us
+        self.event = event
+        self.src = src
+        self.dst = dst
+        self.pkt_id = pkt_id
+        self.app = app
+        self.bytes = bytes
+        self.rssi_dbm = rssi_dbm
+        self.sinr_db = sinr_db
+        self.drop_reason = drop_reason
+
+    @classmethod
+    def from_parse_result(cls, record: ParseResult) -> 'PacketRecord':
+        """
+        Создание компактной записи из модели ParseResult
+        """
+
+        return cls(*(getattr(record, name) for name in cls.__slots__))
+
+    def to_parse_result(self) -> ParseResult:
+        """
+        Преобразование в модель ParseResult без повторной валидации
+        """
+
+        return ParseResult.model_construct(**{name: getattr(self, name) for name in self.__slots__})
+
+    def __eq__(self, other: object) -> bool:
+        if not isinstance(other, PacketRecord):
+            return NotImplemented
+        return all(getattr(self, name) == getattr(other, name) for name in self.__slots__)
+
+    def __repr__(self) -> str:
+        fields = ', '.join(f"{name}={getattr(self, name)!r}" for name in self.__slots__)
+        return f"PacketRecord({fields})"
+
+
+class MatchedPair:
+    """
+    Сопоставленная пара tx и rx одного пакета. Поддерживает обращение по ключу, как словарь
+    """
+
+    __slots__ = (
+        'pkt_id', 'src', 'dst', 'app', 'latency', 'tx_ts', 'rx_ts', 'bytes', 'window_start', 'sinr_db', 'rssi_dbm'
+    )
+
+    def __init__(self, pkt_id: str, src: str, dst: str, app: str, latency: int, tx_ts: int, rx_ts: int,
+                 bytes: int, window_start: int, sinr_db: Optional[float], rssi_dbm: Optional[float] = None) -> None:
+        self.pkt_id = pkt_id
+        self.src = src
+        self.dst = dst
+        self.app = app
+        self.latency = latency
+        self.tx_ts = tx_ts
+        self.rx_ts = rx_ts
+        self.bytes = bytes
+        self.window_start = window_start
+        self.sinr_db = sinr_db
+        self.rssi_dbm = rssi_dbm
+
+    def __getitem__(self, key: str):
+        try:
+            return getattr(self, key)
+        except AttributeError:
+            raise KeyError(key)
+
+    def get(self, key: str, default=None):
+        return getattr(self, key, default)
+
+    def to_dict(self) -> Dict:
+        return {name: getattr(self, name) for name in self.__slots__}
+
+
 class AggregationType(str, Enum):
     """
     Разрешенные типы агрегации метрик
@@ -76,30 +161,100 @@ class LatencyStats(BaseModel):
     p95: float
     std: float
     count: int
+    percentiles: Dict[str, float] = Field(default_factory=dict)
+
+    # Перцентили, которые всегда хранятся в отдельных полях
+    BASE_PERCENTILES: ClassVar[Tuple[float, float]] = (50, 95)
+
+    @staticmethod
+    def percentile_name(percentile: float) -> str:
+        """
+        Название перцентиля: 50 -> 'p50', 99.9 -> 'p99.9'
+        """
+
+        return f"p{percentile:g}"
+
+    @classmethod
+    def from_percentiles(cls, mean: float, std: float, count: int, values: Dict[float, float]):
+        """
+        Модель по уже посчитанным перцентилям: p50 и p95 записываются в свои поля, остальные - в percentiles
+        :param:
+            mean: - среднее значение
+            std: - стандартное отклонение
+            count: - количество значений
+            values: - значения перцентилей по перцентилю в процентах (должны быть 50 и 95)
+        :return:
+            LatencyStats - возвращает модель данных по метрикам latency
+        """
+
+        return cls(
+            mean=mean,
+            p50=values[50],
+            p95=values[95],
+            std=std,
+            count=count,
+            percentiles={
+                cls.percentile_name(percentile): value for percentile, value in values.items()
+                if percentile not in cls.BASE_PERCENTILES
+            }
+        )
 
     @classmethod
-    def create(cls, latencies: List[float]):
+    def empty(cls, percentiles: Sequence[float] = ()):
+        """
+        Статистики группы без задержек
+        """
+
+        return cls.from_percentiles(0.0, 0.0, 0, dict.fromkeys((*cls.BASE_PERCENTILES, *percentiles), 0.0))
+
+    @classmethod
+    def create(cls, latencies: List[float], running_stats=None, percentiles: Sequence[float] = ()):
         """
         Подсчет итоговых статистик по latency
         :param:
             latencies: - список значений для подсчета агрегатов
+            running_stats: - накопитель RunningStats группы. Если передан, mean, std и count берутся из него,
+                             а список нужен только для перцентилей
+            percentiles: - дополнительные перцентили в процентах (например, 90, 99, 99.9)
         :return:
             LatencyStats - возвращает модель данных по метрикам latency
         """
 
         if not latencies:
-            return cls(mean=0.0, p50=0.0, p95=0.0, std=0.0, count=0)
+            return cls.empty(percentiles)
 
         sorted_latencies = sorted(latencies)
         n = len(sorted_latencies)
 
-        return cls(
-            mean=statistics.mean(sorted_latencies),
-            p50=np.percentile(sorted_latencies, 50),
-            p95=np.percentile(sorted_latencies, 95),
-            std=statistics.stdev(sorted_latencies) if n > 1 else 0.0,
-            count=n
-        )
+        if running_stats is not None:
+            mean, std = running_stats.mean, running_stats.std
+        else:
+            mean = statistics.mean(sorted_latencies)
+            std = statistics.stdev(sorted_latencies) if n > 1 else 0.0
+
+        return cls.from_percentiles(mean, std, n, {
+            percentile: np.percentile(sorted_latencies, percentile)
+            for percentile in (*cls.BASE_PERCENTILES, *percentiles)
+        })
+
+    @classmethod
+    def from_sketch(cls, sketch, running_stats, percentiles: Sequence[float] = ()):
+        """
+        Подсчет итоговых статистик по latency из потокового скетча квантилей
+        :param:
+            sketch: - скетч (LatencySketch) с накопленными значениями задержки, из него берутся перцентили
+            running_stats: - накопитель RunningStats группы, из него берутся mean, std и count
+            percentiles: - дополнительные перцентили в процентах
+        :return:
+            LatencyStats - возвращает модель данных по метрикам latency
+        """
+
+        if not running_stats.count:
+            return cls.empty(percentiles)
+
+        return cls.from_percentiles(running_stats.mean, running_stats.std, running_stats.count, {
+            percentile: sketch.quantile(percentile / 100) for percentile in (*cls.BASE_PERCENTILES, *percentiles)
+        })
 
 
 class PDRMetrics(BaseModel):
@@ -139,6 +294,8 @@ class ConnectionMetrics(BaseModel):
     window_start: Optional[int] = None
     sinr_avg: Optional[float] = None
     sinr_count: Optional[float] = None
+    rssi_avg: Optional[float] = None
+    rssi_count: Optional[int] = None
 
 
 class MetricsResult(BaseModel):
@@ -153,3 +310,262 @@ class MetricsResult(BaseModel):
     anomalies: Dict[str, int]
     processed_cnt: int
     success_cnt: int
+
+
+# Колонки ключа группы в таблицах ColumnarMetricsResult и в выгрузке для каждого уровня агрегации
+KEY_FIELDS: Dict[str, Tuple[Tuple[str, pa.DataType], ...]] = {
+    AggregationType.OVERALL.value: (),
+    AggregationType.BY_PAIR.value: (('src', pa.string()), ('dst', pa.string()), ('app', pa.string())),
+    AggregationType.BY_APP.value: (('app', pa.string()),),
+    AggregationType.BY_WINDOW.value: (
+        ('window_start', pa.int64()), ('src', pa.string()), ('dst', pa.string()), ('app', pa.string())
+    )
+}
+
+# Поля записи, по которым задаются пользовательские группировки (group_by), и колонки ключа группы для каждого поля.
+# window - начало окна основного размера по времени tx. Ключ группы берется из записи tx, поэтому поля, которые
+# заполняются только на стороне приема (drop_reason), для группировки не подходят
+GROUP_FIELDS: Dict[str, Tuple[str, pa.DataType]] = {
+    'src': ('src', pa.string()),
+    'dst': ('dst', pa.string()),
+    'app': ('app', pa.string()),
+    'window': ('window_start', pa.int64())
+}
+
+
+def group_name(fields: Sequence[str]) -> str:
+    """
+    Название пользовательской группировки: ('app', 'window') -> 'group_by_app_window'. Отдельный префикс не
+    пересекается с названиями встроенных уровней агрегации
+    """
+
+    return 'group_by_' + '_'.join(fields)
+
+
+def metric_fields(percentile_names: Sequence[str] = ()) -> List[Tuple[str, pa.DataType]]:
+    """
+    Колонки метрик группы: PDR, latency (дополнительные перцентили идут после latency_p95), SINR и RSSI
+    :param:
+        percentile_names: - названия дополнительных перцентилей ('p90', 'p99.9')
+    :return:
+        List[Tuple[str, pa.DataType]]: - названия и типы колонок
+    """
+
+    return [
+        ('tx_count', pa.int64()),
+        ('rx_count', pa.int64()),
+        ('pdr', pa.float64()),
+        ('latency_mean', pa.float64()),
+        ('latency_p50', pa.float64()),
+        ('latency_p95', pa.float64()),
+        *((f"latency_{name}", pa.float64()) for name in percentile_names),
+        ('latency_std', pa.float64()),
+        ('latency_count', pa.int64()),
+        ('sinr_avg', pa.float64()),
+        ('sinr_count', pa.float64()),
+        ('rssi_avg', pa.float64()),
+        ('rssi_count', pa.int64())
+    ]
+
+
+class ColumnarMetricsResult:
+    """
+    Итоговые метрики в колоночном виде: по одной таблице Arrow на уровень агрегации с колонками выгрузки
+    (ключ группы и metric_fields), без объекта ConnectionMetrics на каждую группу. Экспорт и сводка работают
+    с таблицами напрямую, а модель MetricsResult строится только по запросу (to_metrics_result) и нужна
+    для небольших результатов.
+
+    by_window - окна основного (наименьшего) размера. При нескольких размерах окна by_window_size содержит
+    таблицу каждого размера (размер окна в мкс -> таблица со схемой by_window, для основного размера - та же
+    by_window). by_group содержит таблицы пользовательских группировок (поля группировки -> таблица с колонками
+    ключа GROUP_FIELDS и metric_fields). Крупные окна и пользовательские группировки есть только в колоночном виде.
+
+    anomaly_error_rates - оценка вероятности ложного срабатывания для аномалий, найденных вероятностными
+    фильтрами (название аномалии -> вероятность), для точно посчитанных аномалий пуст
+    """
+
+    __slots__ = (
+        'overall', 'by_pair', 'by_app', 'by_window', 'by_window_size', 'by_group', 'anomalies', 'processed_cnt',
+        'success_cnt', 'percentile_names', 'anomaly_error_rates', '_metrics_result'
+    )
+
+    def __init__(self, overall: pa.Table, by_pair: pa.Table, by_app: pa.Table, by_window: pa.Table,
+                 anomalies: Dict[str, int], processed_cnt: int, success_cnt: int,
+                 percentile_names: Sequence[str] = (), by_window_size: Optional[Dict[int, pa.Table]] = None,
+                 by_group: Optional[Dict[Tuple[str, ...], pa.Table]] = None,
+                 anomaly_error_rates: Optional[Dict[str, float]] = None) -> None:
+        self.overall = overall
+        self.by_pair = by_pair
+        self.by_app = by_app
+        self.by_window = by_window
+        self.by_window_size = by_window_size or {}
+        self.by_group = by_group or {}
+        self.anomalies = anomalies
+        self.processed_cnt = processed_cnt
+        self.success_cnt = success_cnt
+        self.percentile_names = tuple(percentile_names)
+        self.anomaly_error_rates = anomaly_error_rates or {}
+        self._metrics_result: Optional['MetricsResult'] = None
+
+    @staticmethod
+    def schema(aggregation: str, percentile_names: Sequence[str] = (),
+               fields: Optional[Sequence[str]] = None) -> pa.Schema:
+        """
+        Схема таблицы уровня агрегации или пользовательской группировки (если переданы fields)
+        """
+
+        key_fields = KEY_FIELDS[aggregation] if fields is None else [GROUP_FIELDS[field] for field in fields]
+        return pa.schema([*key_fields, *metric_fields(percentile_names)])
+
+    @classmethod
+    def table(cls, aggregation: str, rows: List[Tuple], percentile_names: Sequence[str] = (),
+              fields: Optional[Sequence[str]] = None) -> pa.Table:
+        """
+        Таблица уровня агрегации по строкам (значения в порядке колонок схемы)
+        :param:
+            aggregation: - уровень агрегации ('overall', 'by_pair', 'by_app', 'by_window')
+            rows: - строки групп
+            percentile_names: - названия дополнительных перцентилей
+            fields: - поля пользовательской группировки, None - встроенный уровень агрегации
+        :return:
+            pa.Table: - таблица со схемой schema(aggregation, percentile_names, fields)
+        """
+
+        schema = cls.schema(aggregation, percentile_names, fields)
+        columns = list(zip(*rows)) if rows else [[] for _ in schema]
+
+        return pa.table(
+            [pa.array(column, type=field.type) for column, field in zip(columns, schema)], schema=schema
+        )
+
+    @staticmethod
+    def metric_values(metrics: ConnectionMetrics, percentile_names: Sequence[str] = ()) -> Tuple:
+        """
+        Значения колонок metric_fields для модели группы
+        """
+
+        pdr_metrics, latency_stats = metrics.pdr_metrics, metrics.latency_stats
+
+        return (
+            pdr_metrics.tx_count, pdr_metrics.rx_count, pdr_metrics.pdr,
+            latency_stats.mean, latency_stats.p50, latency_stats.p95,
+            *(latency_stats.percentiles[name] for name in percentile_names),
+            latency_stats.std, latency_stats.count,
+            metrics.sinr_avg, metrics.sinr_count, metrics.rssi_avg, metrics.rssi_count
+        )
+
+    @classmethod
+    def from_metrics_result(cls, metrics_result: 'MetricsResult') -> 'ColumnarMetricsResult':
+        """
+        Колоночное представление модели MetricsResult
+        """
+
+        names = tuple(metrics_result.overall.latency_stats.percentiles)
+        values = cls.metric_values
+
+        tables = {
+            'overall': [values(metrics_result.overall, names)],
+            'by_pair': [
+                (src, dst, metrics.app or 'N/A', *values(metrics, names))
+                for (src, dst), metrics in metrics_result.by_pair.items()
+            ],
+            'by_app': [(app, *values(metrics, names)) for app, metrics in metrics_result.by_app.items()],
+            'by_window': [
+                (window_start, src, dst, metrics.app or 'N/A', *values(metrics, names))
+                for (window_start, src, dst), metrics in metrics_result.by_window.items()
+            ]
+        }
+
+        result = cls(
+            **{name: cls.table(name, rows, names) for name, rows in tables.items()},
+            anomalies=metrics_result.anomalies.copy(),
+            processed_cnt=metrics_result.processed_cnt,
+            success_cnt=metrics_result.success_cnt,
+            percentile_names=names
+        )
+        result._metrics_result = metrics_result
+
+        return result
+
+    def to_metrics_result(self) -> 'MetricsResult':
+        """
+        Модель MetricsResult с ConnectionMetrics на каждую группу. Строится один раз при первом обращении, поэтому
+        для больших результатов лучше работать с таблицами
+        """
+
+        if self._metrics_result is None:
+            groups = {
+                name: [self._connection_metrics(name, row) for row in self._rows(getattr(self, name))]
+                for name in KEY_FIELDS
+            }
+
+            self._metrics_result = MetricsResult(
+                overall=groups['overall'][0][1],
+                by_pair={key[:2]: metrics for key, metrics in groups['by_pair']},
+                by_app={key[0]: metrics for key, metrics in groups['by_app']},
+                by_window={key[:3]: metrics for key, metrics in groups['by_window']},
+                anomalies=self.anomalies.copy(),
+                processed_cnt=self.processed_cnt,
+                success_cnt=self.success_cnt
+            )
+
+        return self._metrics_result
+
+    @staticmethod
+    def _rows(table: pa.Table):
+        """
+        Строки таблицы кортежами значений в порядке колонок
+        """
+
+        return zip(*(column.to_pylist() for column in table.columns))
+
+    def _connection_metrics(self, aggregation: str, row: Tuple) -> Tuple[Tuple, ConnectionMetrics]:
+        """
+        Ключ группы и модель ConnectionMetrics по строке таблицы уровня агрегации
+        """
+
+        key_size = len(KEY_FIELDS[aggregation])
+        key, values = row[:key_size], row[key_size:]
+
+        extra = len(self.percentile_names)
+        tx_count, rx_count, pdr, mean, p50, p95 = values[:6]
+        std, count, sinr_avg, sinr_count, rssi_avg, rssi_count = values[6 + extra:]
+
+        src, dst, app, window_start = "OVERALL", "OVERALL", None, None
+        if aggregation == 'by_app':
+            src, dst, app = "APP", key[0], key[0]
+        elif aggregation == 'by_pair':
+            src, dst = key[0], key[1]
+        elif aggregation == 'by_window':
+            window_start, src, dst = key[0], key[1], key[2]
+
+        return key, ConnectionMetrics(
+            src=src,
+            dst=dst,
+            pdr_metrics=PDRMetrics(tx_count=tx_count, rx_count=rx_count, pdr=pdr),
+            latency_stats=LatencyStats(
+                mean=mean, p50=p50, p95=p95, std=std, count=count,
+                percentiles=dict(zip(self.percentile_names, values[6:6 + extra]))
+            ),
+            app=app,
+            window_start=window_start,
+            sinr_avg=sinr_avg,
+            sinr_count=sinr_count,
+            rssi_avg=rssi_avg,
+            rssi_count=rssi_count
+        )
+
+    def summary(self) -> Dict:
+        """
+        Краткая сводка: PDR и средняя задержка по всему датасету, количество пар, приложений и окон
+        """
+
+        overall = self.overall.slice(0, 1).to_pylist()[0]
+
+        return {
+            'overall_pdr': overall['pdr'],
+            'overall_latency_mean': overall['latency_mean'],
+            'unique_pairs': self.by_pair.num_rows,
+            'unique_apps': self.by_app.num_rows,
+            'time_windows': self.by_window.num_rows
+        }
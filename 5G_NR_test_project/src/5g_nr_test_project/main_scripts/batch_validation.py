@@ -0,0 +1,337 @@
+import os
+import sys
+import enum
+import inspect
+import logging
+
+import numpy as np
+import pyarrow as pa
+import pyarrow.compute as pc
+
+from types import NoneType, UnionType
+from typing import Any, Callable, Dict, Iterator, List, Optional, Tuple, Type, Union, get_args, get_origin
+from pydantic import BaseModel, ValidationError
+
+current_dir = os.path.dirname(os.path.abspath(__file__))
+project_root = os.path.dirname(os.path.join(current_dir, '..', '..'))
+sys.path.insert(0, project_root)
+
+from configs.models import ParseResult, PacketRecord
+from support_scripts.symbol_table import SymbolTable
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_BATCH_SIZE = 65536
+
+# Строковые поля с небольшим набором значений, которые кодируются таблицей символов
+ENCODED_FIELDS = ('src', 'dst', 'app')
+
+_ARROW_TYPES = {
+    int: pa.int64(),
+    float: pa.float64(),
+    str: pa.string(),
+    bool: pa.bool_(),
+}
+
+# Строки, которые точно приводятся к числу. Все остальные строки (подчеркивания, 'inf', слишком длинные
+# целые и т.п.) не отбрасываются сразу, а уходят на проверку в pydantic
+_STRING_PATTERNS = {
+    pa.int64(): r'^[+-]?\d{1,18}$',
+    pa.float64(): r'^[+-]?(\d+\.?\d*|\.\d+)([eE][+-]?\d+)?$',
+}
+
+# Ограничения Field из FieldInfo.metadata по имени класса ограничения (Gt, MinLen и т.д. из annotated_types,
+# зависимости pydantic): атрибут с границей и векторная проверка колонки
+_CONSTRAINTS = {
+    'Gt': ('gt', pc.greater),
+    'Ge': ('ge', pc.greater_equal),
+    'Lt': ('lt', pc.less),
+    'Le': ('le', pc.less_equal),
+    'MinLen': ('min_length', lambda column, bound: pc.greater_equal(pc.utf8_length(column), bound)),
+    'MaxLen': ('max_length', lambda column, bound: pc.less_equal(pc.utf8_length(column), bound)),
+}
+
+
+class _FieldRule:
+    """
+    Правила проверки одной колонки, извлеченные из описания поля pydantic модели
+    """
+
+    def __init__(self, name: str, arrow_type: pa.DataType, required: bool) -> None:
+        self.name = name
+        self.arrow_type = arrow_type
+        self.required = required
+        self.allowed_values: Optional[pa.Array] = None
+        self.checks: List[Callable[[pa.ChunkedArray], pa.ChunkedArray]] = []
+        self.validators: List[Callable[[Any], Any]] = []
+        self.model_only = False
+
+
+class ColumnValidator:
+    """
+    Векторный валидатор колонок, который строится по описанию полей pydantic модели: типы колонок, обязательность,
+    ограничения Field (gt/ge/lt/le/min_length/max_length), допустимые значения Enum, field_validator'ы и
+    запрет лишних полей. Строки, которые не прошли векторную проверку или которые нельзя проверить векторно,
+    проверяются самой моделью, поэтому итоговый результат и сообщения об ошибках совпадают с построчной
+    валидацией, а новые поля модели учитываются без изменения этого кода
+    """
+
+    def __init__(self, model: Type[BaseModel]) -> None:
+        self.model = model
+        self.forbid_extra = model.model_config.get('extra') == 'forbid'
+        self.model_only = bool(model.__pydantic_decorators__.model_validators)
+        self.rules = [self._build_rule(name, field) for name, field in model.model_fields.items()]
+        self.schema = pa.schema([pa.field(rule.name, rule.arrow_type) for rule in self.rules])
+
+        self._attach_field_validators()
+
+    @staticmethod
+    def _build_rule(name: str, field: Any) -> _FieldRule:
+        """
+        Построение правил колонки по аннотации и метаданным поля
+        """
+
+        annotation = field.annotation
+        if get_origin(annotation) in (Union, UnionType):
+            args = [arg for arg in get_args(annotation) if arg is not NoneType]
+            annotation = args[0] if len(args) == 1 else Any
+
+        if isinstance(annotation, type) and issubclass(annotation, enum.Enum):
+            rule = _FieldRule(name, pa.string(), field.is_required())
+            rule.allowed_values = pa.array([str(member.value) for member in annotation])
+        elif annotation in _ARROW_TYPES:
+            rule = _FieldRule(name, _ARROW_TYPES[annotation], field.is_required())
+        else:
+            rule = _FieldRule(name, pa.string(), field.is_required())
+            rule.model_only = True
+
+        for constraint in field.metadata:
+            attr, check = _CONSTRAINTS.get(type(constraint).__name__, (None, None))
+            bound = getattr(constraint, attr, None) if attr else None
+            if bound is None:
+                rule.model_only = True
+                continue
+
+            rule.checks.append(lambda column, check=check, bound=bound: check(column, bound))
+
+        return rule
+
+    def _attach_field_validators(self) -> None:
+        """
+        Подключение field_validator'ов модели. Валидаторы в режиме 'after' с одним аргументом вызываются один
+        раз на каждое уникальное значение колонки, для остальных режимов строки проверяются моделью
+        """
+
+        rules = {rule.name: rule for rule in self.rules}
+
+        for decorator in self.model.__pydantic_decorators__.field_validators.values():
+            fields = rules.keys() if '*' in decorator.info.fields else decorator.info.fields
+            single_arg = len(inspect.signature(decorator.func).parameters) == 1
+
+            for name in fields:
+                if name not in rules:
+                    continue
+
+                if decorator.info.mode == 'after' and single_arg:
+                    rules[name].validators.append(decorator.func)
+                else:
+                    rules[name].model_only = True
+
+    def validate(self, table: pa.Table) -> Tuple[pa.RecordBatch, int]:
+        """
+        Проверка и приведение типов сразу для целых колонок
+        :param:
+            table: - таблица с сырыми колонками (строковыми или уже типизированными), null - отсутствующее значение
+        :return:
+            Tuple[pa.RecordBatch, int]: - пакет с корректными строками в исходном порядке и количество
+                                          отброшенных строк
+        """
+
+        num_rows = table.num_rows
+        if num_rows == 0:
+            return self.empty_batch(), 0
+
+        valid = np.ones(num_rows, dtype=bool)
+        needs_model = np.zeros(num_rows, dtype=bool)
+        columns = []
+
+        for rule in self.rules:
+            if rule.name in table.column_names:
+                column, uncoerced = self._coerce(table[rule.name], rule.arrow_type)
+                needs_model |= uncoerced
+            else:
+                column = pa.chunked_array([pa.nulls(num_rows, rule.arrow_type)])
+
+            present = _to_numpy(pc.is_valid(column))
+            if rule.required:
+                valid &= present
+
+            if rule.model_only or self.model_only:
+                needs_model |= present
+
+            column_valid = np.ones(num_rows, dtype=bool)
+            if rule.allowed_values is not None:
+                column_valid &= _to_numpy(pc.is_in(column, value_set=rule.allowed_values))
+            for check in rule.checks:
+                column_valid &= _to_numpy(check(column))
+            for validator in rule.validators:
+                column_valid &= self._apply_validator(validator, column)
+
+            valid &= column_valid | ~present
+            columns.append(column)
+
+        if self.forbid_extra:
+            for name in table.column_names:
+                if name not in self.schema.names:
+                    valid &= ~_to_numpy(pc.is_valid(table[name]))
+
+        fast_rows = valid & ~needs_model
+        model_rows = np.flatnonzero(~fast_rows)
+
+        coerced = pa.Table.from_arrays(columns, schema=self.schema)
+        if len(model_rows) == 0:
+            return _table_to_batch(coerced, self.schema), 0
+
+        accepted_rows, accepted_records = self._validate_with_model(table, model_rows)
+        result = coerced.filter(pa.array(fast_rows))
+
+        if accepted_records:
+            row_index = np.concatenate([np.flatnonzero(fast_rows), accepted_rows])
+            result = pa.concat_tables([result, pa.Table.from_pylist(accepted_records, schema=self.schema)])
+            result = result.take(pa.array(np.argsort(row_index, kind='stable')))
+
+        return _table_to_batch(result, self.schema), len(model_rows) - len(accepted_rows)
+
+    def _validate_with_model(self, table: pa.Table, rows: np.ndarray) -> Tuple[np.ndarray, List[Dict[str, Any]]]:
+        """
+        Проверка отдельных строк самой моделью: строки, которые модель принимает, возвращаются в приведенном виде,
+        а ошибки остальных логируются с исходными сообщениями pydantic
+        """
+
+        accepted_rows = []
+        accepted_records = []
+
+        for row_number, raw_row in zip(rows, table.take(pa.array(rows)).to_pylist()):
+            prepared_row = {key: value for key, value in raw_row.items() if value is not None}
+
+            try:
+                accepted_records.append(self.model(**prepared_row).model_dump())
+                accepted_rows.append(row_number)
+            except ValidationError as e:
+                logger.debug(f"Строка не прошла валидацию {self.model.__name__}: {e}")
+
+        return np.array(accepted_rows, dtype=np.int64), accepted_records
+
+    @staticmethod
+    def _coerce(column: pa.ChunkedArray, arrow_type: pa.DataType) -> Tuple[pa.ChunkedArray, np.ndarray]:
+        """
+        Приведение колонки к типу схемы
+        :return:
+            Tuple[pa.ChunkedArray, np.ndarray]: - приведенная колонка (неприводимые значения заменены на null)
+                                                  и маска строк, которые нужно проверить моделью
+        """
+
+        if column.type == arrow_type:
+            return column, np.zeros(len(column), dtype=bool)
+
+        if pa.types.is_string(column.type) and arrow_type in _STRING_PATTERNS:
+            parsable = pc.fill_null(pc.match_substring_regex(column, _STRING_PATTERNS[arrow_type]), True)
+            uncoerced = ~_to_numpy(parsable)
+            column = pc.if_else(parsable, column, pa.scalar(None, column.type))
+            return pc.cast(column, arrow_type), uncoerced
+
+        try:
+            return pc.cast(column, arrow_type), np.zeros(len(column), dtype=bool)
+        except (pa.ArrowInvalid, pa.ArrowNotImplementedError):
+            uncoerced = _to_numpy(pc.is_valid(column))
+            return pa.chunked_array([pa.nulls(len(column), arrow_type)]), uncoerced
+
+    @staticmethod
+    def _apply_validator(validator: Callable[[Any], Any], column: pa.ChunkedArray) -> np.ndarray:
+        """
+        Применяет field_validator к уникальным значениям колонки
+        :return:
+            np.ndarray: - маска строк, значения которых валидатор принял без изменений
+        """
+
+        unique_values = pc.unique(pc.drop_null(column))
+        accepted = []
+
+        for value in unique_values.to_pylist():
+            try:
+                accepted.append(validator(value) == value)
+            except (ValueError, AssertionError):
+                accepted.append(False)
+
+        accepted_values = unique_values.filter(pa.array(accepted, type=pa.bool_()))
+        return _to_numpy(pc.or_(pc.is_in(column, value_set=accepted_values), pc.is_null(column)))
+
+    def empty_batch(self) -> pa.RecordBatch:
+        """
+        Пустой пакет со схемой модели
+        """
+
+        return pa.RecordBatch.from_pylist([], schema=self.schema)
+
+
+def _to_numpy(mask: pa.ChunkedArray | pa.Array) -> np.ndarray:
+    """
+    Булева маска Arrow в массив NumPy, null считается False
+    """
+
+    return np.asarray(pc.fill_null(mask, False), dtype=bool)
+
+
+def _table_to_batch(table: pa.Table, schema: pa.Schema) -> pa.RecordBatch:
+    """
+    Склеивает таблицу в один RecordBatch
+    """
+
+    batches = table.combine_chunks().to_batches()
+    return batches[0] if batches else pa.RecordBatch.from_pylist([], schema=schema)
+
+
+PARSE_RESULT_VALIDATOR = ColumnValidator(ParseResult)
+PARSE_RESULT_SCHEMA = PARSE_RESULT_VALIDATOR.schema
+
+
+def records_to_batch(records: List[Dict[str, Any]]) -> pa.RecordBatch:
+    """
+    Собирает пакет Arrow из списка словарей (например, результатов ParseResult.model_dump())
+    :param:
+        records: - список записей в формате модели ParseResult
+    :return:
+        pa.RecordBatch: - пакет записей со схемой PARSE_RESULT_SCHEMA
+    """
+
+    return pa.RecordBatch.from_pylist(records, schema=PARSE_RESULT_SCHEMA)
+
+
+def validate_batch(table: pa.Table) -> Tuple[pa.RecordBatch, int]:
+    """
+    Векторная проверка правил модели ParseResult сразу для целых колонок
+    :param:
+        table: - таблица с колонками модели ParseResult (строковыми или типизированными)
+    :return:
+        Tuple[pa.RecordBatch, int]: - пакет только с корректными строками и количество отброшенных строк
+    """
+
+    return PARSE_RESULT_VALIDATOR.validate(table)
+
+
+def iter_packet_records(batch: pa.RecordBatch, symbols: Optional[SymbolTable] = None) -> Iterator[PacketRecord]:
+    """
+    Преобразует пакет записей в поток компактных записей PacketRecord без создания моделей pydantic
+    :param:
+        batch: - пакет записей со схемой PARSE_RESULT_SCHEMA
+        symbols: - таблица символов. Если передана, поля src, dst и app кодируются в целые коды векторно
+    :return:
+        Iterator[PacketRecord]: - генератор записей в порядке строк пакета
+    """
+
+    columns = [
+        symbols.encode_array(batch.column(name)).tolist()
+        if symbols is not None and name in ENCODED_FIELDS else batch.column(name).to_pylist()
+        for name in PacketRecord.__slots__
+    ]
+    return map(PacketRecord, *columns)
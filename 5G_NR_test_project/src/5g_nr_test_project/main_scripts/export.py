@@ -2,16 +2,17 @@ import os
 import sys
 import csv
 import pandas as pd
+import pyarrow as pa
 import logging
 
 from pathlib import Path
-from typing import Dict
+from typing import Dict, Union
 
 current_dir = os.path.dirname(os.path.abspath(__file__))
 project_root = os.path.dirname(os.path.join(current_dir, '..', '..'))
 sys.path.insert(0, project_root)
 
-from configs.models import ConnectionMetrics, MetricsResult
+from configs.models import MetricsResult, ColumnarMetricsResult, group_name
 
 logger = logging.getLogger(__name__)
 
@@ -26,140 +27,60 @@ class ComprehensiveMetricsExporter:
         self.output_dir.mkdir(parents=True, exist_ok=True)
         logger.info(f"Класс по экспорту данных был инициализирован: {output_dir}")
 
-    def export_metrics(self, metrics_result: MetricsResult, base_filename: str) -> Dict[str, Path]:
+    def export_metrics(self, metrics_result: Union[MetricsResult, ColumnarMetricsResult],
+                       base_filename: str) -> Dict[str, Path]:
         """
-        Экспортирует все группы метрик в отдельные файлы
+        Экспортирует все группы метрик в отдельные файлы. Таблицы ColumnarMetricsResult уже содержат колонки
+        выгрузки и сохраняются без промежуточных словарей, MetricsResult сначала переводится в колоночный вид
         """
 
+        if isinstance(metrics_result, MetricsResult):
+            metrics_result = ColumnarMetricsResult.from_metrics_result(metrics_result)
+
         exported_files = {}
 
-        self._export_overall(metrics_result.overall, base_filename, exported_files)
-        self._export_pairs(metrics_result.by_pair, base_filename, exported_files)
-        self._export_apps(metrics_result.by_app, base_filename, exported_files)
-        self._export_windows(metrics_result.by_window, base_filename, exported_files)
+        self._export_table(metrics_result.overall, f"{base_filename}_overall", exported_files, required=True)
+        self._export_table(metrics_result.by_pair, f"{base_filename}_pairs", exported_files)
+        self._export_table(metrics_result.by_app, f"{base_filename}_apps", exported_files)
+        self._export_table(metrics_result.by_window, f"{base_filename}_windows", exported_files)
+        for window_size, table in metrics_result.by_window_size.items():
+            self._export_table(table, f"{base_filename}_windows_{window_size}", exported_files)
+        for fields, table in metrics_result.by_group.items():
+            self._export_table(table, f"{base_filename}_{group_name(fields)}", exported_files)
         self._export_summary(metrics_result, base_filename, exported_files)
 
         logger.info(f"Экспорт данных завершился")
         return exported_files
 
-    def _export_overall(self, overall_metrics: ConnectionMetrics, base_filename: str, exported_files: Dict[str, Path]):
-        """
-        Экспорт общих метрик
-        """
-
-        data = [{
-            'tx_count': overall_metrics.pdr_metrics.tx_count,
-            'rx_count': overall_metrics.pdr_metrics.rx_count,
-            'pdr': overall_metrics.pdr_metrics.pdr,
-            'latency_mean': overall_metrics.latency_stats.mean,
-            'latency_p50': overall_metrics.latency_stats.p50,
-            'latency_p95': overall_metrics.latency_stats.p95,
-            'latency_std': overall_metrics.latency_stats.std,
-            'latency_count': overall_metrics.latency_stats.count,
-            'sinr_avg': overall_metrics.sinr_avg,
-            'sinr_count': overall_metrics.sinr_count
-        }]
-
-        df = pd.DataFrame(data)
-        self._save_dataframe(df, f"{base_filename}_overall", exported_files)
-
-    def _export_pairs(self, pairs_metrics: Dict, base_filename: str, exported_files: Dict[str, Path]):
+    def _export_table(self, table: pa.Table, name: str, exported_files: Dict[str, Path],
+                      required: bool = False) -> None:
         """
-        Экспорт метрик по парам src-dst
+        Экспорт таблицы одного уровня агрегации. Пустые таблицы пар, приложений и окон не сохраняются
         """
 
-        data = []
-        for (src, dst), metrics in pairs_metrics.items():
-            data.append({
-                'src': src,
-                'dst': dst,
-                'app': metrics.app or 'N/A',
-                'tx_count': metrics.pdr_metrics.tx_count,
-                'rx_count': metrics.pdr_metrics.rx_count,
-                'pdr': metrics.pdr_metrics.pdr,
-                'latency_mean': metrics.latency_stats.mean,
-                'latency_p50': metrics.latency_stats.p50,
-                'latency_p95': metrics.latency_stats.p95,
-                'latency_std': metrics.latency_stats.std,
-                'latency_count': metrics.latency_stats.count,
-                'sinr_avg': metrics.sinr_avg,
-                'sinr_count': metrics.sinr_count
-            })
-
-        if data:
-            df = pd.DataFrame(data)
-            self._save_dataframe(df, f"{base_filename}_pairs", exported_files)
-
-    def _export_apps(self, apps_metrics: Dict, base_filename: str, exported_files: Dict[str, Path]):
-        """
-        Экспорт метрик по приложениям
-        """
+        if table.num_rows or required:
+            self._save_dataframe(table.to_pandas(), name, exported_files)
 
-        data = []
-        for app, metrics in apps_metrics.items():
-            data.append({
-                'app': app,
-                'tx_count': metrics.pdr_metrics.tx_count,
-                'rx_count': metrics.pdr_metrics.rx_count,
-                'pdr': metrics.pdr_metrics.pdr,
-                'latency_mean': metrics.latency_stats.mean,
-                'latency_p50': metrics.latency_stats.p50,
-                'latency_p95': metrics.latency_stats.p95,
-                'latency_std': metrics.latency_stats.std,
-                'latency_count': metrics.latency_stats.count,
-                'sinr_avg': metrics.sinr_avg,
-                'sinr_count': metrics.sinr_count
-            })
-
-        if data:
-            df = pd.DataFrame(data)
-            self._save_dataframe(df, f"{base_filename}_apps", exported_files)
-
-    def _export_windows(self, windows_metrics: Dict, base_filename: str, exported_files: Dict[str, Path]):
-        """
-        Экспорт метрик по временным окнам
-        """
-
-        data = []
-        for (window_start, src, dst), metrics in windows_metrics.items():
-            data.append({
-                'window_start': window_start,
-                'src': src,
-                'dst': dst,
-                'app': metrics.app or 'N/A',
-                'tx_count': metrics.pdr_metrics.tx_count,
-                'rx_count': metrics.pdr_metrics.rx_count,
-                'pdr': metrics.pdr_metrics.pdr,
-                'latency_mean': metrics.latency_stats.mean,
-                'latency_p50': metrics.latency_stats.p50,
-                'latency_p95': metrics.latency_stats.p95,
-                'latency_std': metrics.latency_stats.std,
-                'latency_count': metrics.latency_stats.count,
-                'sinr_avg': metrics.sinr_avg,
-                'sinr_count': metrics.sinr_count
-            })
-
-        if data:
-            df = pd.DataFrame(data)
-            self._save_dataframe(df, f"{base_filename}_windows", exported_files)
-
-    def _export_summary(self, metrics_result: MetricsResult, base_filename: str, exported_files: Dict[str, Path]):
+    def _export_summary(self, metrics_result: ColumnarMetricsResult, base_filename: str,
+                        exported_files: Dict[str, Path]):
         """
         Экспорт сводной статистики и аномалий
         """
 
+        overall = metrics_result.overall.slice(0, 1).to_pylist()[0]
+
         summary_data = [{
             'total_processed': metrics_result.processed_cnt,
             'successfully_matched': metrics_result.success_cnt,
             'success_rate': metrics_result.success_cnt / metrics_result.processed_cnt if metrics_result.processed_cnt > 0 else 0,
-            'overall_pdr': metrics_result.overall.pdr_metrics.pdr,
-            'overall_tx_count': metrics_result.overall.pdr_metrics.tx_count,
-            'overall_rx_count': metrics_result.overall.pdr_metrics.rx_count,
-            'overall_sinr_avg': metrics_result.overall.sinr_avg,
-            'overall_sinr_count': metrics_result.overall.sinr_count,
-            'unique_src_dst_pairs': len(metrics_result.by_pair),
-            'unique_apps': len(metrics_result.by_app),
-            'time_windows': len(metrics_result.by_window)
+            'overall_pdr': overall['pdr'],
+            'overall_tx_count': overall['tx_count'],
+            'overall_rx_count': overall['rx_count'],
+            'overall_sinr_avg': overall['sinr_avg'],
+            'overall_sinr_count': overall['sinr_count'],
+            'unique_src_dst_pairs': metrics_result.by_pair.num_rows,
+            'unique_apps': metrics_result.by_app.num_rows,
+            'time_windows': metrics_result.by_window.num_rows
         }]
 
         summary_df = pd.DataFrame(summary_data)
@@ -171,6 +92,11 @@ class ComprehensiveMetricsExporter:
             'count': count
         } for anomaly_type, count in metrics_result.anomalies.items()]
 
+        # Для аномалий, найденных вероятностными фильтрами, - оценка вероятности ложного срабатывания
+        if metrics_result.anomaly_error_rates:
+            for row in anomalies_data:
+                row['false_positive_rate'] = metrics_result.anomaly_error_rates.get(row['anomaly_type'])
+
         if anomalies_data:
             anomalies_df = pd.DataFrame(anomalies_data)
             self._save_dataframe(anomalies_df, f"{base_filename}_anomalies", exported_files)
@@ -196,7 +122,8 @@ class ComprehensiveMetricsExporter:
             raise
 
 
-def export_comprehensive(metrics_result: MetricsResult, output_dir: Path, filename: str = "metrics") -> Dict[str, Path]:
+def export_comprehensive(metrics_result: Union[MetricsResult, ColumnarMetricsResult], output_dir: Path,
+                         filename: str = "metrics") -> Dict[str, Path]:
     """
     Комплексный экспорт всех метрик
     """
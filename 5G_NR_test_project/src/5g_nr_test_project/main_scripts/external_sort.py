@@ -0,0 +1,293 @@
+import os
+import sys
+import logging
+import tempfile
+
+import numpy as np
+import pyarrow as pa
+import pyarrow.compute as pc
+
+from pathlib import Path
+from typing import Any, Iterator, List, Optional, Sequence, Union
+
+current_dir = os.path.dirname(os.path.abspath(__file__))
+project_root = os.path.dirname(os.path.join(current_dir, '..', '..'))
+sys.path.insert(0, project_root)
+
+from main_scripts.processor import MetricsCalculator
+from support_scripts.symbol_table import SymbolTable
+
+logger = logging.getLogger(__name__)
+
+# Количество строк в одном блоке файла серии: при слиянии в памяти находится текущий блок каждой серии
+RUN_BLOCK_ROWS = 8192
+
+# Колонка с номером записи во входном потоке: по ней восстанавливается исходный порядок записей одного pkt_id
+SEQ_FIELD = 'seq'
+
+# Параметры MetricsCalculator, при которых результат зависит от порядка записей по ts_us, а не только от порядка
+# записей внутри pkt_id
+ORDER_DEPENDENT_OPTIONS = ('match_timeout_us', 'allowed_lateness_us', 'sorted_input')
+
+SIZE_UNITS = {'': 1, 'B': 1, 'K': 1 << 10, 'M': 1 << 20, 'G': 1 << 30, 'T': 1 << 40}
+
+
+def parse_memory_size(value: str) -> int:
+    """
+    Размер памяти из строки: число байт или число с суффиксом K, M, G, T (степени 1024, например '512M', '1.5G')
+    :param:
+        value: - строка размера
+    :return:
+        int: - размер в байтах
+    """
+
+    text = value.strip().upper().removesuffix('IB').removesuffix('B')
+    number, unit = (text[:-1], text[-1]) if text and text[-1] in SIZE_UNITS else (text, '')
+
+    try:
+        size = int(float(number) * SIZE_UNITS[unit])
+    except ValueError:
+        raise ValueError(f"Некорректный размер памяти: {value}") from None
+
+    if size <= 0:
+        raise ValueError(f"Размер памяти должен быть положительным: {value}")
+    return size
+
+
+def pkt_id_keys(column: Union[pa.Array, pa.ChunkedArray]) -> np.ndarray:
+    """
+    Ключи сортировки по pkt_id: байтовые строки UTF-8 фиксированной длины, порядок которых совпадает с
+    побайтовым порядком строк
+    """
+
+    return pc.cast(column, pa.binary()).to_numpy(zero_copy_only=False).astype(np.bytes_)
+
+
+class _RunReader:
+    """
+    Текущий блок записей одной серии, упорядоченной по (pkt_id, seq), и поток следующих блоков файла серии
+    """
+
+    __slots__ = ('reader', 'next_block', 'table', 'keys')
+
+    def __init__(self, path: Path) -> None:
+        self.reader = pa.ipc.open_file(pa.memory_map(str(path)))
+        self.next_block = 0
+        self.table = self.reader.schema.empty_table()
+        self.keys = pkt_id_keys(pa.array([], pa.string()))
+        if self.has_next:
+            self.extend()
+
+    @property
+    def has_next(self) -> bool:
+        return self.next_block < self.reader.num_record_batches
+
+    @property
+    def exhausted(self) -> bool:
+        return not len(self.keys) and not self.has_next
+
+    def extend(self) -> None:
+        """
+        Добавление к текущему блоку следующего блока файла
+        """
+
+        batch = self.reader.get_batch(self.next_block)
+        self.next_block += 1
+        self.table = pa.concat_tables([self.table, pa.Table.from_batches([batch])])
+        self.keys = np.concatenate([self.keys, pkt_id_keys(batch.column('pkt_id'))])
+
+    def take_before(self, bound: Optional[bytes]) -> pa.Table:
+        """
+        Записи блока с pkt_id меньше bound (все записи блока, если bound не задан). Пока оставшиеся записи
+        блока относятся к одному pkt_id, а в файле есть следующие блоки, они добавляются к текущему, чтобы
+        граница следующего шага была больше
+        """
+
+        size = len(self.keys) if bound is None else int(np.searchsorted(self.keys, bound, side='left'))
+        part = self.table.slice(0, size)
+        self.table, self.keys = self.table.slice(size), self.keys[size:]
+
+        while self.has_next and (not len(self.keys) or self.keys[0] == self.keys[-1]):
+            self.extend()
+
+        return part
+
+
+class ExternalSortMetrics:
+    """
+    Расчет метрик с внешней сортировкой по pkt_id для входных данных больше памяти, в которых tx и rx одного
+    пакета далеко друг от друга (неупорядоченные выгрузки, объединенные захваты).
+
+    Записи потока накапливаются в памяти и при достижении половины memory_limit сортируются по (pkt_id, номер
+    записи в потоке) и сбрасываются на диск серией - файлом Arrow IPC из блоков по RUN_BLOCK_ROWS строк. В конце
+    серии сливаются (k-way merge) по pkt_id: на каждом шаге граница - наименьший из последних pkt_id текущих
+    блоков серий, у которых есть следующие блоки, поэтому записи с pkt_id меньше границы во всех сериях собраны
+    полностью. Они передаются в MetricsCalculator одним пакетом в исходном порядке внутри каждого pkt_id, после
+    чего ожидающие записи калькулятора освобождаются (release_pending). Сопоставление tx и rx и классификация
+    аномалий (duplicate_tx, rx_without_tx, direction_mismatch, negative_latency, duplicate_rx) зависят только от
+    порядка записей одного pkt_id, поэтому результат совпадает с обработкой потока в памяти с точностью до
+    округления сумм, а ожидающих записей в памяти не больше, чем записей в одном пакете слияния.
+
+    Если серий больше, чем помещается текущих блоков в половину memory_limit, они предварительно сливаются
+    группами в более длинные серии. Не ограничиваются лимитом накопители групп и окон: для большого количества
+    пар лучше использовать latency_backend = 'sketch'. Параметры, при которых результат зависит от порядка записей
+    по ts_us (ORDER_DEPENDENT_OPTIONS), не поддерживаются. Ожидающих записей в итоговом калькуляторе нет, поэтому его
+    состояние не предназначено для объединения с состояниями других частей потока
+    """
+
+    def __init__(self, memory_limit: int, temp_dir: Optional[Union[str, Path]] = None,
+                 symbols: Optional[SymbolTable] = None, **options: Any) -> None:
+        """
+        :param:
+            memory_limit: - ограничение памяти под записи в байтах
+            temp_dir: - директория для временных файлов серий (по умолчанию системная)
+            symbols: - таблица символов калькулятора (по умолчанию новая)
+            options: - параметры MetricsCalculator (window_size, latency_backend, engine и т.д.)
+        """
+
+        if memory_limit <= 0:
+            raise ValueError(f"Ограничение памяти должно быть положительным: {memory_limit}")
+        unsupported = [name for name in ORDER_DEPENDENT_OPTIONS if options.get(name)]
+        if unsupported:
+            raise ValueError(f"Внешняя сортировка не поддерживает параметры {', '.join(unsupported)}")
+
+        self.memory_limit = memory_limit
+        self.calculator = MetricsCalculator(symbols=symbols, **options)
+
+        self._temp_dir = tempfile.TemporaryDirectory(prefix='nr_metrics_runs_', dir=temp_dir)
+        self.runs: List[Path] = []
+        self._run_count = 0
+        self._buffer: List[pa.RecordBatch] = []
+        self._buffered_bytes = 0
+        self._rows = 0
+        self._row_bytes = 0.0
+
+    @property
+    def temp_path(self) -> Path:
+        return Path(self._temp_dir.name)
+
+    def process_batch(self, batch: pa.RecordBatch) -> None:
+        """
+        Добавление пакета записей со схемой ParseResult. При достижении половины memory_limit накопленные записи
+        сбрасываются на диск серией (вторая половина нужна под сортировку)
+        """
+
+        if not batch.num_rows:
+            return
+
+        seq = pa.array(np.arange(self._rows, self._rows + batch.num_rows, dtype=np.int64))
+        self._buffer.append(batch.append_column(SEQ_FIELD, seq))
+        self._rows += batch.num_rows
+        self._buffered_bytes += self._buffer[-1].nbytes
+        self._row_bytes = max(self._row_bytes, self._buffer[-1].nbytes / batch.num_rows)
+
+        if self._buffered_bytes >= self.memory_limit // 2:
+            self._spill()
+
+    def _sorted_buffer(self) -> pa.Table:
+        """
+        Накопленные записи, отсортированные по (pkt_id, seq): номера записей в буфере возрастают, поэтому
+        достаточно устойчивой сортировки по pkt_id
+        """
+
+        table = pa.Table.from_batches(self._buffer)
+        self._buffer, self._buffered_bytes = [], 0
+
+        order = np.argsort(pkt_id_keys(table.column('pkt_id')), kind='stable')
+        return table.take(pa.array(order))
+
+    def _write_run(self, tables: Iterator[pa.Table], schema: pa.Schema) -> Path:
+        """
+        Запись упорядоченных по (pkt_id, seq) записей в файл новой серии
+        """
+
+        path = self.temp_path / f'run_{self._run_count:05d}.arrow'
+        self._run_count += 1
+        with pa.ipc.new_file(str(path), schema) as writer:
+            for table in tables:
+                writer.write_table(table, max_chunksize=RUN_BLOCK_ROWS)
+
+        return path
+
+    def _spill(self) -> None:
+        table = self._sorted_buffer()
+        path = self._write_run(iter([table]), table.schema)
+        self.runs.append(path)
+        logger.info(f"Серия {path.name}: {table.num_rows} записей сброшено на диск")
+
+    @staticmethod
+    def _merge_runs(paths: Sequence[Path]) -> Iterator[pa.Table]:
+        """
+        Слияние серий по pkt_id: каждая выдаваемая таблица содержит все записи своих pkt_id, упорядоченные по
+        (pkt_id, seq)
+        """
+
+        readers = [_RunReader(path) for path in paths]
+
+        while readers:
+            bounds = [reader.keys[-1] for reader in readers if reader.has_next]
+            bound = min(bounds) if bounds else None
+
+            parts = [reader.take_before(bound) for reader in readers]
+            parts = [part for part in parts if part.num_rows]
+            readers = [reader for reader in readers if not reader.exhausted]
+
+            if not parts:
+                continue
+
+            table = pa.concat_tables(parts)
+            keys = pkt_id_keys(table.column('pkt_id'))
+            order = np.lexsort((table.column(SEQ_FIELD).to_numpy(), keys))
+            yield table.take(pa.array(order))
+
+    def _fan_in(self) -> int:
+        """
+        Количество серий, текущие блоки которых помещаются в половину memory_limit
+        """
+
+        return max(2, int(self.memory_limit // (2 * RUN_BLOCK_ROWS * max(self._row_bytes, 1.0))))
+
+    def _sorted_tables(self) -> Iterator[pa.Table]:
+        """
+        Все записи потока группами целых pkt_id в порядке (pkt_id, seq)
+        """
+
+        if not self.runs:
+            if self._buffer:
+                yield self._sorted_buffer()
+            return
+
+        if self._buffer:
+            self._spill()
+
+        runs, self.runs = self.runs, []
+        fan_in = self._fan_in()
+
+        while len(runs) > fan_in:
+            logger.info(f"Промежуточное слияние {len(runs)} серий группами по {fan_in}")
+            schema = pa.ipc.open_file(pa.memory_map(str(runs[0]))).schema
+            merged = [self._write_run(self._merge_runs(runs[start:start + fan_in]), schema)
+                      for start in range(0, len(runs), fan_in)]
+
+            for path in runs:
+                path.unlink()
+            runs = merged
+
+        yield from self._merge_runs(runs)
+
+    def result(self) -> MetricsCalculator:
+        """
+        Слияние серий, сопоставление tx и rx по группам pkt_id и удаление временных файлов
+        :return:
+            MetricsCalculator: - калькулятор с результатами всего потока
+        """
+
+        try:
+            for table in self._sorted_tables():
+                for batch in table.drop_columns([SEQ_FIELD]).combine_chunks().to_batches():
+                    self.calculator.process_batch(batch)
+                self.calculator.release_pending()
+        finally:
+            self._temp_dir.cleanup()
+
+        return self.calculator
@@ -0,0 +1,119 @@
+import os
+import sys
+import logging
+
+import numpy as np
+
+from typing import Callable, Dict, Hashable, List, Sequence, Tuple
+
+current_dir = os.path.dirname(os.path.abspath(__file__))
+project_root = os.path.dirname(os.path.join(current_dir, '..', '..'))
+sys.path.insert(0, project_root)
+
+from configs.models import GROUP_FIELDS, group_name
+from main_scripts.batch_validation import ENCODED_FIELDS
+
+logger = logging.getLogger(__name__)
+
+# Встроенные уровни агрегации с накопителями групп и поля записи, по которым они группируются
+BUILTIN_GROUPINGS: Dict[str, Tuple[str, ...]] = {
+    'by_pair': ('src', 'dst'),
+    'by_app': ('app',)
+}
+
+
+def normalize_group_by(group_by: Sequence[Sequence[str]]) -> Tuple[Tuple[str, ...], ...]:
+    """
+    Проверка пользовательских группировок: поля должны быть из GROUP_FIELDS и не повторяться внутри группировки,
+    повторяющиеся группировки отбрасываются
+    :param:
+        group_by: - группировки, каждая - последовательность полей записи (например, [['src'], ['app', 'window']])
+    :return:
+        Tuple[Tuple[str, ...], ...]: - группировки без повторов в порядке перечисления
+    """
+
+    groupings = []
+    for fields in group_by:
+        fields = (fields,) if isinstance(fields, str) else tuple(fields)
+
+        if not fields:
+            raise ValueError("Группировка должна содержать хотя бы одно поле")
+        unknown = [field for field in fields if field not in GROUP_FIELDS]
+        if unknown:
+            raise ValueError(f"Неизвестные поля группировки {unknown}, доступны: {', '.join(GROUP_FIELDS)}")
+        if len(set(fields)) != len(fields):
+            raise ValueError(f"Поля группировки не должны повторяться: {fields}")
+
+        if fields not in groupings:
+            groupings.append(fields)
+
+    return tuple(groupings)
+
+
+def groupings_of(group_by: Sequence[Tuple[str, ...]]) -> Dict[str, Tuple[str, ...]]:
+    """
+    Все уровни агрегации с накопителями групп (кроме overall): встроенные и пользовательские
+    """
+
+    return {**BUILTIN_GROUPINGS, **{group_name(fields): fields for fields in group_by}}
+
+
+def _key_expression(fields: Sequence[str]) -> str:
+    """
+    Выражение ключа группы над записью record: одно поле - значение поля, несколько - кортеж значений
+    """
+
+    values = ['window' if field == 'window' else f'record.{field}' for field in fields]
+    return values[0] if len(values) == 1 else f"({', '.join(values)})"
+
+
+def compile_group_accumulators(groupings: Dict[str, Tuple[str, ...]], accumulated_data: Dict,
+                               window_size: int) -> Callable:
+    """
+    Сборка одной функции, которая по записи tx возвращает накопители всех групп, в которые попадает пакет:
+    overall и по одному накопителю на каждый уровень агрегации. Ключи всех уровней вычисляются в одном теле
+    функции без цикла по уровням и без обращения к описанию группировок на каждую запись. Исходный код
+    функции собирается из названий полей, которые проверены по GROUP_FIELDS
+    :param:
+        groupings: - уровни агрегации и их поля (groupings_of)
+        accumulated_data: - накопители калькулятора ('overall' и словари групп уровней)
+        window_size: - размер окна для поля window
+    :return:
+        Callable: - функция record -> кортеж накопителей групп
+    """
+
+    namespace = {'overall': accumulated_data['overall'], 'window_size': window_size}
+    lines = ['def group_accumulators(record):']
+
+    if any('window' in fields for fields in groupings.values()):
+        lines.append('    window = record.ts_us // window_size * window_size')
+
+    accumulators = ['overall']
+    for index, (name, fields) in enumerate(groupings.items()):
+        namespace[f'groups_{index}'] = accumulated_data[name]
+        accumulators.append(f'groups_{index}[{_key_expression(fields)}]')
+
+    lines.append(f"    return {', '.join(accumulators)}")
+
+    exec('\n'.join(lines), namespace)
+    return namespace['group_accumulators']
+
+
+def group_columns(columns: Dict[str, np.ndarray], fields: Sequence[str], window_size: int) -> List[np.ndarray]:
+    """
+    Колонки пакета записей, по которым группируется уровень агрегации в движке vectorized
+    """
+
+    return [columns['ts_us'] // window_size * window_size if field == 'window' else columns[field] for field in fields]
+
+
+def convert_group_key(fields: Sequence[str], key: Hashable, convert: Callable) -> Hashable:
+    """
+    Перевод ключа группы другого калькулятора в коды этого: переводятся только поля, закодированные таблицей
+    символов (src, dst, app)
+    """
+
+    if len(fields) == 1:
+        return convert(key) if fields[0] in ENCODED_FIELDS else key
+
+    return tuple(convert(value) if field in ENCODED_FIELDS else value for field, value in zip(fields, key))
@@ -0,0 +1,150 @@
+import os
+import sys
+import logging
+
+import numpy as np
+import pyarrow as pa
+
+from pathlib import Path
+from typing import Iterator, List, Optional, Sequence, Tuple
+
+current_dir = os.path.dirname(os.path.abspath(__file__))
+project_root = os.path.dirname(os.path.join(current_dir, '..', '..'))
+sys.path.insert(0, project_root)
+
+from main_scripts.parser_definition import ParserDefinition, get_parser_factory
+from main_scripts.test_base_parser import TestParser
+from support_scripts.progress_bar import ProgressBar
+
+logger = logging.getLogger(__name__)
+
+# Количество строк источника в одном блоке при слиянии: в памяти одновременно находится не больше одного
+# блока на файл, поэтому блок меньше, чем при обработке одного файла
+DEFAULT_MERGE_BATCH_SIZE = 8192
+
+
+def collect_input_files(paths: Sequence[Path],
+                        factory: Optional[ParserDefinition] = None) -> List[Tuple[Path, TestParser]]:
+    """
+    Список входных файлов с парсерами, выбранными фабрикой. Директории раскрываются в свои файлы (без
+    вложенных директорий) в порядке имен, файлы без подходящего парсера в директориях пропускаются
+    :param:
+        paths: - пути к файлам и директориям в порядке перечисления
+        factory: - фабрика парсеров (по умолчанию get_parser_factory())
+    :return:
+        List[Tuple[Path, TestParser]]: - файлы и их парсеры
+    """
+
+    factory = factory if factory is not None else get_parser_factory()
+    sources = []
+
+    for path in map(Path, paths):
+        if not path.is_dir():
+            sources.append((path, factory.get_parser(path)))
+            continue
+
+        for file_path in sorted(path.iterdir()):
+            if not file_path.is_file() or file_path.name.startswith('.'):
+                continue
+            try:
+                sources.append((file_path, factory.get_parser(file_path)))
+            except ValueError:
+                logger.info(f"Файл {file_path} пропущен: нет подходящего парсера")
+
+    if not sources:
+        raise ValueError(f"Не найдено входных файлов: {', '.join(map(str, paths))}")
+
+    return sources
+
+
+class _SourceBuffer:
+    """
+    Текущий блок записей одного файла, упорядоченный по ts_us, и поток следующих блоков
+    """
+
+    __slots__ = ('batches', 'batch', 'ts_us')
+
+    def __init__(self, batches: Iterator[pa.RecordBatch]) -> None:
+        self.batches = batches
+        self.batch: Optional[pa.RecordBatch] = None
+        self.ts_us: Optional[np.ndarray] = None
+        self.refill()
+
+    def refill(self) -> None:
+        """
+        Переход к следующему блоку файла. Блок, записи которого идут не по возрастанию ts_us, сортируется
+        (устойчиво), чтобы из него можно было брать записи префиксами
+        """
+
+        self.batch = next(self.batches, None)
+        if self.batch is None:
+            self.ts_us = None
+            return
+
+        self.ts_us = self.batch.column('ts_us').to_numpy(zero_copy_only=False)
+        if np.any(self.ts_us[1:] < self.ts_us[:-1]):
+            order = np.argsort(self.ts_us, kind='stable')
+            self.batch, self.ts_us = self.batch.take(pa.array(order)), self.ts_us[order]
+
+    def take_until(self, bound: int) -> pa.RecordBatch:
+        """
+        Записи блока с ts_us <= bound. Если блок закончился, загружается следующий
+        """
+
+        size = int(np.searchsorted(self.ts_us, bound, side='right'))
+        if size == len(self.ts_us):
+            batch = self.batch
+            self.refill()
+            return batch
+
+        batch = self.batch.slice(0, size)
+        self.batch, self.ts_us = self.batch.slice(size), self.ts_us[size:]
+        return batch
+
+
+def merge_batches(sources: Sequence[Tuple[Path, TestParser]],
+                  batch_size: int = DEFAULT_MERGE_BATCH_SIZE) -> Iterator[pa.RecordBatch]:
+    """
+    Ленивое слияние нескольких источников по ts_us (k-way merge): каждый файл читается пакетным режимом своего
+    парсера, и в памяти хранится только текущий блок каждого файла. На каждом шаге граница - наименьший из
+    последних ts_us текущих блоков: записи всех блоков с ts_us не больше границы гарантированно не встретятся
+    позже в файле с этой границей, поэтому выдаются одним пакетом, отсортированным по ts_us (при равных ts_us - в
+    порядке файлов), а блок файла с границей загружается заново. Если каждый файл упорядочен по ts_us, итоговый
+    поток тоже упорядочен; записи файла не по порядку остаются не по порядку только между его блоками
+    :param:
+        sources: - файлы и их парсеры (collect_input_files)
+        batch_size: - количество строк источника в одном блоке каждого файла
+    :return:
+        Iterator[pa.RecordBatch]: - генератор пакетов со схемой ParseResult в порядке ts_us
+    """
+
+    progress_bar = ProgressBar.create_parser_progress_bar([path for path, _ in sources])
+
+    try:
+        buffers = [
+            _SourceBuffer(parser.parse_byte_range(
+                path, parser._data_start_offset(path), None, batch_size, progress_bar
+            ))
+            for path, parser in sources
+        ]
+
+        while True:
+            buffers = [buffer for buffer in buffers if buffer.batch is not None]
+            if len(buffers) <= 1:
+                break
+
+            bound = min(int(buffer.ts_us[-1]) for buffer in buffers)
+            parts = [buffer.take_until(bound) for buffer in buffers]
+
+            table = pa.Table.from_batches([part for part in parts if part.num_rows])
+            ts_us = np.concatenate([part.column('ts_us').to_numpy(zero_copy_only=False) for part in parts])
+            yield table.take(pa.array(np.argsort(ts_us, kind='stable'))).combine_chunks().to_batches()[0]
+
+        # Последний непрочитанный файл выдается без слияния
+        for buffer in buffers:
+            while buffer.batch is not None:
+                yield buffer.batch
+                buffer.refill()
+
+    finally:
+        progress_bar.close()
@@ -0,0 +1,122 @@
+import os
+import sys
+import copy
+import logging
+
+import pyarrow as pa
+
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor, Future
+from pathlib import Path
+from typing import Deque, Dict, Iterator, List, Optional, Tuple
+
+current_dir = os.path.dirname(os.path.abspath(__file__))
+project_root = os.path.dirname(os.path.join(current_dir, '..', '..'))
+sys.path.insert(0, project_root)
+
+from main_scripts.batch_validation import DEFAULT_BATCH_SIZE
+from main_scripts.test_base_parser import TestParser
+from support_scripts.progress_bar import ProgressBar
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_RANGE_SIZE = 64 * 1024 * 1024
+
+
+def split_byte_ranges(file_path: Path, start: int, range_size: int) -> List[Tuple[int, int]]:
+    """
+    Делит файл на диапазоны байт, границы которых выровнены по началу строк
+    :param:
+        file_path: - путь к файлу
+        start: - смещение первой записи (после заголовка CSV)
+        range_size: - желаемый размер одного диапазона в байтах
+    :return:
+        List[Tuple[int, int]]: - список диапазонов [start, end) в порядке следования в файле
+    """
+
+    file_size = file_path.stat().st_size
+    boundaries = [start]
+
+    with open(file_path, 'rb') as file:
+        offset = start + range_size
+        while offset < file_size:
+            file.seek(offset - 1)
+            file.readline()
+            boundary = file.tell()
+
+            if boundary >= file_size:
+                break
+
+            boundaries.append(boundary)
+            offset = boundary + range_size
+
+    boundaries.append(file_size)
+    return [(begin, end) for begin, end in zip(boundaries, boundaries[1:]) if begin < end]
+
+
+def _parse_range(parser: TestParser, file_path: Path, start: int, end: int,
+                 batch_size: int) -> Tuple[List[pa.RecordBatch], Dict[str, int]]:
+    """
+    Обработчик одного диапазона в отдельном процессе
+    :return:
+        Tuple[List[pa.RecordBatch], Dict[str, int]]: - пакеты записей диапазона и статистика парсера
+    """
+
+    parser.reset_stats()
+    parser._data_start_offset(file_path)
+    batches = list(parser.parse_byte_range(file_path, start, end, batch_size))
+
+    return batches, parser.get_stats()
+
+
+def parse_parallel(parser: TestParser, file_path: Path, workers: int, batch_size: int = DEFAULT_BATCH_SIZE,
+                   range_size: int = DEFAULT_RANGE_SIZE) -> Iterator[List[pa.RecordBatch]]:
+    """
+    Параллельный парсинг одного файла: файл делится на диапазоны байт по границам строк, диапазоны разбираются
+    в пуле процессов пакетным режимом парсера, а результаты возвращаются в порядке следования диапазонов в
+    файле, поэтому итоговый поток записей совпадает с последовательным запуском. Одновременно в работе
+    находится не больше 2 * workers диапазонов, чтобы готовые, но еще не выданные результаты не копились в памяти
+    :param:
+        parser: - парсер, выбранный фабрикой для файла. В него же добавляется статистика всех процессов
+        file_path: - путь к файлу
+        workers: - количество процессов
+        batch_size: - количество строк в одном блоке пакетного режима
+        range_size: - размер одного диапазона в байтах
+    :return:
+        Iterator[List[pa.RecordBatch]]: - генератор результатов по диапазонам, в порядке диапазонов
+    """
+
+    start = parser._data_start_offset(file_path)
+    ranges = split_byte_ranges(file_path, start, range_size)
+    logger.info(f"Файл {file_path} разделен на {len(ranges)} диапазонов для {workers} процессов")
+
+    progress_bar = ProgressBar.create_bytes_progress_bar(file_path.stat().st_size - start)
+    worker_parser = copy.copy(parser)
+
+    try:
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            pending: Deque[Tuple[Future, int]] = deque()
+            range_iter = iter(ranges)
+
+            def submit_next() -> None:
+                next_range: Optional[Tuple[int, int]] = next(range_iter, None)
+                if next_range is not None:
+                    begin, end = next_range
+                    future = executor.submit(_parse_range, worker_parser, file_path, begin, end, batch_size)
+                    pending.append((future, end - begin))
+
+            for _ in range(2 * workers):
+                submit_next()
+
+            while pending:
+                future, range_bytes = pending.popleft()
+                batches, stats = future.result()
+                submit_next()
+
+                parser.merge_stats(stats)
+                progress_bar.update(range_bytes)
+
+                yield batches
+
+    finally:
+        progress_bar.close()
@@ -1,9 +1,16 @@
+import io
 import json
 import csv
 import sys
 import os
 
-from typing import Dict, Set, Iterable, Any
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.csv as pa_csv
+import pyarrow.json as pa_json
+
+from functools import reduce
+from typing import Dict, Set, Iterable, List, Any
 from pathlib import Path
 from pydantic import ValidationError
 
@@ -13,6 +20,7 @@ sys.path.insert(0, project_root)
 
 from configs.models import ParseResult, EventType
 from main_scripts.test_base_parser import TestParser
+from main_scripts.batch_validation import PARSE_RESULT_SCHEMA, records_to_batch, validate_batch
 from support_scripts.progress_bar import ProgressBar
 
 
@@ -40,23 +48,11 @@ class NJsonParser(TestParser):
                 for i, line in enumerate(file, 1):
                     self._increment_processed_cnt()
 
-                    if not line.strip():
+                    record = self._parse_json_line(line)
+                    if record is None:
                         continue
 
-                    try:
-                        raw_data = json.loads(line.strip())
-                        record = ParseResult(**raw_data)
-                        yield record
-
-                    except json.JSONDecodeError as e:
-                        self._increment_error_cnt()
-                        continue
-                    except ValidationError as e:
-                        self._increment_validation_error_cnt()
-                        continue
-                    except Exception:
-                        self._increment_error_cnt()
-                        continue
+                    yield record
 
                     progress_bar.update(1)
 
@@ -65,6 +61,59 @@ class NJsonParser(TestParser):
         except Exception as e:
             raise RuntimeError(f"Ошибка в момент парсинга данных: {e}")
 
+    def _parse_json_line(self, line: str | bytes) -> ParseResult | None:
+        """
+        Парсинг одной строки NDJSON в модель данных ParseResult с валидацией pydantic
+        :param:
+            line: - строка источника
+        :return:
+            ParseResult | None - модель данных или None, если строка пустая или некорректная
+        """
+
+        if not line.strip():
+            return None
+
+        try:
+            raw_data = json.loads(line.strip())
+            return ParseResult(**raw_data)
+
+        except json.JSONDecodeError as e:
+            self._increment_error_cnt()
+        except ValidationError as e:
+            self._increment_validation_error_cnt()
+        except Exception:
+            self._increment_error_cnt()
+
+        return None
+
+    def _parse_lines_batch(self, lines: List[bytes]) -> pa.RecordBatch:
+        """
+        Блок строк разбирается читателем pyarrow по явной схеме и проверяется по колонкам. Если в блоке есть
+        строки, которые pyarrow не может разобрать по схеме (битый JSON, лишние поля, значения другого типа),
+        весь блок обрабатывается построчно через _parse_json_line, чтобы результат совпадал с parse_data_stream
+        """
+
+        self._increment_processed_cnt(len(lines))
+        data = b''.join(lines)
+
+        try:
+            table = pa_json.read_json(
+                io.BytesIO(data),
+                read_options=pa_json.ReadOptions(block_size=max(len(data), 1 << 20)),
+                parse_options=pa_json.ParseOptions(
+                    explicit_schema=PARSE_RESULT_SCHEMA,
+                    unexpected_field_behavior='error'
+                )
+            )
+        except (pa.ArrowInvalid, pa.ArrowNotImplementedError):
+            records = (self._parse_json_line(line) for line in lines)
+            return records_to_batch([record.model_dump() for record in records if record is not None])
+
+        batch, invalid_cnt = validate_batch(table)
+        self._increment_validation_error_cnt(invalid_cnt)
+
+        return batch
+
     def validate_file_format(self, file_path: Path) -> bool:
         if super().validate_file_format(file_path) == False:
             return False
@@ -88,6 +137,8 @@ class CsvParser(TestParser):
         super().__init__()
         self.delimiter = delimiter
         self.encoding = encoding
+        self._header_line = b''
+        self._fieldnames: List[str] = []
 
     @property
     def supported_extensions(self) -> Set[str]:
@@ -150,6 +201,93 @@ class CsvParser(TestParser):
             self._increment_error_cnt()
             return None
 
+    def _data_start_offset(self, file_path: Path) -> int:
+        """
+        Считывает заголовок CSV, который нужен для разбора каждого блока строк
+        """
+
+        with open(file_path, 'rb') as file:
+            self._header_line = file.readline()
+            start = file.tell()
+
+        header = self._header_line.decode(self.encoding)
+        self._fieldnames = next(csv.reader([header], delimiter=self.delimiter), [])
+
+        if self._header_line and not self._header_line.endswith(b'\n'):
+            self._header_line += b'\n'
+
+        return start
+
+    def _parse_lines_batch(self, lines: List[bytes]) -> pa.RecordBatch:
+        """
+        Блок строк разбирается читателем pyarrow как строковые колонки, после чего значения очищаются так же,
+        как в _prepare_row, а приведение к типам и проверка выполняются по колонкам валидатором. Если блок не
+        удается разобрать (например, из-за неверного количества полей), он обрабатывается построчно через
+        _parse_csv_row
+        """
+
+        try:
+            table = pa_csv.read_csv(
+                io.BytesIO(self._header_line + b''.join(lines)),
+                read_options=pa_csv.ReadOptions(encoding=self.encoding),
+                parse_options=pa_csv.ParseOptions(delimiter=self.delimiter),
+                convert_options=pa_csv.ConvertOptions(
+                    column_types={name: pa.string() for name in self._fieldnames},
+                    strings_can_be_null=False,
+                    quoted_strings_can_be_null=False
+                )
+            )
+        except (pa.ArrowInvalid, pa.ArrowNotImplementedError):
+            return self._parse_lines_by_row(lines)
+
+        self._increment_processed_cnt(table.num_rows)
+
+        batch, invalid_cnt = validate_batch(self._prepare_table(table))
+        self._increment_error_cnt(invalid_cnt)
+
+        return batch
+
+    def _prepare_table(self, table: pa.Table) -> pa.Table:
+        """
+        Векторный аналог _prepare_row: пропускает полностью пустые строки, обрезает пробелы и превращает пустые
+        значения в null. Приведение к типам и проверка выполняются валидатором колонок
+        :param:
+            table: - таблица блока со строковыми колонками
+        :return:
+            pa.Table: - подготовленная таблица
+        """
+
+        not_empty = reduce(pc.or_, [pc.not_equal(table[name], '') for name in table.column_names])
+        table = table.filter(not_empty)
+
+        columns = []
+        for name in table.column_names:
+            trimmed = pc.utf8_trim_whitespace(table[name])
+            columns.append(pc.if_else(pc.equal(trimmed, ''), pa.scalar(None, pa.string()), trimmed))
+
+        return pa.Table.from_arrays(columns, names=table.column_names)
+
+    def _parse_lines_by_row(self, lines: List[bytes]) -> pa.RecordBatch:
+        """
+        Построчная обработка блока с той же логикой, что и в parse_data_stream
+        """
+
+        text = b''.join(lines).decode(self.encoding)
+        reader = csv.DictReader(io.StringIO(text, newline=''), fieldnames=self._fieldnames, delimiter=self.delimiter)
+
+        records = []
+        for i, row in enumerate(reader, 2):
+            self._increment_processed_cnt()
+
+            if not any(row.values()):
+                continue
+
+            record = self._parse_csv_row(row, i)
+            if record is not None:
+                records.append(record.model_dump())
+
+        return records_to_batch(records)
+
     def _prepare_row(self, row: Dict[str, str]) -> Dict[str, Any]:
         prepared_data = {}
 
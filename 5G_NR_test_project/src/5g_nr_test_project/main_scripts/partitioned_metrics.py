@@ -0,0 +1,206 @@
+import os
+import sys
+import queue
+import logging
+import multiprocessing
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+
+from typing import Any, Dict, List, Optional
+
+current_dir = os.path.dirname(os.path.abspath(__file__))
+project_root = os.path.dirname(os.path.join(current_dir, '..', '..'))
+sys.path.insert(0, project_root)
+
+from main_scripts.batch_validation import ENCODED_FIELDS
+from main_scripts.processor import MetricsCalculator
+from support_scripts.symbol_table import SymbolTable
+
+logger = logging.getLogger(__name__)
+
+# Количество пакетов, которые могут ждать обработки в очереди одного процесса
+QUEUE_SIZE = 8
+
+# Период проверки, что процесс секции жив, пока очередь заполнена
+PUT_TIMEOUT = 1.0
+
+
+def partition_of(pkt_ids: pa.Array | pa.ChunkedArray, partitions: int) -> np.ndarray:
+    """
+    Номер секции для каждого pkt_id. Используется стабильный хэш pandas, а не встроенный hash, который
+    отличается между процессами и запусками, поэтому разбиение воспроизводимо
+    :param:
+        pkt_ids: - колонка pkt_id
+        partitions: - количество секций
+    :return:
+        np.ndarray: - номера секций
+    """
+
+    values = np.asarray(pkt_ids.to_numpy(zero_copy_only=False), dtype=object)
+    return (pd.util.hash_array(values) % np.uint64(partitions)).astype(np.intp)
+
+
+def _run_partition(inbox: multiprocessing.Queue, outbox: multiprocessing.Queue, index: int,
+                   options: Dict[str, Any]) -> None:
+    """
+    Процесс одной секции: обрабатывает пакеты своей секции до получения None и возвращает калькулятор
+    """
+
+    try:
+        calculator = MetricsCalculator(symbols=SymbolTable(), **options)
+
+        while True:
+            item = inbox.get()
+            if item is None:
+                break
+
+            batch, watermarks, symbols = item
+            for symbol in symbols:
+                calculator.symbols.encode(symbol)
+
+            calculator.process_batch(batch, watermarks)
+
+        outbox.put((index, calculator, None))
+
+    except Exception as e:
+        logger.error(f"Ошибка в процессе секции {index}: {e}")
+        outbox.put((index, None, str(e)))
+
+
+class PartitionedMetricsCalculator:
+    """
+    Параллельный расчет метрик: записи распределяются по секциям по хэшу pkt_id, каждую секцию обрабатывает свой
+    процесс со своим MetricsCalculator. tx и rx одного пакета всегда попадают в одну секцию и в ней сохраняют
+    исходный порядок, поэтому сопоставление и аномалии совпадают с последовательным расчетом, а накопители
+    секций в конце объединяются через MetricsCalculator.merge.
+
+    Строки src, dst и app каждого пакета сначала кодируются общей таблицей символов, и процессы получают новые
+    строки таблицы в том же порядке, поэтому коды во всех секциях совпадают с кодами итогового калькулятора и
+    при объединении не переводятся.
+
+    При заданных match_timeout_us или sorted_input вместе с записями секции передается watermark всего потока на
+    момент каждой записи, поэтому ожидающие записи вытесняются, а записи не по порядку находятся так же, как при
+    последовательном расчете
+    """
+
+    def __init__(self, workers: int, symbols: Optional[SymbolTable] = None, **options: Any) -> None:
+        """
+        :param:
+            workers: - количество процессов (секций)
+            symbols: - таблица символов итогового калькулятора (по умолчанию новая)
+            options: - параметры MetricsCalculator (window_size, latency_backend, match_timeout_us и т.д.)
+        """
+
+        if workers < 1:
+            raise ValueError(f"Количество процессов должно быть положительным: {workers}")
+
+        # Бюджет памяти ожидающих записей (pending_memory_limit) задан на весь расчет и делится между секциями
+        if options.get('pending_memory_limit') is not None:
+            options = {**options, 'pending_memory_limit': max(1, options['pending_memory_limit'] // workers)}
+
+        self.workers = workers
+        self.symbols = symbols if symbols is not None else SymbolTable()
+        self.options = options
+        self.watermark: Optional[int] = None
+
+        self._outbox = multiprocessing.Queue()
+        self._inboxes: List[multiprocessing.Queue] = []
+        self._sent_symbols = [0] * workers
+        self._processes: List[multiprocessing.Process] = []
+
+        for index in range(workers):
+            inbox = multiprocessing.Queue(maxsize=QUEUE_SIZE)
+            process = multiprocessing.Process(
+                target=_run_partition, args=(inbox, self._outbox, index, options), daemon=True
+            )
+            process.start()
+
+            self._inboxes.append(inbox)
+            self._processes.append(process)
+
+        logger.info(f"Запущено {workers} процессов расчета метрик")
+
+    def process_batch(self, batch: pa.RecordBatch) -> None:
+        """
+        Распределение пакета записей по секциям
+        :param:
+            batch: - пакет записей со схемой ParseResult
+        """
+
+        if batch.num_rows == 0:
+            return
+
+        watermarks = None
+        if self.options.get('match_timeout_us') is not None or self.options.get('sorted_input'):
+            watermarks = np.maximum.accumulate(batch.column('ts_us').to_numpy(zero_copy_only=False))
+            if self.watermark is not None:
+                watermarks = np.maximum(watermarks, self.watermark)
+            self.watermark = int(watermarks[-1])
+
+        for name in ENCODED_FIELDS:
+            self.symbols.encode_array(batch.column(name))
+
+        partitions = partition_of(batch.column('pkt_id'), self.workers)
+        order = np.argsort(partitions, kind='stable')
+        bounds = np.cumsum(np.bincount(partitions, minlength=self.workers))[:-1]
+
+        for index, rows in enumerate(np.split(order, bounds)):
+            if len(rows) == 0:
+                continue
+
+            symbols = self.symbols.symbols[self._sent_symbols[index]:]
+            self._sent_symbols[index] = len(self.symbols)
+
+            partition_watermarks = watermarks[rows] if watermarks is not None else None
+            self._put(index, (batch.take(pa.array(rows)), partition_watermarks, symbols))
+
+    def _put(self, index: int, item) -> None:
+        """
+        Передача задания процессу секции с проверкой, что процесс не завершился с ошибкой
+        """
+
+        while True:
+            try:
+                self._inboxes[index].put(item, timeout=PUT_TIMEOUT)
+                return
+            except queue.Full:
+                if not self._processes[index].is_alive():
+                    raise RuntimeError(f"Процесс секции {index} завершился до окончания обработки")
+
+    def result(self) -> MetricsCalculator:
+        """
+        Завершение процессов и объединение их калькуляторов
+        :return:
+            MetricsCalculator: - калькулятор со всеми накопителями, аномалиями и ожидающими записями
+        """
+
+        for index in range(self.workers):
+            self._put(index, None)
+
+        calculators: List[Optional[MetricsCalculator]] = [None] * self.workers
+        for _ in range(self.workers):
+            index, calculator, error = self._outbox.get()
+            if error is not None:
+                raise RuntimeError(f"Ошибка в процессе секции {index}: {error}")
+            calculators[index] = calculator
+
+        for process in self._processes:
+            process.join()
+
+        # Коды секций совпадают с общей таблицей, поэтому первая секция становится основой результата
+        merged = calculators[0]
+        merged.symbols = self.symbols
+        for calculator in calculators[1:]:
+            merged.merge(calculator)
+
+        # Каждая секция вытесняла ожидающие записи только до watermark своей последней записи, поэтому после
+        # объединения вытесняется то, что последовательный расчет вытеснил бы по watermark всего потока
+        if self.watermark is not None:
+            merged.watermark = self.watermark
+            if merged.match_timeout_us is not None:
+                merged._evict_expired(self.watermark - merged.match_timeout_us)
+
+        logger.info(f"Объединены результаты {self.workers} процессов расчета метрик")
+        return merged
@@ -1,65 +1,231 @@
 import os
 import sys
+import heapq
+import pickle
 import logging
 
+import numpy as np
+import pyarrow as pa
+import pyarrow.compute as pc
+
 from pathlib import Path
-from collections import defaultdict
-from typing import Dict, List, Tuple, Optional, DefaultDict
+from itertools import chain
+from collections import defaultdict, deque
+from typing import Dict, List, Tuple, Optional, DefaultDict, Union, Set, Sequence, Deque
 
 current_dir = os.path.dirname(os.path.abspath(__file__))
 project_root = os.path.dirname(os.path.join(current_dir, '..', '..'))
 sys.path.insert(0, project_root)
 
-from configs.models import ParseResult
-from configs.models import LatencyStats, PDRMetrics, ConnectionMetrics, MetricsResult, AggregationType
+from configs.models import ParseResult, PacketRecord, MatchedPair
+from configs.models import LatencyStats, MetricsResult, AggregationType
+from configs.models import ColumnarMetricsResult, KEY_FIELDS, group_name
+from configs.interfaces import WindowSinkInterface
 from main_scripts.export import export_comprehensive
+from main_scripts.batch_validation import iter_packet_records, ENCODED_FIELDS
+from main_scripts.group_by import normalize_group_by, groupings_of, compile_group_accumulators, group_columns
+from main_scripts.group_by import convert_group_key
+from main_scripts.vectorized_engine import VectorizedMatcher, BatchMatches, batch_columns, group_rows
+from main_scripts.vectorized_engine import group_moments, group_percentiles, split_by_group
+from support_scripts.quantile_sketch import LatencySketch, DEFAULT_RELATIVE_ACCURACY
+from support_scripts.running_stats import RunningStats
+from support_scripts.pending_table import PendingPacketTable
+from support_scripts.seen_filter import SeenFilter
+from support_scripts.spill_store import PendingSpillStore, SpillingMap, ENTRY_BYTES, EXPIRY_ENTRY_BYTES
+from support_scripts.symbol_table import SymbolTable
+from support_scripts.window_store import WindowPairStore, FIELD_INDEX
 
 logger = logging.getLogger(__name__)
 
+# Формат файла состояния MetricsCalculator.save_state
+STATE_FORMAT = 'nr_metrics_state'
+STATE_VERSION = 8
+
+# Количество обновлений окон построчной обработки, после которого закрытые окна выгружаются в window_sink
+WINDOW_EMIT_UPDATES = 4096
+
+# Размер очередей вытеснения при pending_memory_limit (в записях бюджета), после которого из них удаляются элементы
+# записей, которых нет в памяти. Бюджет учитывает столько элементов очереди на каждую запись
+EXPIRY_QUEUE_FACTOR = 2
+
 
 class MetricsCalculator:
     """
     Класс для реализации подсчета метрик
     """
 
-    def __init__(self, window_size: int = 1000000) -> None:
+    LATENCY_BACKENDS = ('exact', 'sketch')
+    PENDING_STORES = ('dict', 'array')
+    ENGINES = ('record', 'vectorized')
+
+    def __init__(self, window_size: Union[int, Sequence[int]] = 1000000, latency_backend: str = 'exact',
+                 latency_accuracy: float = DEFAULT_RELATIVE_ACCURACY, match_timeout_us: Optional[int] = None,
+                 pending_store: str = 'dict', symbols: Optional[SymbolTable] = None, engine: str = 'record',
+                 percentiles: Sequence[float] = (), allowed_lateness_us: Optional[int] = None,
+                 window_sink: Optional[WindowSinkInterface] = None, emit_corrections: bool = False,
+                 window_hop_us: Optional[int] = None, group_by: Sequence[Sequence[str]] = (),
+                 duplicate_filter_error_rate: Optional[float] = None, sorted_input: bool = False,
+                 pending_memory_limit: Optional[int] = None) -> None:
         """
         :param:
-            window_size: - размер временного окна для агрегации
+            window_size: - размер временного окна для агрегации или несколько размеров. Накопители ведутся только
+                           для наименьшего размера, а более крупные окна (кратные наименьшему) собираются при
+                           расчете итоговых метрик объединением мелких ячеек (WindowPairStore.rollup)
+            latency_backend: - способ хранения задержек: 'exact' (полный список значений) или 'sketch'
+                               (скетч квантилей с ограниченной памятью и относительной ошибкой latency_accuracy)
+            latency_accuracy: - относительная точность p50/p95 для latency_backend = 'sketch'
+            match_timeout_us: - время ожидания пары в мкс. Ожидающие tx и rx, которые старше watermark (максимальное
+                                увиденное ts_us) на это время, вытесняются: tx без пары считается потерянным (lost_tx),
+                                rx без пары - rx_without_tx. None - записи ожидают пару до конца обработки
+            pending_store: - хранилище ожидающих tx: 'dict' (словарь записей) или 'array' (PendingPacketTable на
+                             массивах NumPy, меньше 64 байт на ожидающий пакет)
+            symbols: - общая с парсером таблица символов. Если передана, записи несут целые коды src, dst и app,
+                       накопители группируются по кодам, а строки восстанавливаются только в get_metrics_result
+            engine: - способ обработки: 'record' (построчная обработка process_record) или 'vectorized' (колоночное
+                      сопоставление целых пакетов в process_batch через сортировки NumPy). Движок vectorized
+                      всегда работает на кодах таблицы символов и не поддерживает match_timeout_us и pending_store
+            percentiles: - дополнительные перцентили задержки в процентах (например, 90, 99, 99.9), которые
+                           считаются вместе с p50 и p95 и попадают в LatencyStats.percentiles
+            allowed_lateness_us: - допустимое опоздание записей в мкс. Если задано, окно закрывается, когда watermark
+                                   проходит window_start + window_size + allowed_lateness_us: его строки передаются
+                                   в window_sink и освобождаются, а записи, попавшие в закрытое окно, считаются
+                                   late_records. None - окна хранятся до конца обработки
+            window_sink: - приемник закрытых окон, обязателен при заданном allowed_lateness_us
+            emit_corrections: - передавать опоздавшие записи в window_sink строками-поправками (correction = True)
+                                при следующем закрытии окон, иначе они учитываются только в метриках
+                                пар и приложений
+            window_hop_us: - шаг скользящих (hopping) окон в мкс. Если задан, накопители ведутся по панелям
+                             размером в шаг, а окно каждого размера из window_size (кратного шагу) собирается
+                             объединением своих панелей при расчете итоговых метрик (WindowPairStore.hop), поэтому
+                             запись обновляет одну панель при любом перекрытии окон. None - окна не перекрываются
+            group_by: - дополнительные группировки по полям записи tx (src, dst, app, window),
+                        например [['src'], ['app', 'window']]. Каждая группировка ведет свои накопители и выгружается
+                        отдельной таблицей (ColumnarMetricsResult.by_group). Ключи всех уровней агрегации
+                        вычисляются одной собранной функцией (compile_group_accumulators), поэтому запись
+                        обновляет все группы за один вызов
+            duplicate_filter_error_rate: - вероятность ложного срабатывания фильтров увиденных pkt_id
+                                           (SeenFilter). Если задана, повторный rx с тем же pkt_id считается
+                                           duplicate_rx и не сопоставляется, а при заданном match_timeout_us
+                                           дубликаты tx находятся и после вытеснения первого tx. Память фильтра -
+                                           несколько байт на уникальный pkt_id при 0.1%, а не ожидающая запись.
+                                           Оценка вероятности ложного срабатывания выводится рядом с аномалиями
+                                           (anomaly_error_rates). None - duplicate_rx не считается
+            sorted_input: - признак того, что записи упорядочены по ts_us. Пока порядок не нарушен, окна при
+                            заданных allowed_lateness_us и match_timeout_us закрываются, как только в них не может
+                            прийти обновление (через min(allowed_lateness_us, match_timeout_us) после конца окна),
+                            а записи с ts_us меньше watermark учитываются в аномалии out_of_order_records.
+                            После первой такой записи калькулятор возвращается к общему режиму. Очереди вытеснения
+                            по match_timeout_us работают как FIFO, пока порядок не нарушен, и без этого признака
+            pending_memory_limit: - бюджет памяти ожидающих tx и rx в байтах (оценка по ENTRY_BYTES на запись).
+                                    Самые старые ожидающие записи сверх бюджета переносятся во временную базу
+                                    sqlite3 и ищутся в ней при промахе (PendingSpillStore), счетчики обращений
+                                    выводятся в get_curr_stats. При заданном match_timeout_us в бюджет входят
+                                    очереди вытеснения и отметки сопоставленных tx (EXPIRY_ENTRY_BYTES на элемент,
+                                    EXPIRY_QUEUE_FACTOR элементов на запись): они хранятся только для записей в
+                                    памяти, а записи на диске вытесняются запросом по времени к базе.
+                                    None - все ожидающие записи хранятся в памяти
         """
 
-        self.window_size = window_size
+        if latency_backend not in self.LATENCY_BACKENDS:
+            raise ValueError(f"Неизвестный способ хранения задержек: {latency_backend}")
+
+        if pending_store not in self.PENDING_STORES:
+            raise ValueError(f"Неизвестное хранилище ожидающих tx: {pending_store}")
+
+        if match_timeout_us is not None and match_timeout_us < 0:
+            raise ValueError(f"Время ожидания пары не может быть отрицательным: {match_timeout_us}")
+
+        if any(not 0 <= percentile <= 100 for percentile in percentiles):
+            raise ValueError(f"Перцентили должны быть в диапазоне [0, 100]: {percentiles}")
+
+        if engine not in self.ENGINES:
+            raise ValueError(f"Неизвестный способ обработки: {engine}")
+
+        window_sizes = (window_size,) if isinstance(window_size, (int, np.integer)) else tuple(sorted(set(window_size)))
+        if not window_sizes or window_sizes[0] <= 0:
+            raise ValueError(f"Размер окна должен быть положительным: {window_size}")
+        if any(size % window_sizes[0] for size in window_sizes):
+            raise ValueError(f"Размеры окон должны быть кратны наименьшему размеру: {window_size}")
+
+        if window_hop_us is not None:
+            if window_hop_us <= 0:
+                raise ValueError(f"Шаг окна должен быть положительным: {window_hop_us}")
+            if any(size % window_hop_us for size in window_sizes):
+                raise ValueError(f"Размеры окон должны быть кратны шагу {window_hop_us}: {window_size}")
+            if allowed_lateness_us is not None:
+                raise ValueError("Закрытие окон по allowed_lateness_us не поддерживает скользящие окна")
+
+        if allowed_lateness_us is not None:
+            if len(window_sizes) > 1:
+                raise ValueError("Закрытие окон по allowed_lateness_us поддерживает только один размер окна")
+            if allowed_lateness_us < 0:
+                raise ValueError(f"Допустимое опоздание не может быть отрицательным: {allowed_lateness_us}")
+            if window_sink is None:
+                raise ValueError("Для закрытия окон по allowed_lateness_us нужен window_sink")
+
+        if duplicate_filter_error_rate is not None and not 0 < duplicate_filter_error_rate < 1:
+            raise ValueError(f"Вероятность ложного срабатывания должна быть в интервале (0, 1): "
+                             f"{duplicate_filter_error_rate}")
+
+        if pending_memory_limit is not None:
+            if pending_memory_limit <= 0:
+                raise ValueError(f"Бюджет памяти ожидающих записей должен быть положительным: {pending_memory_limit}")
+            if engine != 'record' or pending_store != 'dict':
+                raise ValueError("pending_memory_limit поддерживается только движком record с pending_store = 'dict'")
+
+        group_by = normalize_group_by(group_by)
+
+        if engine == 'vectorized':
+            if match_timeout_us is not None or pending_store != 'dict':
+                raise ValueError("Движок vectorized не поддерживает match_timeout_us и pending_store")
+            if symbols is None:
+                symbols = SymbolTable()
+
+        self.window_size = int(window_sizes[0])
+        self.window_sizes = tuple(int(size) for size in window_sizes)
+        self.window_hop_us = None if window_hop_us is None else int(window_hop_us)
+        self.group_by = group_by
+        self._groupings = groupings_of(group_by)
+        self.latency_backend = latency_backend
+        self.latency_accuracy = latency_accuracy
+        self.match_timeout_us = match_timeout_us
+        self.pending_store = pending_store
+        self.symbols = symbols
+        self.engine = engine
+        self.percentiles = tuple(percentiles)
+        self.allowed_lateness_us = allowed_lateness_us
+        self.window_sink = window_sink
+        self.emit_corrections = emit_corrections
+        self.duplicate_filter_error_rate = duplicate_filter_error_rate
+        self.sorted_input = sorted_input
+        self.pending_memory_limit = pending_memory_limit
 
         self._reset_accums()
 
-        logger.info(f"MetricsCalculator был инициализирован с window_size = {self.window_size}")
+        logger.info(
+            f"MetricsCalculator был инициализирован с window_size = {', '.join(map(str, self.window_sizes))}, "
+            f"window_hop_us = {self.window_hop_us}, latency_backend = {self.latency_backend}, "
+            f"match_timeout_us = {self.match_timeout_us}, pending_store = {self.pending_store}, engine = {self.engine}"
+        )
 
     def _reset_accums(self) -> None:
         """
         Обновление предагрегированных данных
         """
 
-        self.tx_records: Dict[str, Dict] = {}
-        self.rx_records: DefaultDict[str, List[Dict]] = defaultdict(list)
+        self._new_pending()
+        self._matcher = VectorizedMatcher() if self.engine == 'vectorized' else None
 
-        self.accumulated_data = {
-            'overall': {
-                'tx': 0,
-                'rx': 0,
-                'latency': [],
-                'sinr_sum': 0.0,
-                'sinr_count': 0
-            },
-            'by_pair': defaultdict(
-                lambda: {'tx': 0, 'rx': 0, 'latency': [], 'sinr_sum': 0.0, 'sinr_count': 0}
-            ),
-            'by_app': defaultdict(
-                lambda: {'tx': 0, 'rx': 0, 'latency': [], 'sinr_sum': 0.0, 'sinr_count': 0}
-            ),
-            'by_window': defaultdict(
-                lambda: {'tx': 0, 'rx': 0, 'latency': [], 'sinr_sum': 0.0, 'sinr_count': 0}
-            )
-        }
+        self.accumulated_data = {'overall': self._new_group()}
+        self.accumulated_data.update((name, defaultdict(self._new_group)) for name in self._groupings)
+        self._compile_groups()
+
+        # Метрики временных окон (или панелей скользящих окон) по парам src-dst хранятся в массивах NumPy,
+        # а не в накопителях групп
+        self.window_store = WindowPairStore(
+            self.window_hop_us or self.window_size, self.latency_backend, self.latency_accuracy,
+            keep_late=self.emit_corrections
+        )
 
         self.anomalies = {
             'duplicate_tx': 0,
@@ -69,22 +235,309 @@ class MetricsCalculator:
             'duplicate_rx': 0
         }
 
+        # Фильтры увиденных pkt_id. Для tx фильтр нужен только при вытеснении ожидающих tx по match_timeout_us,
+        # иначе дубликаты tx точно находятся по ожидающим tx
+        error_rate = self.duplicate_filter_error_rate
+        self.seen_rx = SeenFilter(error_rate) if error_rate is not None else None
+        self.seen_tx = SeenFilter(error_rate) if error_rate is not None and self.match_timeout_us is not None else None
+
+        # Очереди вытеснения по ts_us: пока записи приходят по возрастанию ts_us (ordered), это FIFO (deque),
+        # после первой записи не по порядку - кучи heapq
+        self.watermark: Optional[int] = None
+        self.ordered = True
+        self._tx_expiry: Union[Deque[Tuple[int, str]], List[Tuple[int, str]]] = deque()
+        self._rx_expiry: Union[Deque[Tuple[int, str]], List[Tuple[int, str]]] = deque()
+        self._matched_tx: Set[str] = set()
+
+        if self.match_timeout_us is not None:
+            self.anomalies['lost_tx'] = 0
+
+        if self.allowed_lateness_us is not None:
+            self.anomalies['late_records'] = 0
+
+        if self.sorted_input:
+            self.anomalies['out_of_order_records'] = 0
+
         self.processed_cnt = 0
         self.success_cnt = 0
 
+        self._reset_snapshot()
+
         # logger.debug(f"")
 
-    def process_record(self, record: ParseResult) -> Optional[Dict]:
+    def _new_pending(self) -> None:
+        """
+        Пустые хранилища ожидающих tx и rx: словари, PendingPacketTable для tx или, при заданном
+        pending_memory_limit, SpillingMap с общим бюджетом памяти
+        """
+
+        self._spill_store: Optional[PendingSpillStore] = None
+
+        if self.pending_memory_limit is not None:
+            if self.match_timeout_us is None:
+                self._spill_store = PendingSpillStore(self.pending_memory_limit)
+                self.tx_records = self._spill_store.new_map('tx_records')
+                self.rx_records = self._spill_store.new_map('rx_records', default_factory=list)
+                return
+
+            self._spill_store = PendingSpillStore(
+                self.pending_memory_limit, ENTRY_BYTES + EXPIRY_QUEUE_FACTOR * EXPIRY_ENTRY_BYTES
+            )
+            self._expiry_limit = EXPIRY_QUEUE_FACTOR * self._spill_store.capacity
+            self.tx_records = self._spill_store.new_map('tx_records', expiry_ts=lambda tx_record: tx_record.ts_us)
+            self.rx_records = self._spill_store.new_map(
+                'rx_records', default_factory=list, on_load=self._push_rx_expiry,
+                expiry_ts=lambda rx_list: min(rx_record.ts_us for rx_record in rx_list)
+            )
+            return
+
+        self.tx_records: Union[Dict[str, PacketRecord], PendingPacketTable] = (
+            PendingPacketTable(symbols=self.symbols) if self.pending_store == 'array' else {}
+        )
+        self.rx_records: DefaultDict[str, List[PacketRecord]] = defaultdict(list)
+
+    def _compile_groups(self) -> None:
+        """
+        Сборка функции, возвращающей накопители групп записи tx. Функция ссылается на словари accumulated_data,
+        поэтому собирается заново при их замене
+        """
+
+        self._group_accumulators = compile_group_accumulators(self._groupings, self.accumulated_data, self.window_size)
+
+    def _reset_snapshot(self) -> None:
+        """
+        Сброс кэша итоговых метрик: для каждой группы хранится версия накопителя, по которой считались метрики,
+        и строка группы в таблице ColumnarMetricsResult, а для каждого уровня агрегации - собранная таблица
+        """
+
+        self._snapshot: Dict[str, Dict] = {name: {} for name in self.accumulated_data}
+        self._tables: Dict[str, pa.Table] = {}
+        self._columnar_result: Optional[ColumnarMetricsResult] = None
+        self._columnar_result_key = None
+        self._window_version: Optional[int] = None
+        self._by_window_size: Dict[int, pa.Table] = {}
+
+    def __getstate__(self) -> Dict:
+        """
+        Состояние для передачи калькулятора в другой процесс. Накопители групп и ожидающие записи хранятся
+        колонками (массивы счетчиков, моментов и задержек, списки полей записей), поэтому сериализация не
+        обходит сотни тысяч отдельных объектов
+        """
+
+        state = self.__dict__.copy()
+        for name in ('_snapshot', '_tables', '_columnar_result', '_columnar_result_key', '_window_version',
+                     '_by_window_size', '_group_accumulators', '_spill_store'):
+            state.pop(name, None)
+        state['window_sink'] = None
+
+        state['accumulated_data'] = {
+            name: self._pack_groups({None: groups} if name == 'overall' else groups)
+            for name, groups in self.accumulated_data.items()
+        }
+
+        if not isinstance(self.tx_records, PendingPacketTable):
+            state['tx_records'] = self._pack_records(self.tx_records.values())
+
+        # Записи на диске сохраняются вместе с остальными ожидающими, а хранилище создается заново при загрузке
+        if self._spill_store is not None:
+            state['_spill_counters'] = self._spill_store.stats
+            state['_matched_tx'] = self.tx_records.matched_keys()
+
+        state['rx_records'] = self._pack_records(
+            rx_record for rx_list in self.rx_records.values() for rx_record in rx_list
+        )
+
+        return state
+
+    def __setstate__(self, state: Dict) -> None:
+        self.__dict__.update(state)
+
+        accumulated_data = {name: self._unpack_groups(groups) for name, groups in state['accumulated_data'].items()}
+        accumulated_data['overall'] = accumulated_data['overall'][None]
+        self.accumulated_data = {
+            name: groups if name == 'overall' else defaultdict(self._new_group, groups)
+            for name, groups in accumulated_data.items()
+        }
+        self._compile_groups()
+
+        self._new_pending()
+        if isinstance(state['tx_records'], PendingPacketTable):
+            self.tx_records = state['tx_records']
+        else:
+            for record in self._unpack_records(state['tx_records']):
+                self.tx_records[record.pkt_id] = record
+
+        for rx_record in self._unpack_records(state['rx_records']):
+            self.rx_records[rx_record.pkt_id].append(rx_record)
+
+        spill_counters = self.__dict__.pop('_spill_counters', None)
+        if spill_counters is not None:
+            self._spill_store.hits = self._spill_store.misses = self._spill_store.spilled = 0
+            self._spill_store.add_counters(spill_counters)
+
+            for pkt_id in self._matched_tx:
+                self.tx_records.mark_matched(pkt_id)
+            self._matched_tx = set()
+
+        self._reset_snapshot()
+
+    @staticmethod
+    def _pack_records(records) -> Dict[str, List]:
+        """
+        Колонки полей PacketRecord для последовательности записей
+        """
+
+        columns = {name: [] for name in PacketRecord.__slots__}
+        for record in records:
+            for name, column in columns.items():
+                column.append(getattr(record, name))
+        return columns
+
+    @staticmethod
+    def _unpack_records(columns: Dict[str, List]) -> List[PacketRecord]:
+        return list(map(PacketRecord, *(columns[name] for name in PacketRecord.__slots__)))
+
+    def _pack_groups(self, groups: Dict) -> Dict:
+        """
+        Колоночное представление накопителей групп: ключи, счетчики tx/rx, моменты RunningStats и задержки
+        (для exact - все значения подряд и количество значений в каждой группе)
+        """
+
+        data_list = list(groups.values())
+
+        packed = {
+            'keys': list(groups),
+            'tx': np.array([data['tx'] for data in data_list], dtype=np.int64),
+            'rx': np.array([data['rx'] for data in data_list], dtype=np.int64),
+        }
+
+        for name in ('latency_stats', 'sinr', 'rssi'):
+            packed[name] = np.array(
+                [(data[name].count, data[name].mean, data[name]._m2) for data in data_list], dtype=np.float64
+            ).reshape(-1, 3)
+
+        if self.latency_backend == 'sketch':
+            packed['latency'] = [data['latency'] for data in data_list]
+        else:
+            packed['latency_counts'] = np.array([len(data['latency']) for data in data_list], dtype=np.int64)
+            packed['latency'] = np.array([value for data in data_list for value in data['latency']])
+
+        return packed
+
+    def _unpack_groups(self, packed: Dict) -> Dict:
+        """
+        Восстановление накопителей групп из колоночного представления
+        """
+
+        if self.latency_backend == 'sketch':
+            latencies = packed['latency']
+        else:
+            values = packed['latency'].tolist()
+            bounds = np.cumsum(packed['latency_counts']).tolist()
+            latencies = [values[start:end] for start, end in zip([0] + bounds, bounds)]
+
+        stats = {name: packed[name].tolist() for name in ('latency_stats', 'sinr', 'rssi')}
+
+        groups = {}
+        for index, (key, tx, rx, latency) in enumerate(zip(packed['keys'], packed['tx'].tolist(),
+                                                          packed['rx'].tolist(), latencies)):
+            data = groups[key] = {'tx': tx, 'rx': rx, 'latency': latency}
+            for name, moments in stats.items():
+                count, mean, m2 = moments[index]
+                data[name] = RunningStats.from_moments(int(count), mean, m2)
+
+        return groups
+
+    def _new_group(self) -> Dict:
+        """
+        Создание накопителя одной группы: счетчики tx/rx, хранилище задержек для перцентилей и онлайн-накопители
+        среднего и дисперсии для latency, SINR и RSSI
+        """
+
+        return {
+            'tx': 0,
+            'rx': 0,
+            'latency': self._new_latencies(),
+            'latency_stats': RunningStats(),
+            'sinr': RunningStats(),
+            'rssi': RunningStats()
+        }
+
+    def _new_latencies(self) -> Union[List[int], LatencySketch]:
+        """
+        Создание хранилища задержек для одной группы в зависимости от latency_backend
+        """
+
+        if self.latency_backend == 'sketch':
+            return LatencySketch(self.latency_accuracy)
+        return []
+
+    def _percentile_names(self) -> Tuple[List[float], List[str]]:
+        """
+        Дополнительные перцентили без повторов и p50/p95 и их названия
+        """
+
+        extra = [
+            percentile for percentile in dict.fromkeys(self.percentiles)
+            if percentile not in LatencyStats.BASE_PERCENTILES
+        ]
+        return extra, [LatencyStats.percentile_name(percentile) for percentile in extra]
+
+    def _latency_values(self, data_list: List[Dict]) -> List[Tuple]:
+        """
+        Значения колонок latency (mean, p50, p95, дополнительные перцентили, std, count) для накопителей групп.
+        Для exact задержки всех групп объединяются в один массив со смещениями групп, и перцентили считаются
+        одной сортировкой (group_percentiles), а mean, std и count берутся из RunningStats групп
+        :param:
+            data_list: - накопители групп
+        :return:
+            List[Tuple]: - значения в порядке накопителей
+        """
+
+        extra, _ = self._percentile_names()
+        percentiles = (*LatencyStats.BASE_PERCENTILES, *extra)
+        empty = (0.0,) * (len(percentiles) + 2) + (0,)
+
+        if self.latency_backend == 'sketch':
+            return [
+                (
+                    data['latency_stats'].mean,
+                    *(data['latency'].quantile(percentile / 100) for percentile in percentiles),
+                    data['latency_stats'].std, data['latency_stats'].count
+                ) if data['latency_stats'].count else empty
+                for data in data_list
+            ]
+
+        counts = np.fromiter((len(data['latency']) for data in data_list), dtype=np.intp, count=len(data_list))
+        values = np.fromiter(
+            chain.from_iterable(data['latency'] for data in data_list), dtype=np.float64, count=int(counts.sum())
+        )
+        percentile_values = group_percentiles(values, counts, percentiles).tolist()
+
+        latency_values = []
+        for data, count, row in zip(data_list, counts.tolist(), percentile_values):
+            running_stats = data['latency_stats']
+            latency_values.append((running_stats.mean, *row, running_stats.std, count) if count else empty)
+
+        return latency_values
+
+    def process_record(self, record: Union[ParseResult, PacketRecord]) -> Optional[MatchedPair]:
         """
         Обработка строки подготовленных данных
         :param:
-            record: - строка для обработки
+            record: - строка для обработки (модель ParseResult или компактная запись PacketRecord)
         :return:
-            Optional[Dict]: - возвращает итоговый статус обработки строки
+            Optional[MatchedPair]: - возвращает итоговый статус обработки строки
         """
 
+        if self._matcher is not None:
+            raise RuntimeError("Движок vectorized обрабатывает только пакеты записей через process_batch")
+
         self.processed_cnt += 1
 
+        if self.match_timeout_us is not None or self.allowed_lateness_us is not None or self.sorted_input:
+            self._advance_watermark(record.ts_us)
+
         if record.event == 'tx':
             return self._process_tx(record)
         elif record.event == 'rx':
@@ -93,393 +546,1083 @@ class MetricsCalculator:
             logger.error("Неизвестный тип данных в поле 'event'")
             return None
 
-    def _process_tx(self, tx_record: ParseResult) -> Optional[Dict]:
+    def _advance_watermark(self, ts_us: int) -> None:
+        """
+        Сдвиг watermark по времени события, вытеснение ожидающих записей, для которых истекло время ожидания пары,
+        и закрытие окон, для которых истекло допустимое опоздание
+        :param:
+            ts_us: - время события текущей записи
+        """
+
+        if self.watermark is not None and ts_us <= self.watermark:
+            if ts_us < self.watermark:
+                self._count_out_of_order(1)
+            return
+
+        self.watermark = ts_us
+
+        if self.match_timeout_us is not None:
+            self._evict_expired(ts_us - self.match_timeout_us)
+
+        if self.allowed_lateness_us is not None:
+            self.window_store.close((ts_us - self._closing_delay()) // self.window_size)
+            if self.window_store.buffered >= WINDOW_EMIT_UPDATES:
+                self._emit_windows()
+
+    def _closing_delay(self) -> int:
+        """
+        Время после конца окна, через которое окно закрывается. Для упорядоченного потока (sorted_input) окно
+        закрывается, когда ожидающие tx этого окна вытеснены по match_timeout_us: позже обновлений в нем не будет
+        """
+
+        if self.sorted_input and self.ordered and self.match_timeout_us is not None:
+            return min(self.allowed_lateness_us, self.match_timeout_us)
+        return self.allowed_lateness_us
+
+    def _count_out_of_order(self, count: int) -> None:
+        """
+        Учет записей с ts_us меньше watermark и переход очередей вытеснения с FIFO на кучи
+        :param:
+            count: - количество таких записей
+        """
+
+        if self.sorted_input:
+            self.anomalies['out_of_order_records'] += count
+
+        if self.ordered:
+            self.ordered = False
+            # Очередь, упорядоченная по возрастанию, уже является кучей
+            self._tx_expiry, self._rx_expiry = list(self._tx_expiry), list(self._rx_expiry)
+            logger.log(
+                logging.WARNING if self.sorted_input else logging.DEBUG,
+                f"Запись с ts_us меньше watermark = {self.watermark}: поток не упорядочен по времени"
+            )
+
+    def _push_expiry(self, queue: Union[Deque, List], ts_us: int, pkt_id: str) -> None:
+        if self.ordered:
+            queue.append((ts_us, pkt_id))
+        else:
+            heapq.heappush(queue, (ts_us, pkt_id))
+
+    def _pop_expiry(self, queue: Union[Deque, List]) -> Tuple[int, str]:
+        return queue.popleft() if self.ordered else heapq.heappop(queue)
+
+    def _push_rx_expiry(self, pkt_id: str, rx_list: List[PacketRecord]) -> None:
+        """
+        Постановка в очередь вытеснения всех rx списка, например, перенесенного с диска обратно в память
+        """
+
+        for rx_record in rx_list:
+            self._push_expiry(self._rx_expiry, rx_record.ts_us, pkt_id)
+
+    def _compact_expiry(self) -> None:
+        """
+        Удаление из очередей вытеснения элементов записей, которых нет в памяти (при pending_memory_limit): записи
+        на диске вытесняются запросом по времени (SpillingMap.pop_expired), а элементы сопоставленных и уже
+        вытесненных записей не нужны. Поэтому размер очередей ограничен количеством записей в памяти
+        """
+
+        tx_memory, rx_memory = self.tx_records.memory, self.rx_records.memory
+        tx_expiry = [(ts_us, pkt_id) for ts_us, pkt_id in self._tx_expiry
+                     if pkt_id in tx_memory and tx_memory[pkt_id].ts_us == ts_us]
+        rx_expiry = [(ts_us, pkt_id) for ts_us, pkt_id in self._rx_expiry if pkt_id in rx_memory]
+
+        if self.ordered:
+            self._tx_expiry, self._rx_expiry = deque(tx_expiry), deque(rx_expiry)
+        else:
+            heapq.heapify(tx_expiry)
+            heapq.heapify(rx_expiry)
+            self._tx_expiry, self._rx_expiry = tx_expiry, rx_expiry
+
+        # Списки с несколькими rx дают больше одного элемента на запись: порог растет, чтобы не очищать очереди
+        # на каждой записи
+        size = len(tx_expiry) + len(rx_expiry)
+        self._expiry_limit = EXPIRY_QUEUE_FACTOR * max(self._spill_store.capacity, size)
+        logger.debug(f"В очередях вытеснения осталось {size} элементов записей в памяти")
+
+    def _emit_windows(self) -> None:
+        """
+        Выгрузка закрытых окон: строки окон передаются в window_sink и освобождаются. Окна закрываются сразу при
+        сдвиге watermark, а выгружаются пакетами (построчная обработка - раз в WINDOW_EMIT_UPDATES обновлений,
+        колоночная - после каждого пакета записей), чтобы не собирать таблицу на каждое окно. Строки окон,
+        выгруженных раньше (опоздавшие записи при emit_corrections), помечаются как поправки
+        """
+
+        store = self.window_store
+        if store.closed_end is None or store.closed_end == store.emitted_end:
+            return
+
+        previous_end = store.emitted_end
+
+        _, names = self._percentile_names()
+        table = self._window_table(names, store.split())
+        self._sync_late_records()
+
+        if table.num_rows == 0:
+            return
+
+        if previous_end is None:
+            correction = pa.array([False] * table.num_rows)
+        else:
+            correction = pc.less(table.column('window_start'), previous_end * self.window_size)
+
+        self.window_sink.write(table.append_column('correction', correction))
+        logger.debug(f"Выгружено {table.num_rows} строк окон до window_start = {store.emitted_end * self.window_size}")
+
+    def _sync_late_records(self) -> None:
+        """
+        Перенос в аномалии счетчика опоздавших записей: хранилище окон находит их при переносе буфера в массивы
+        """
+
+        self.window_store.flush()
+        if self.allowed_lateness_us is not None:
+            self.anomalies['late_records'] = self.window_store.late_records
+
+    def close_windows(self) -> None:
+        """
+        Закрытие всех оставшихся окон в конце потока. Имеет смысл только при заданном allowed_lateness_us
+        """
+
+        if self.allowed_lateness_us is None:
+            return
+
+        window_range = self.window_store.window_range
+        if window_range is not None:
+            self.window_store.close(window_range[1] + 1)
+
+        self._emit_windows()
+
+    def _evict_expired(self, cutoff: float) -> None:
+        """
+        Вытеснение ожидающих tx и rx с ts_us < cutoff. Очереди вытеснения упорядочены по ts_us (FIFO для
+        упорядоченного потока, иначе heapq), поэтому порядок записей во входном файле не важен
+        :param:
+            cutoff: - граница времени события
+        """
+
+        if self._spill_store is not None and len(self._tx_expiry) + len(self._rx_expiry) > self._expiry_limit:
+            self._compact_expiry()
+
+        while self._tx_expiry and self._tx_expiry[0][0] < cutoff:
+            ts_us, pkt_id = self._pop_expiry(self._tx_expiry)
+
+            tx_record = self.tx_records.get(pkt_id)
+            if tx_record is None or tx_record.ts_us != ts_us:
+                continue
+
+            matched = self._pop_tx_matched(pkt_id)
+            del self.tx_records[pkt_id]
+
+            if not matched:
+                self.anomalies['lost_tx'] += 1
+                logger.debug(f"TX для pkt_id = {pkt_id} не получил пару за {self.match_timeout_us} мкс")
+
+        while self._rx_expiry and self._rx_expiry[0][0] < cutoff:
+            ts_us, pkt_id = self._pop_expiry(self._rx_expiry)
+
+            rx_list = self.rx_records.get(pkt_id)
+            if not rx_list:
+                continue
+
+            remaining = [rx_record for rx_record in rx_list if rx_record.ts_us >= cutoff]
+            self.anomalies['rx_without_tx'] += len(rx_list) - len(remaining)
+            logger.debug(f"RX без соответствующего TX для pkt_id = {pkt_id}")
+
+            if remaining:
+                self.rx_records[pkt_id] = remaining
+            else:
+                del self.rx_records[pkt_id]
+
+        if self._spill_store is not None:
+            self._evict_spilled(cutoff)
+
+    def _evict_spilled(self, cutoff: float) -> None:
+        """
+        Вытеснение ожидающих tx и rx, перенесенных на диск: их элементы удаляются из очередей вытеснения, поэтому
+        записи выбираются из базы по времени. Оставшиеся rx списка возвращаются в память и в очередь
+        :param:
+            cutoff: - граница времени события
+        """
+
+        for pkt_id, _, matched in self.tx_records.pop_expired(cutoff):
+            if not matched:
+                self.anomalies['lost_tx'] += 1
+                logger.debug(f"TX для pkt_id = {pkt_id} не получил пару за {self.match_timeout_us} мкс")
+
+        for pkt_id, rx_list, _ in self.rx_records.pop_expired(cutoff):
+            remaining = [rx_record for rx_record in rx_list if rx_record.ts_us >= cutoff]
+            self.anomalies['rx_without_tx'] += len(rx_list) - len(remaining)
+            logger.debug(f"RX без соответствующего TX для pkt_id = {pkt_id}")
+
+            if remaining:
+                self.rx_records[pkt_id] = remaining
+                self._push_rx_expiry(pkt_id, remaining)
+
+    def _mark_tx_matched(self, pkt_id: str) -> None:
+        """
+        Отметка ожидающего tx как получившего пару
+        """
+
+        if isinstance(self.tx_records, (PendingPacketTable, SpillingMap)):
+            self.tx_records.mark_matched(pkt_id)
+        else:
+            self._matched_tx.add(pkt_id)
+
+    def _pop_tx_matched(self, pkt_id: str) -> bool:
+        """
+        Проверка и сброс отметки о паре для вытесняемого tx
+        """
+
+        if isinstance(self.tx_records, (PendingPacketTable, SpillingMap)):
+            return self.tx_records.is_matched(pkt_id)
+
+        if pkt_id in self._matched_tx:
+            self._matched_tx.discard(pkt_id)
+            return True
+        return False
+
+    def flush_pending(self) -> None:
+        """
+        Вытеснение всех ожидающих записей в конце потока: оставшиеся tx без пары считаются потерянными, rx без пары
+        учитываются в rx_without_tx, а при заданном allowed_lateness_us закрываются все окна. Имеет смысл только при
+        заданных match_timeout_us или allowed_lateness_us
+        """
+
+        if self.match_timeout_us is not None:
+            self._evict_expired(float('inf'))
+
+        self.close_windows()
+
+    def release_pending(self) -> None:
+        """
+        Освобождение всех ожидающих tx и rx без учета в аномалиях: rx без пары уже учтены в rx_without_tx при
+        поступлении. Используется, когда известно, что записей с этими pkt_id дальше не будет (например, при
+        внешней сортировке по pkt_id - ExternalSortMetrics), поэтому результат не меняется, а память освобождается
+        """
+
+        self._new_pending()
+        if self._matcher is not None:
+            self._matcher = VectorizedMatcher()
+
+    def process_batch(self, batch: pa.RecordBatch, watermarks: Optional[np.ndarray] = None) -> None:
+        """
+        Обработка пакета записей, полученного пакетным или параллельным режимом парсинга. Записи в пакете уже
+        провалидированы парсером, поэтому они передаются в калькулятор как PacketRecord без создания моделей
+        :param:
+            batch: - пакет записей со схемой ParseResult
+            watermarks: - watermark всего потока на момент каждой записи. Передается, когда калькулятор
+                          обрабатывает только часть потока (секцию pkt_id), чтобы вытеснение по match_timeout_us
+                          происходило в те же моменты, а out_of_order_records считались так же, как при обработке
+                          всего потока
+        """
+
+        if self._matcher is not None:
+            self._process_columns(batch, watermarks)
+            return
+
+        records = iter_packet_records(batch, self.symbols)
+
+        if watermarks is None or (self.match_timeout_us is None and not self.sorted_input):
+            for record in records:
+                self.process_record(record)
+            return
+
+        for record, watermark in zip(records, watermarks.tolist()):
+            self._advance_watermark(watermark)
+            self.process_record(record)
+
+    def _process_columns(self, batch: pa.RecordBatch, watermarks: Optional[np.ndarray] = None) -> None:
+        """
+        Колоночная обработка пакета движком vectorized: сопоставление tx и rx целым пакетом и агрегация
+        по кодам групп вместо обновления накопителей на каждую запись
+        :param:
+            batch: - пакет записей со схемой ParseResult
+            watermarks: - watermark всего потока на момент каждой записи (process_batch)
+        """
+
+        self.processed_cnt += batch.num_rows
+
+        columns = batch_columns(batch, self.symbols)
+        if self.seen_rx is not None:
+            columns = self._drop_duplicate_rx(columns)
+
+        self._apply_matches(self._matcher.match(columns))
+
+        if (self.allowed_lateness_us is not None or self.sorted_input) and batch.num_rows:
+            ts_us = batch.column('ts_us').to_numpy(zero_copy_only=False)
+            if self.sorted_input:
+                # Запись не по порядку, если ее ts_us меньше watermark на момент записи (с учетом ее самой)
+                running = np.maximum.accumulate(ts_us) if watermarks is None else watermarks
+                if self.watermark is not None:
+                    running = np.maximum(running, self.watermark)
+                out_of_order = int(np.count_nonzero(ts_us < running))
+                if out_of_order:
+                    self._count_out_of_order(out_of_order)
+
+            self._advance_watermark(int(running[-1] if self.sorted_input else ts_us.max()))
+            if self.allowed_lateness_us is not None:
+                self._emit_windows()
+
+    def _drop_duplicate_rx(self, columns: Dict[str, np.ndarray]) -> Dict[str, np.ndarray]:
+        """
+        Векторный аналог проверки duplicate_rx в _process_rx: rx, pkt_id которых уже встречался в этом или
+        предыдущих пакетах, учитываются как duplicate_rx и исключаются из сопоставления
+        :param:
+            columns: - колонки пакета (batch_columns)
+        :return:
+            Dict[str, np.ndarray]: - колонки пакета без повторных rx
+        """
+
+        rx_rows = np.flatnonzero(~columns['is_tx'])
+        duplicates = rx_rows[self.seen_rx.add_many(columns['pkt_id'][rx_rows])]
+        if not len(duplicates):
+            return columns
+
+        self.anomalies['duplicate_rx'] += len(duplicates)
+        keep = np.ones(len(columns['is_tx']), dtype=bool)
+        keep[duplicates] = False
+        return {name: column[keep] for name, column in columns.items()}
+
+    def _apply_matches(self, matches: BatchMatches) -> None:
+        """
+        Учет результата колоночного сопоставления: аномалии, счетчики tx/rx и накопители сопоставленных пар
+        :param:
+            matches: - результат сопоставления пакета или объединения состояний
+        """
+
+        self.success_cnt += len(matches.tx['ts_us'])
+
+        for name, count in matches.anomalies.items():
+            self.anomalies[name] += count
+
+        self._add_tx_counters(matches.new_tx)
+        self._add_tx_counters(matches.removed_tx, sign=-1)
+        self._add_matched(matches)
+
+    def _add_tx_counters(self, columns: Dict[str, np.ndarray], sign: int = 1) -> None:
+        """
+        Векторный аналог _update_tx_counters: счетчики tx по группам записей пакета
+        :param:
+            columns: - колонки ts_us, src, dst и app записей tx
+            sign: - -1, если учет записей отменяется
+        """
+
+        if len(columns['ts_us']) == 0:
+            return
+
+        self.accumulated_data['overall']['tx'] += sign * len(columns['ts_us'])
+
+        for name, fields in self._groupings.items():
+            keys, inverse = group_rows(*group_columns(columns, fields, self.window_size))
+            counts = np.bincount(inverse, minlength=len(keys)).tolist()
+
+            accumulated = self.accumulated_data[name]
+            for group_key, count in zip(keys, counts):
+                accumulated[group_key]['tx'] += sign * count
+
+        self.window_store.add_counts('tx', columns['ts_us'], columns['src'], columns['dst'], sign)
+
+    def _add_matched(self, matches: BatchMatches) -> None:
+        """
+        Векторный аналог _update_matched: сопоставленные пары пакета раскладываются по группам tx одной
+        группировкой на уровень агрегации, по ней считаются rx, задержки, средние и дисперсии групп, которые
+        объединяются с накопителями через RunningStats.merge
+        :param:
+            matches: - результат сопоставления пакета
+        """
+
+        latency = matches.latency
+        if len(latency) == 0:
+            return
+
+        tx = matches.tx
+
+        signals = (
+            ('latency_stats', latency.astype(np.float64)),
+            ('sinr', matches.rx['sinr_db']),
+            ('rssi', matches.rx['rssi_dbm'])
+        )
+
+        groups = [([self.accumulated_data['overall']], np.zeros(len(latency), dtype=np.intp))]
+        for name, fields in self._groupings.items():
+            keys, inverse = group_rows(*group_columns(tx, fields, self.window_size))
+            accumulated = self.accumulated_data[name]
+            groups.append(([accumulated[group_key] for group_key in keys], inverse))
+
+        for data_list, inverse in groups:
+            size = len(data_list)
+
+            counts = np.bincount(inverse, minlength=size).tolist()
+            for data, count, values in zip(data_list, counts, split_by_group(inverse, latency, size)):
+                data['rx'] += count
+                data['latency'].extend(values.tolist())
+
+            for name, values in signals:
+                counts, means, m2s = group_moments(inverse, values, size)
+                for data, count, mean, m2 in zip(data_list, counts.tolist(), means.tolist(), m2s.tolist()):
+                    if count:
+                        data[name].merge(RunningStats.from_moments(count, mean, m2))
+
+        self.window_store.add_matched_columns(
+            tx['ts_us'], tx['src'], tx['dst'], latency, matches.rx['sinr_db'], matches.rx['rssi_dbm']
+        )
+
+    def _process_tx(self, tx_record: Union[ParseResult, PacketRecord]) -> Optional[MatchedPair]:
         """
-        Обработка строк с данными по tx
+        Обработка строк с данными по tx. Запись сохраняется в ожидающих tx без копирования
         :param:
             tx_record: - строка с tx для обработки
         :return:
-            Optional[Dict]: - возвращает итоговый статус обработки строки
+            Optional[MatchedPair]: - возвращает итоговый статус обработки строки
         """
 
         pkt_id = tx_record.pkt_id
 
-        if pkt_id in self.tx_records:
+        if pkt_id in self.tx_records or (self.seen_tx is not None and self.seen_tx.add(pkt_id)):
             self.anomalies['duplicate_tx'] += 1
             logger.warning(f"Обнаружен дубликат TX для pkt_id = {pkt_id}")
             return None
 
-        tx_data = {
-            'ts_us': tx_record.ts_us,
-            'src': tx_record.src,
-            'dst': tx_record.dst,
-            'pkt_id': tx_record.pkt_id,
-            'app': tx_record.app,
-            'bytes': tx_record.bytes
-        }
-        self.tx_records[pkt_id] = tx_data
+        self.tx_records[pkt_id] = tx_record
+
+        if self.match_timeout_us is not None:
+            self._push_expiry(self._tx_expiry, tx_record.ts_us, pkt_id)
 
-        self._update_counters(tx_data, is_tx=True)
+        self._update_tx_counters(tx_record)
 
-        if pkt_id in self.rx_records:
+        rx_list = self.rx_records.pop(pkt_id, None)
+        if rx_list is not None:
             matched_pairs = []
-            for rx_data in self.rx_records[pkt_id]:
-                matched_pair = self._match_tx_rx(tx_data, rx_data)
+            for rx_record in rx_list:
+                matched_pair = self._match_tx_rx(tx_record, rx_record)
                 if matched_pair:
                     matched_pairs.append(matched_pair)
                     self.success_cnt += 1
 
-            del self.rx_records[pkt_id]
-
             return matched_pairs[0] if matched_pairs else None
 
         return None
 
-    def _process_rx(self, rx_record: ParseResult) -> Optional[Dict]:
+    def _process_rx(self, rx_record: Union[ParseResult, PacketRecord]) -> Optional[MatchedPair]:
         """
         Обработка строк с данными по rx
         :param:
             rx_record: - строка с rx для обработки
         :return:
-            Optional[Dict]: - возвращает итоговый статус обработки строки
+            Optional[MatchedPair]: - возвращает итоговый статус обработки строки
         """
 
-        rx_data = {
-            'ts_us': rx_record.ts_us,
-            'src': rx_record.src,
-            'dst': rx_record.dst,
-            'pkt_id': rx_record.pkt_id,
-            'app': rx_record.app,
-            'bytes': rx_record.bytes
-        }
-
         pkt_id = rx_record.pkt_id
 
-        if pkt_id in self.tx_records:
-            tx_data = self.tx_records[pkt_id]
-            matched_pair = self._match_tx_rx(tx_data, rx_data)
+        if self.seen_rx is not None and self.seen_rx.add(pkt_id):
+            self.anomalies['duplicate_rx'] += 1
+            logger.debug(f"Обнаружен дубликат RX для pkt_id = {pkt_id}")
+            return None
+
+        tx_record = self.tx_records.get(pkt_id)
+
+        if tx_record is not None:
+            matched_pair = self._match_tx_rx(tx_record, rx_record)
             if matched_pair:
                 self.success_cnt += 1
                 return matched_pair
+        elif self.match_timeout_us is not None:
+            self.rx_records[pkt_id].append(rx_record)
+            self._push_expiry(self._rx_expiry, rx_record.ts_us, pkt_id)
         else:
-            self.rx_records[pkt_id].append(rx_data)
+            self.rx_records[pkt_id].append(rx_record)
             self.anomalies['rx_without_tx'] += 1
             logger.debug(f"RX без соответствующего TX для pkt_id = {pkt_id}")
 
         return None
 
-    def _match_tx_rx(self, tx_data: Dict, rx_data: Dict) -> Optional[Dict]:
+    def _match_tx_rx(self, tx_record: Union[ParseResult, PacketRecord],
+                     rx_record: Union[ParseResult, PacketRecord]) -> Optional[MatchedPair]:
         """
         Проверка на соответствие строк tx и rx при одном id пакета
         :param:
-            tx_data: - данные по tx
-            rx_data: - данные по rx
+            tx_record: - данные по tx
+            rx_record: - данные по rx
         :return:
-            Optional[Dict]: - возвращает итоговый статус обработки
+            Optional[MatchedPair]: - возвращает итоговый статус обработки
         """
 
-        if tx_data['src'] != rx_data['dst'] or tx_data['dst'] != rx_data['src']:
+        if tx_record.src != rx_record.dst or tx_record.dst != rx_record.src:
             self.anomalies['direction_mismatch'] += 1
             logger.warning(
-                f"Несоответствие направления для pkt_id {tx_data['pkt_id']}"
-                f"TX: {tx_data['src']} -> {tx_data['tx']} "
-                f"RX: {rx_data['src']} -> {rx_data['tx']} "
+                f"Несоответствие направления для pkt_id {tx_record.pkt_id} "
+                f"TX: {self._decode(tx_record.src)} -> {self._decode(tx_record.dst)} "
+                f"RX: {self._decode(rx_record.src)} -> {self._decode(rx_record.dst)} "
             )
             return None
 
-        latency = rx_data['ts_us'] - tx_data['ts_us']
+        latency = rx_record.ts_us - tx_record.ts_us
 
         if latency < 0:
             self.anomalies['negative_latency'] += 1
             logger.warning(
-                f"Отрицательная задержка {latency} для pkt_id {tx_data['pkt_id']} "
-                f"TX: {tx_data['ts_us']}, RX: {rx_data['ts_us']}"
+                f"Отрицательная задержка {latency} для pkt_id {tx_record.pkt_id} "
+                f"TX: {tx_record.ts_us}, RX: {rx_record.ts_us}"
             )
             return None
 
-        matched_pair = {
-            'pkt_id': tx_data['pkt_id'],
-            'src': tx_data['src'],
-            'dst': tx_data['dst'],
-            'app': tx_data['app'],
-            'latency': latency,
-            'tx_ts': tx_data['ts_us'],
-            'rx_ts': rx_data['ts_us'],
-            'bytes': tx_data['bytes'],
-            'window_start': (tx_data['ts_us'] // self.window_size) * self.window_size,
-            'sinr_db': rx_data.get('sinr_db')
-        }
+        matched_pair = MatchedPair(
+            pkt_id=tx_record.pkt_id,
+            src=tx_record.src,
+            dst=tx_record.dst,
+            app=tx_record.app,
+            latency=latency,
+            tx_ts=tx_record.ts_us,
+            rx_ts=rx_record.ts_us,
+            bytes=tx_record.bytes,
+            window_start=(tx_record.ts_us // self.window_size) * self.window_size,
+            sinr_db=rx_record.sinr_db,
+            rssi_dbm=rx_record.rssi_dbm
+        )
+
+        if self.match_timeout_us is not None:
+            self._mark_tx_matched(tx_record.pkt_id)
 
-        self._update_counters(rx_data, is_tx=False)
-        # self._update_counters_for_matched_rx(tx_data)
-        self._update_latencies(matched_pair)
-        self._update_sinr_stats(matched_pair)
+        self._update_matched(tx_record, matched_pair)
 
-        logger.debug(f"Сопоставлена пара pkt_id {tx_data['pkt_id']}, задержка: {latency}")
+        logger.debug(f"Сопоставлена пара pkt_id {tx_record.pkt_id}, задержка: {latency}")
         return matched_pair
 
-    def _update_counters(self, record: Dict, is_tx: bool) -> None:
+    def _update_tx_counters(self, tx_record: Union[ParseResult, PacketRecord], count: int = 1) -> None:
         """
-        Обновление статистики по tx, rx
+        Обновление счетчиков tx во всех группах записи
         :param:
-            record: - строка обрабатываемых данных
-            is_tx: - флаг, показывающий каким данным нужно обновить статистику
+            tx_record: - строка с tx
+            count: - изменение счетчиков (-1 при отмене учета tx, оказавшегося дубликатом при объединении)
         """
 
-        key = 'tx' if is_tx else 'rx'
+        for data in self._group_accumulators(tx_record):
+            data['tx'] += count
 
-        self.accumulated_data['overall'][key] += 1
+        self.window_store.count('tx', tx_record.ts_us, (tx_record.src, tx_record.dst), count)
 
-        pair_key = (record['src'], record['dst'])
-        self.accumulated_data['by_pair'][pair_key][key] += 1
+    def _update_matched(self, tx_record: Union[ParseResult, PacketRecord], matched_pair: MatchedPair) -> None:
+        """
+        Учет сопоставленной пары одним проходом по группам tx: счетчик rx, задержка и онлайн-статистика SINR и
+        RSSI принятого пакета. rx учитывается в группах своего tx, поэтому PDR группы - доля доставленных пакетов,
+        отправленных в этой группе
+        :param:
+            tx_record: - строка с tx пары
+            matched_pair: - соответствующая пара tx и rx
+        """
 
-        self.accumulated_data['by_app'][record['app']][key] += 1
+        latency, sinr_db, rssi_dbm = matched_pair.latency, matched_pair.sinr_db, matched_pair.rssi_dbm
 
-        window_id = (record['ts_us'] // self.window_size) * self.window_size
-        window_key = (window_id, record['src'], record['dst'])
-        self.accumulated_data['by_window'][window_key][key] += 1
+        for data in self._group_accumulators(tx_record):
+            data['rx'] += 1
+            data['latency'].append(latency)
+            data['latency_stats'].update(latency)
+            if sinr_db is not None:
+                data['sinr'].update(sinr_db)
+            if rssi_dbm is not None:
+                data['rssi'].update(rssi_dbm)
 
-    # def _update_counters_for_matched_rx(self, tx_data: Dict) -> None:
-    #     """
-    #
-    #     :param tx_data:
-    #     :return:
-    #     """
-    #
-    #     self.accumulated_data['overall']['rx'] += 1
-    #
-    #     pair_key = (tx_data['src'], tx_data['dst'])
-    #     self.accumulated_data['by_pair'][pair_key]['rx'] += 1
-    #
-    #     self.accumulated_data['by_app'][tx_data['app']]['rx'] += 1
-    #
-    #     window_id = (tx_data['ts_us'] // self.window_size) * self.window_size
-    #     window_key = (window_id, tx_data['src'], tx_data['dst'])
-    #     self.accumulated_data['by_window'][window_key]['rx'] += 1
+        self.window_store.add_matched(
+            matched_pair.tx_ts, (matched_pair.src, matched_pair.dst), latency, sinr_db, rssi_dbm
+        )
 
-    def _update_latencies(self, matched_pair: Dict) -> None:
+    def merge(self, other: 'MetricsCalculator') -> None:
         """
-        Обновление статистики по latency
+        Объединение с калькулятором, обработавшим другую часть записей: счетчики, аномалии и накопители групп
+        складываются, ожидающие записи переносятся. Поток other считается продолжением потока этого калькулятора,
+        поэтому ожидающие записи сопоставляются так же, как при последовательной обработке обоих потоков:
+        ожидающий rx этого калькулятора сопоставляется с tx другого, а ожидающий rx другого - с tx этого (и
+        перестает считаться rx_without_tx). tx с pkt_id, уже известным этому калькулятору, учитывается как
+        duplicate_tx. Коды src, dst и app другого калькулятора переводятся в коды своей таблицы символов.
+        Фильтры увиденных pkt_id объединяются, но повторы rx между частями не ищутся: части должны делиться
+        по pkt_id, как в PartitionedMetrics.
+
+        Ограничение: если tx с pkt_id этого калькулятора повторяется в другой части, rx другой части уже
+        сопоставлены с ее копией tx, а не с первым tx, как при последовательной обработке. Счетчики копии
+        вычитаются, но rx, latency и аномалии этих rx (rx_without_tx, negative_latency, direction_mismatch) остаются
+        посчитанными по копии, поэтому для таких pkt_id результат отличается от последовательного расчета. О таких
+        tx пишется предупреждение в лог
         :param:
-            matched_pair: - соответствующая пара tx и rx
+            other: - калькулятор с теми же window_size, window_hop_us, latency_backend, match_timeout_us, engine,
+                     group_by и duplicate_filter_error_rate
         """
 
-        latency = matched_pair['latency']
+        options = (
+            'window_sizes', 'window_hop_us', 'latency_backend', 'match_timeout_us', 'engine', 'group_by',
+            'duplicate_filter_error_rate'
+        )
+        if any(getattr(other, name) != getattr(self, name) for name in options):
+            raise ValueError(f"Объединять можно только калькуляторы с одинаковыми параметрами: {', '.join(options)}")
 
-        self.accumulated_data['overall']['latency'].append(latency)
+        if self.window_store.closed_end is not None or other.window_store.closed_end is not None:
+            raise ValueError("Нельзя объединять калькуляторы, которые уже передали закрытые окна в window_sink")
 
-        pair_key = (matched_pair['src'], matched_pair['dst'])
-        self.accumulated_data['by_pair'][pair_key]['latency'].append(latency)
+        converter = self._symbol_converter(other.symbols)
+        convert = converter if converter is not None else (lambda value: value)
 
-        self.accumulated_data['by_app'][matched_pair['app']]['latency'].append(latency)
+        self.processed_cnt += other.processed_cnt
+        self.success_cnt += other.success_cnt
 
-        window_key = (matched_pair['window_start'], matched_pair['src'], matched_pair['dst'])
-        self.accumulated_data['by_window'][window_key]['latency'].append(latency)
-        self.accumulated_data['by_window'][window_key]['rx'] += 1
+        for name, count in other.anomalies.items():
+            self.anomalies[name] = self.anomalies.get(name, 0) + count
 
-    def _update_sinr_stats(self, matched_pair: Dict) -> None:
-        """
-        Обновление статистики по SINR
-        :param:
-            matched_pair: - соответствующая пара tx и rx
-        """
+        accumulated_data, other_data = self.accumulated_data, other.accumulated_data
+        self._merge_group(accumulated_data['overall'], other_data['overall'])
 
-        sinr_db = matched_pair.get('sinr_db')
+        for name, fields in self._groupings.items():
+            groups = accumulated_data[name]
+            for group_key, data in other_data[name].items():
+                self._merge_group(groups[convert_group_key(fields, group_key, convert)], data)
 
-        if sinr_db is not None:
-            self.accumulated_data['overall']['sinr_sum'] += sinr_db
-            self.accumulated_data['overall']['sinr_count'] += 1
+        self.window_store.merge(other.window_store, converter)
 
-            pair_key = (matched_pair['src'], matched_pair['dst'])
-            self.accumulated_data['by_pair'][pair_key]['sinr_sum'] += sinr_db
-            self.accumulated_data['by_pair'][pair_key]['sinr_count'] += 1
+        if self._spill_store is not None and other._spill_store is not None:
+            self._spill_store.add_counters(other._spill_store.stats)
 
-            self.accumulated_data['by_app'][matched_pair['app']]['sinr_sum'] += sinr_db
-            self.accumulated_data['by_app'][pair_key]['sinr_count'] += 1
+        for name in ('seen_tx', 'seen_rx'):
+            if getattr(self, name) is not None:
+                getattr(self, name).merge(getattr(other, name))
 
-            window_key = (matched_pair['window_start'], matched_pair['src'], matched_pair['dst'])
-            self.accumulated_data['by_window'][window_key]['sinr_sum'] += sinr_db
-            self.accumulated_data['by_window'][window_key]['sinr_count'] += 1
+        duplicate_tx = self.anomalies['duplicate_tx']
+        self._merge_pending(other, converter)
 
-    def get_curr_stats(self) -> Dict:
+        duplicate_tx = self.anomalies['duplicate_tx'] - duplicate_tx
+        if duplicate_tx:
+            logger.warning(
+                f"При объединении обнаружено {duplicate_tx} дубликатов TX: rx этих pkt_id во второй части "
+                f"сопоставлены с повторным tx, результат по ним может отличаться от последовательного расчета"
+            )
+
+        logger.info(f"Объединено состояние калькулятора: {other.processed_cnt} записей")
+
+    def _symbol_converter(self, other_symbols: Optional[SymbolTable]):
         """
-        Получение текущей статистики обработки данных
-        :return:
-            Dict: - словарь с метриками по обработке данных
+        Функция перевода значений src, dst и app другого калькулятора в значения этого калькулятора. None, если
+        перевод не нужен: таблицы совпадают или таблица другого калькулятора - начало этой таблицы
         """
 
-        return {
-            'processed_cnt': self.processed_cnt,
-            'sucess_cnt': self.success_cnt,
-            'pending_tx': len(self.tx_records),
-            'pending_rx': sum(len(rx_list) for rx_list in self.rx_records.values()),
-            'anomalies': self.anomalies.copy(),
-            'matched': (
-                self.success_cnt / self.processed_cnt if self.processed_cnt > 0 else 0.0
-            )
-        }
+        if other_symbols is self.symbols or (
+            other_symbols is not None and self.symbols is not None
+            and other_symbols.symbols == self.symbols.symbols[:len(other_symbols)]
+        ):
+            return None
+        if self.symbols is None:
+            return other_symbols.decode
+        if other_symbols is None:
+            return self.symbols.encode
 
-    def get_metrics_result(self) -> MetricsResult:
+        return [self.symbols.encode(symbol) for symbol in other_symbols.symbols].__getitem__
+
+    @staticmethod
+    def _merge_group(data: Dict, other: Dict) -> None:
         """
-        Подсчет и возвращение итоговых агрегируемых метрик
-        :return:
-            MetricsResult: - модель данных для итогового набора метрик
+        Объединение накопителей одной группы
         """
 
-        logger.info("Расчет финальных метрик")
-
-        overall_metrics = self._calculate_overall_metrics()
-        by_pair_metrics = self._calculate_pairs_metrics()
-        by_app_metrics = self._calculate_app_metrics()
-        by_window_metrics = self._calculate_window_metrics()
+        data['tx'] += other['tx']
+        data['rx'] += other['rx']
 
-        metrics_result = MetricsResult(
-            overall=overall_metrics,
-            by_pair=by_pair_metrics,
-            by_app=by_app_metrics,
-            by_window=by_window_metrics,
-            anomalies=self.anomalies.copy(),
-            processed_cnt=self.processed_cnt,
-            success_cnt=self.success_cnt
-        )
+        if isinstance(data['latency'], LatencySketch):
+            data['latency'].merge(other['latency'])
+        else:
+            data['latency'].extend(other['latency'])
 
-        logger.info("Расчет итоговых метрик закончен")
-        return metrics_result
+        for name in ('latency_stats', 'sinr', 'rssi'):
+            data[name].merge(other[name])
 
-    def _calculate_overall_metrics(self) -> ConnectionMetrics:
+    def _merge_pending(self, other: 'MetricsCalculator', convert) -> None:
         """
-        Подсчет метрик по всему датасету
-        :return:
-            ConnectionMetrics: - Модель данных по статистике для определенной группе
+        Перенос ожидающих tx и rx другого калькулятора с сопоставлением пар между калькуляторами, а также очередей
+        вытеснения и watermark
+        :param:
+            other: - второй калькулятор
+            convert: - перевод значений src, dst и app или None, если коды совпадают
         """
 
-        overall_data = self.accumulated_data['overall']
+        if self._matcher is not None:
+            code_map = np.arange(len(other.symbols)) if convert is None else np.array(
+                [convert(code) for code in range(len(other.symbols))], dtype=np.int64
+            )
+            self._apply_matches(self._matcher.merge(other._matcher, code_map))
+            return
 
-        pdr_metrics = PDRMetrics.create(
-            tx_count=overall_data['tx'],
-            rx_count=overall_data['rx']
-        )
+        def converted(record: PacketRecord) -> PacketRecord:
+            if convert is None:
+                return record
+
+            return PacketRecord(
+                ts_us=record.ts_us, event=record.event, src=convert(record.src), dst=convert(record.dst),
+                pkt_id=record.pkt_id, app=convert(record.app), bytes=record.bytes, rssi_dbm=record.rssi_dbm,
+                sinr_db=record.sinr_db, drop_reason=record.drop_reason
+            )
 
-        latency_stats = LatencyStats.create(overall_data['latency'])
+        tx_records, other_tx_records = self.tx_records, other.tx_records
 
-        sinr_avg = overall_data['sinr_sum'] / overall_data['sinr_count'] if overall_data['sinr_count'] > 0 else None
+        # Ожидающие rx этого калькулятора получают tx, пришедший в другой части потока
+        cross_matched = set()
+        for pkt_id in [pkt_id for pkt_id in self.rx_records if pkt_id in other_tx_records]:
+            tx_record = converted(other_tx_records[pkt_id])
+            for rx_record in self.rx_records.pop(pkt_id):
+                if self._match_tx_rx(tx_record, rx_record):
+                    self.success_cnt += 1
+                    cross_matched.add(pkt_id)
 
-        return ConnectionMetrics(
-            src="OVERALL",
-            dst="OVERALL",
-            pdr_metrics=pdr_metrics,
-            latency_stats=latency_stats,
-            sinr_avg=sinr_avg,
-            sinr_count=overall_data['sinr_count']
-        )
+        # Ожидающие rx другого калькулятора пришли после tx этого калькулятора
+        for pkt_id, rx_list in other.rx_records.items():
+            tx_record = tx_records.get(pkt_id)
+            if tx_record is None:
+                self.rx_records[pkt_id].extend(converted(rx_record) for rx_record in rx_list)
+                continue
+
+            for rx_record in rx_list:
+                if self._match_tx_rx(tx_record, converted(rx_record)):
+                    self.success_cnt += 1
+
+            if self.match_timeout_us is None:
+                self.anomalies['rx_without_tx'] -= len(rx_list)
+
+        if convert is None and isinstance(tx_records, dict) and isinstance(other_tx_records, dict):
+            duplicates = tx_records.keys() & other_tx_records.keys()
+            duplicate_count = len(duplicates)
+
+            for pkt_id in duplicates:
+                self._update_tx_counters(other_tx_records[pkt_id], count=-1)
 
-    def _calculate_pairs_metrics(self) -> Dict[Tuple[str, str], ConnectionMetrics]:
+            if duplicates:
+                tx_records.update(
+                    (pkt_id, tx_record) for pkt_id, tx_record in other_tx_records.items() if pkt_id not in duplicates
+                )
+            else:
+                tx_records.update(other_tx_records)
+        else:
+            duplicate_count = 0
+            for pkt_id in other_tx_records:
+                if pkt_id in tx_records:
+                    duplicate_count += 1
+                    self._update_tx_counters(converted(other_tx_records[pkt_id]), count=-1)
+                else:
+                    tx_records[pkt_id] = converted(other_tx_records[pkt_id])
+
+        self.anomalies['duplicate_tx'] += duplicate_count
+
+        if self.match_timeout_us is not None:
+            matched = other._matched_tx | cross_matched
+            if isinstance(other_tx_records, PendingPacketTable):
+                matched.update(pkt_id for pkt_id in other_tx_records if other_tx_records.is_matched(pkt_id))
+            elif isinstance(other_tx_records, SpillingMap):
+                matched.update(other_tx_records.matched_keys())
+            for pkt_id in matched:
+                self._mark_tx_matched(pkt_id)
+
+        # Отсортированная очередь подходит и как FIFO, и как куча
+        self.ordered = self.ordered and other.ordered
+        queue = deque if self.ordered else list
+        self._tx_expiry = queue(sorted(chain(self._tx_expiry, other._tx_expiry)))
+        self._rx_expiry = queue(sorted(chain(self._rx_expiry, other._rx_expiry)))
+
+        if other.watermark is not None:
+            self.watermark = max(self.watermark if self.watermark is not None else other.watermark, other.watermark)
+
+    def save_state(self, path: Union[str, Path]) -> None:
+        """
+        Сохранение состояния калькулятора (накопители групп, аномалии, ожидающие записи, таблица символов) в
+        бинарный файл. Состояние можно загрузить через load_state и объединить с состояниями других файлов через
+        merge, не перечитывая исходные логи. Чтобы ожидающие пары сопоставлялись между файлами, состояние
+        сохраняется до flush_pending
+        :param:
+            path: - путь к файлу состояния
         """
 
+        with open(path, 'wb') as file:
+            pickle.dump(
+                {'format': STATE_FORMAT, 'version': STATE_VERSION, 'calculator': self}, file,
+                protocol=pickle.HIGHEST_PROTOCOL
+            )
+
+        logger.info(f"Состояние калькулятора сохранено в {path}")
+
+    @classmethod
+    def load_state(cls, path: Union[str, Path]) -> 'MetricsCalculator':
+        """
+        Загрузка состояния, сохраненного save_state. Файл состояния - pickle, поэтому загружать можно только
+        файлы из доверенного источника
+        :param:
+            path: - путь к файлу состояния
         :return:
+            MetricsCalculator: - калькулятор с восстановленным состоянием
         """
 
-        by_pair_metrics = {}
+        with open(path, 'rb') as file:
+            payload = pickle.load(file)
 
-        for pair_key, data in self.accumulated_data['by_pair'].items():
-            src, dst = pair_key
+        if not isinstance(payload, dict) or payload.get('format') != STATE_FORMAT:
+            raise ValueError(f"Файл {path} не является состоянием MetricsCalculator")
 
-            if data['tx'] == 0 and data['rx'] == 0:
-                continue
+        if payload.get('version') != STATE_VERSION:
+            raise ValueError(f"Неподдерживаемая версия состояния {payload.get('version')} в файле {path}")
 
-            pdr_metrics = PDRMetrics.create(
-                tx_count=data['tx'],
-                rx_count=data['rx']
-            )
+        logger.info(f"Состояние калькулятора загружено из {path}")
+        return payload['calculator']
 
-            latency_stats = LatencyStats.create(data['latency'])
+    def get_curr_stats(self) -> Dict:
+        """
+        Получение текущей статистики обработки данных
+        :return:
+            Dict: - словарь с метриками по обработке данных. Средние значения latency, SINR и RSSI доступны
+                    в любой момент обработки, счетчики pending_spill - только при заданном pending_memory_limit
+        """
 
-            sinr_avg = data['sinr_sum'] / data['sinr_count'] if data['sinr_count'] > 0 else None
+        overall = self.accumulated_data['overall']
+        self._sync_late_records()
 
-            by_pair_metrics[pair_key] = ConnectionMetrics(
-                src=src,
-                dst=dst,
-                pdr_metrics=pdr_metrics,
-                latency_stats=latency_stats,
-                sinr_avg=sinr_avg,
-                sinr_count=data['sinr_count']
+        stats = {
+            'processed_cnt': self.processed_cnt,
+            'sucess_cnt': self.success_cnt,
+            'pending_tx': len(self._matcher.tx_records if self._matcher is not None else self.tx_records),
+            'pending_rx': (
+                self._matcher.pending_rx if self._matcher is not None
+                else sum(len(rx_list) for rx_list in self.rx_records.values())
+            ),
+            'anomalies': self.anomalies.copy(),
+            'anomaly_error_rates': self.anomaly_error_rates(),
+            'latency_mean': overall['latency_stats'].avg,
+            'latency_std': overall['latency_stats'].std,
+            'sinr_avg': overall['sinr'].avg,
+            'rssi_avg': overall['rssi'].avg,
+            'matched': (
+                self.success_cnt / self.processed_cnt if self.processed_cnt > 0 else 0.0
             )
+        }
 
-        return by_pair_metrics
+        # Обращения к ожидающим записям при pending_memory_limit: hits - в памяти, misses - чтения с диска,
+        # spilled - перенесено на диск, on_disk - сейчас на диске
+        if self._spill_store is not None:
+            stats['pending_spill'] = self._spill_store.stats
 
-    def _calculate_app_metrics(self) -> Dict[str, ConnectionMetrics]:
-        """
+        return stats
 
+    def anomaly_error_rates(self) -> Dict[str, float]:
+        """
+        Оценка вероятности ложного срабатывания для аномалий, которые находятся фильтрами увиденных pkt_id
         :return:
+            Dict[str, float]: - название аномалии -> вероятность того, что новый pkt_id будет принят за дубликат.
+                                Аномалий, которые считаются точно, в словаре нет
         """
 
-        by_app_metrics = {}
+        filters = {'duplicate_tx': self.seen_tx, 'duplicate_rx': self.seen_rx}
+        return {name: seen.false_positive_rate for name, seen in filters.items() if seen is not None}
 
-        for app, data in self.accumulated_data['by_app'].items():
-
-            if data['tx'] == 0 and data['rx'] == 0:
-                continue
+    def _decode(self, value: Union[str, int]) -> str:
+        """
+        Восстановление строки src, dst или app из кода таблицы символов
+        """
 
-            pdr_metrics = PDRMetrics.create(
-                tx_count=data['tx'],
-                rx_count=data['rx']
-            )
+        return self.symbols.decode(value) if self.symbols is not None else value
 
-            latency_stats = LatencyStats.create(data['latency'])
+    def get_columnar_result(self) -> ColumnarMetricsResult:
+        """
+        Подсчет итоговых метрик в колоночном виде: по таблице Arrow на уровень агрегации. Строки групп кэшируются
+        вместе с версией накопителя группы (счетчики tx/rx и количество значений latency, SINR и RSSI меняются при
+        любом обновлении группы), поэтому повторный вызов пересчитывает только изменившиеся группы и собирает
+        заново только таблицы с такими группами, а без изменений возвращает тот же результат. Задержки всех
+        пересчитываемых групп обрабатываются за один проход (_latency_values). Таблица by_window собирается
+        колонками из хранилища окон (_window_table) и пересобирается при изменении его версии
+        :return:
+            ColumnarMetricsResult: - итоговые метрики
+        """
 
-            sinr_avg = data['sinr_sum'] / data['sinr_count'] if data['sinr_count'] > 0 else None
+        self._sync_late_records()
+
+        result_key = (self.processed_cnt, self.success_cnt, tuple(self.anomalies.items()))
+
+        aggregations = {'overall': {None: self.accumulated_data['overall']}}
+        aggregations.update((name, self.accumulated_data[name]) for name in self._groupings)
+
+        windows_changed = self._window_version != self.window_store.version
+
+        group_version = self._group_version
+        stale = []
+        for name, groups in aggregations.items():
+            snapshot = self._snapshot[name]
+            for group_key, data in groups.items():
+                version = group_version(data)
+                cached = snapshot.get(group_key)
+                if cached is None or cached[0] != version:
+                    stale.append((name, group_key, data, version))
+
+        if (self._columnar_result is not None and not stale and not windows_changed
+                and result_key == self._columnar_result_key):
+            logger.info("Итоговые метрики не изменились с прошлого расчета")
+            return self._columnar_result
+
+        logger.info(f"Расчет финальных метрик: пересчитывается {len(stale)} групп")
+
+        latency_values = self._latency_values([data for _, _, data, _ in stale])
+
+        for (name, group_key, data, version), latency in zip(stale, latency_values):
+            row = None
+            if name == 'overall' or data['tx'] != 0 or data['rx'] != 0:
+                row = (*self._group_key_values(name, group_key), *self._group_values(data, latency))
+
+            self._snapshot[name][group_key] = (version, row)
+
+        _, names = self._percentile_names()
+        for name in {name for name, _, _, _ in stale} | (aggregations.keys() - self._tables.keys()):
+            rows = [row for _, row in self._snapshot[name].values() if row is not None]
+            fields = None if name in KEY_FIELDS else self._groupings[name]
+            self._tables[name] = ColumnarMetricsResult.table(name, rows, names, fields)
+
+        if windows_changed or 'by_window' not in self._tables:
+            tables = {}
+            if self.window_hop_us is not None:
+                for size in self.window_sizes:
+                    tables[size] = self._window_table(names, self.window_store.hop(size // self.window_hop_us))
+            else:
+                # Каждый размер собирается из предыдущего, если он кратен ему, иначе из основных ячеек
+                source = self.window_store
+                tables[self.window_size] = self._window_table(names)
+                for size in self.window_sizes[1:]:
+                    if size % source.window_size:
+                        source = self.window_store
+                    source = source.rollup(size // source.window_size)
+                    tables[size] = self._window_table(names, source)
+            self._tables['by_window'] = tables[self.window_size]
+            self._by_window_size = tables if len(self.window_sizes) > 1 else {}
+            self._window_version = self.window_store.version
+
+        columnar_result = ColumnarMetricsResult(
+            **{name: self._tables[name] for name in KEY_FIELDS},
+            anomalies=self.anomalies.copy(),
+            processed_cnt=self.processed_cnt,
+            success_cnt=self.success_cnt,
+            percentile_names=names,
+            anomaly_error_rates=self.anomaly_error_rates(),
+            by_window_size=self._by_window_size,
+            by_group={fields: self._tables[group_name(fields)] for fields in self.group_by}
+        )
 
-            by_app_metrics[app] = ConnectionMetrics(
-                src="APP",
-                dst=app,
-                app=app,
-                pdr_metrics=pdr_metrics,
-                latency_stats=latency_stats,
-                sinr_avg=sinr_avg,
-                sinr_count=data['sinr_count']
-            )
+        self._columnar_result, self._columnar_result_key = columnar_result, result_key
 
-        return by_app_metrics
+        logger.info("Расчет итоговых метрик закончен")
+        return columnar_result
 
-    def _calculate_window_metrics(self) -> Dict[Tuple[int, str, str], ConnectionMetrics]:
+    def get_metrics_result(self) -> MetricsResult:
+        """
+        Подсчет и возвращение итоговых агрегируемых метрик в виде моделей ConnectionMetrics на каждую группу.
+        Модели строятся по get_columnar_result, поэтому для большого количества групп лучше использовать его
+        :return:
+            MetricsResult: - модель данных для итогового набора метрик
         """
 
+        return self.get_columnar_result().to_metrics_result()
+
+    def _window_table(self, percentile_names: Sequence[str], store: Optional[WindowPairStore] = None) -> pa.Table:
+        """
+        Таблица by_window по ячейкам хранилища окон: все колонки считаются операциями над массивами ячеек, строки
+        упорядочены по окну и по порядку появления пар. Как и для остальных уровней, ячейки без tx и rx не
+        попадают в таблицу
+        :param:
+            percentile_names: - названия дополнительных перцентилей
+            store: - хранилище окон, None - открытые окна калькулятора
         :return:
+            pa.Table: - таблица со схемой ColumnarMetricsResult.schema('by_window')
         """
 
-        by_window_metrics = {}
+        store = store if store is not None else self.window_store
+        windows, pairs, values = store.cells()
 
-        for window_key, data in self.accumulated_data['by_window'].items():
-            window_start, src, dst = window_key
+        tx, rx = values[FIELD_INDEX['tx']], values[FIELD_INDEX['rx']]
+        occupied = (tx != 0) | (rx != 0)
+        windows, pairs, values = windows[occupied], pairs[occupied], values[:, occupied]
+        tx, rx = tx[occupied], rx[occupied]
 
-            if data['tx'] == 0 and data['rx'] == 0:
-                continue
+        def field(name: str) -> np.ndarray:
+            return values[FIELD_INDEX[name]]
 
-            pdr_metrics = PDRMetrics.create(
-                tx_count=data['tx'],
-                rx_count=data['rx']
-            )
+        latency_count = field('latency_count')
+        with np.errstate(divide='ignore', invalid='ignore'):
+            latency_std = np.sqrt(np.where(latency_count > 1, field('latency_m2') / (latency_count - 1), 0.0))
+        has_latency = latency_count > 0
+
+        extra, _ = self._percentile_names()
+        percentiles = (*LatencyStats.BASE_PERCENTILES, *extra)
+        latency_percentiles = np.zeros((len(windows), len(percentiles)))
 
-            latency_stats = LatencyStats.create(data['latency'])
+        if self.latency_backend == 'sketch':
+            for row in np.flatnonzero(has_latency).tolist():
+                sketch = store.sketches[(int(windows[row]), int(pairs[row]))]
+                latency_percentiles[row] = [sketch.quantile(percentile / 100) for percentile in percentiles]
+        else:
+            log_windows, log_pairs, log_values = store.latencies()
+            stride = max(len(store.pair_keys), 1)
+            rows = np.searchsorted(windows * stride + pairs, log_windows * stride + log_pairs)
+            order = np.argsort(rows, kind='stable')
+            counts = np.bincount(rows, minlength=len(windows))
+            latency_percentiles = group_percentiles(log_values[order], counts, percentiles)
+
+        decoded = [(self._decode(src), self._decode(dst)) for src, dst in store.pair_keys]
+        src_names = pa.array([src for src, _ in decoded], pa.string()).take(pa.array(pairs))
+        dst_names = pa.array([dst for _, dst in decoded], pa.string()).take(pa.array(pairs))
+
+        def signal_avg(name: str) -> pa.Array:
+            return pa.array(field(f'{name}_mean'), pa.float64(), mask=field(f'{name}_count') == 0)
+
+        columns = [
+            windows * store.window_size, src_names, dst_names, pa.array(['N/A'] * len(windows), pa.string()),
+            tx.astype(np.int64), rx.astype(np.int64), np.where(tx > 0, rx / np.where(tx > 0, tx, 1), 0.0),
+            np.where(has_latency, field('latency_mean'), 0.0),
+            *(latency_percentiles[:, index] for index in range(len(percentiles))),
+            latency_std, latency_count.astype(np.int64),
+            signal_avg('sinr'), field('sinr_count'), signal_avg('rssi'), field('rssi_count').astype(np.int64)
+        ]
+
+        schema = ColumnarMetricsResult.schema(AggregationType.BY_WINDOW.value, percentile_names)
+        return pa.table([
+            column if isinstance(column, pa.Array) else pa.array(column, type=item.type)
+            for column, item in zip(columns, schema)
+        ], schema=schema)
+
+    @staticmethod
+    def _group_version(data: Dict) -> Tuple[int, int, int, int, int]:
+        """
+        Версия накопителя группы: каждое обновление группы меняет хотя бы один из счетчиков, а задержки
+        добавляются вместе с latency_stats
+        """
 
-            sinr_avg = data['sinr_sum'] / data['sinr_count'] if data['sinr_count'] > 0 else None
+        return data['tx'], data['rx'], data['latency_stats'].count, data['sinr'].count, data['rssi'].count
 
-            by_window_metrics[window_key] = ConnectionMetrics(
-                src=src,
-                dst=dst,
-                pdr_metrics=pdr_metrics,
-                latency_stats=latency_stats,
-                window_start=window_start,
-                sinr_avg=sinr_avg,
-                sinr_count=data['sinr_count']
-            )
+    def _group_key_values(self, name: str, group_key) -> Tuple:
+        """
+        Значения колонок ключа группы (KEY_FIELDS или GROUP_FIELDS) со строками вместо кодов таблицы символов
+        """
 
-        return by_window_metrics
+        if name == 'overall':
+            return ()
+        if name == 'by_pair':
+            return self._decode(group_key[0]), self._decode(group_key[1]), 'N/A'
 
-    def export_to_dict(self) -> Dict:
+        fields = self._groupings[name]
+        values = (group_key,) if len(fields) == 1 else group_key
+        return tuple(
+            self._decode(value) if field in ENCODED_FIELDS else value for field, value in zip(fields, values)
+        )
+
+    @staticmethod
+    def _group_values(data: Dict, latency: Tuple) -> Tuple:
+        """
+        Значения колонок метрик группы (metric_fields)
         """
 
+        tx, rx = data['tx'], data['rx']
+        sinr, rssi = data['sinr'], data['rssi']
+
+        return tx, rx, rx / tx if tx > 0 else 0.0, *latency, sinr.avg, sinr.count, rssi.avg, rssi.count
+
+    def export_to_dict(self) -> Dict:
+        """
+        Итоговые метрики в виде словаря
         :return:
+            Dict: - словарь MetricsResult
         """
 
         metrics_result = self.get_metrics_result()
@@ -487,23 +1630,16 @@ class MetricsCalculator:
 
     def get_summary(self) -> Dict:
         """
-
+        Краткая сводка по итоговым метрикам
         :return:
+            Dict: - PDR и средняя задержка по всему датасету, количество пар, приложений и окон
         """
 
-        metrics_result = self.get_metrics_result()
-
-        return {
-            'overall_pdr': metrics_result.overall.pdr_metrics.pdr,
-            'overall_latency_mean': metrics_result.overall.latency_stats.mean,
-            'unique_pairs': len(metrics_result.by_pair),
-            'unique_apps': len(metrics_result.by_app),
-            'time_windows': len(metrics_result.by_window)
-        }
+        return self.get_columnar_result().summary()
 
     def export_comprehensive(self, output_dir: Path, filename: str = "metrics") -> Dict[str, Path]:
         """
         Комплексный экспорт всех метрик
         """
 
-        return export_comprehensive(self.get_metrics_result(), output_dir, filename)
+        return export_comprehensive(self.get_columnar_result(), output_dir, filename)
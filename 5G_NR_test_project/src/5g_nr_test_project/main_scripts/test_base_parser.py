@@ -1,7 +1,9 @@
 import sys
 import os
 
-from typing import Dict, Set, Iterable, Any
+import pyarrow as pa
+
+from typing import Dict, Set, Iterable, Iterator, List, Optional, Any
 from pathlib import Path
 from abc import ABC, abstractmethod
 
@@ -9,8 +11,12 @@ current_dir = os.path.dirname(os.path.abspath(__file__))
 project_root = os.path.dirname(os.path.join(current_dir, '..', '..'))
 sys.path.insert(0, project_root)
 
-from configs.models import ParseResult, EventType
+from configs.models import ParseResult, PacketRecord, EventType
 from configs.interfaces import ParserInterface
+from main_scripts.batch_validation import DEFAULT_BATCH_SIZE, iter_packet_records
+from support_scripts.progress_bar import ProgressBar
+from support_scripts.work_with_file import iter_line_chunks
+from support_scripts.symbol_table import SymbolTable
 
 
 class TestParser(ParserInterface, ABC):
@@ -32,14 +38,14 @@ class TestParser(ParserInterface, ABC):
             'success_cnt': self._processed_cnt - self._error_cnt - self._validation_error_cnt,
         }
 
-    def _increment_processed_cnt(self) -> None:
-        self._processed_cnt += 1
+    def _increment_processed_cnt(self, count: int = 1) -> None:
+        self._processed_cnt += count
 
-    def _increment_error_cnt(self) -> None:
-        self._error_cnt += 1
+    def _increment_error_cnt(self, count: int = 1) -> None:
+        self._error_cnt += count
 
-    def _increment_validation_error_cnt(self) -> None:
-        self._validation_error_cnt += 1
+    def _increment_validation_error_cnt(self, count: int = 1) -> None:
+        self._validation_error_cnt += count
 
     def validate_file_format(self, file_path: Path) -> bool:
         if not file_path.exists():
@@ -49,6 +55,90 @@ class TestParser(ParserInterface, ABC):
 
         return file_path.suffix.lower() in self.supported_extensions
 
+    def parse_batches(self, file_path: Path, batch_size: int = DEFAULT_BATCH_SIZE) -> Iterator[pa.RecordBatch]:
+        """
+        Пакетный режим парсинга: источник читается блоками по batch_size строк, правила модели ParseResult
+        проверяются сразу для целых колонок, а на выходе получаются Arrow RecordBatch со схемой
+        PARSE_RESULT_SCHEMA. Отброшенные строки учитываются в тех же счетчиках, что и в parse_data_stream
+        :param:
+            file_path: - путь, по которому находится источник данных
+            batch_size: - количество строк источника в одном блоке
+        :return:
+            Iterator[pa.RecordBatch]: - генератор пакетов с провалидированными записями
+        """
+
+        progress_bar = ProgressBar.create_parser_progress_bar(file_path)
+
+        try:
+            start = self._data_start_offset(file_path)
+            yield from self.parse_byte_range(file_path, start, None, batch_size, progress_bar)
+
+        finally:
+            progress_bar.close()
+
+    def parse_records(self, file_path: Path, batch_size: int = DEFAULT_BATCH_SIZE,
+                      symbols: Optional[SymbolTable] = None) -> Iterator[PacketRecord]:
+        """
+        Поток компактных записей PacketRecord поверх пакетного режима, для передачи в MetricsCalculator
+        без создания моделей ParseResult на каждую строку
+        :param:
+            file_path: - путь, по которому находится источник данных
+            batch_size: - количество строк источника в одном блоке
+            symbols: - общая с калькулятором таблица символов. Если передана, парсер пополняет ее, а записи несут
+                       целые коды src, dst и app вместо строк
+        :return:
+            Iterator[PacketRecord]: - генератор записей в порядке следования в источнике
+        """
+
+        for batch in self.parse_batches(file_path, batch_size):
+            yield from iter_packet_records(batch, symbols)
+
+    def parse_byte_range(self, file_path: Path, start: int, end: Optional[int],
+                         batch_size: int = DEFAULT_BATCH_SIZE, progress_bar: Any = None) -> Iterator[pa.RecordBatch]:
+        """
+        Пакетный парсинг части источника: строк, начинающихся в диапазоне байт [start, end). Используется
+        для параллельной обработки одного файла в нескольких процессах
+        :param:
+            file_path: - путь, по которому находится источник данных
+            start: - смещение начала диапазона (должно указывать на начало строки)
+            end: - смещение конца диапазона, None - до конца файла
+            batch_size: - количество строк источника в одном блоке
+            progress_bar: - строка прогресса, которую нужно обновлять по мере чтения строк
+        :return:
+            Iterator[pa.RecordBatch]: - генератор пакетов с провалидированными записями
+        """
+
+        for lines in iter_line_chunks(file_path, start=start, end=end, chunk_size=batch_size):
+            batch = self._parse_lines_batch(lines)
+
+            if progress_bar is not None:
+                progress_bar.update(len(lines))
+
+            if batch.num_rows:
+                yield batch
+
+    def merge_stats(self, stats: Dict[str, int]) -> None:
+        """
+        Добавляет к счетчикам парсера статистику другого экземпляра (например, из процесса-обработчика)
+        :param:
+            stats: - словарь в формате get_stats
+        """
+
+        self._increment_processed_cnt(stats['processed_cnt'])
+        self._increment_error_cnt(stats['error_cnt'])
+        self._increment_validation_error_cnt(stats['validation_error_cnt'])
+
+    def _data_start_offset(self, file_path: Path) -> int:
+        """
+        Смещение в байтах, с которого в источнике начинаются записи (например, после заголовка CSV)
+        :param:
+            file_path: - путь, по которому находится источник данных
+        :return:
+            int: - смещение первой записи
+        """
+
+        return 0
+
     def reset_stats(self) -> None:
         self._processed_cnt = 0
         self._error_cnt = 0
@@ -85,3 +175,15 @@ class TestParser(ParserInterface, ABC):
         """
 
         pass
+
+    @abstractmethod
+    def _parse_lines_batch(self, lines: List[bytes]) -> pa.RecordBatch:
+        """
+        Обработка одного блока строк источника в пакетном режиме
+        :param:
+            lines: - строки источника в байтовом виде
+        :return:
+            pa.RecordBatch: - пакет с корректными записями
+        """
+
+        pass
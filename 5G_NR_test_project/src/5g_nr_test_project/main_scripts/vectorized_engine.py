@@ -0,0 +1,410 @@
+import os
+import sys
+import logging
+
+import numpy as np
+import pyarrow as pa
+import pyarrow.compute as pc
+
+from typing import Dict, List, Optional, Sequence, Tuple
+
+current_dir = os.path.dirname(os.path.abspath(__file__))
+project_root = os.path.dirname(os.path.join(current_dir, '..', '..'))
+sys.path.insert(0, project_root)
+
+from main_scripts.batch_validation import ENCODED_FIELDS
+from support_scripts.symbol_table import SymbolTable
+
+logger = logging.getLogger(__name__)
+
+# Поля ожидающего tx, которые нужны для сопоставления с rx
+TX_FIELDS = ('ts_us', 'src', 'dst', 'app')
+
+# Поля ожидающего rx: поля tx, SINR и RSSI приемника
+RX_FIELDS = TX_FIELDS + ('sinr_db', 'rssi_dbm')
+
+
+def batch_columns(batch: pa.RecordBatch, symbols: SymbolTable) -> Dict[str, np.ndarray]:
+    """
+    Колонки пакета записей в виде массивов NumPy: src, dst и app кодируются таблицей символов, pkt_id
+    переводится в байтовые строки фиксированной длины (их можно сортировать и искать через searchsorted),
+    пустые SINR и RSSI становятся NaN
+    :param:
+        batch: - пакет записей со схемой PARSE_RESULT_SCHEMA
+        symbols: - общая таблица символов
+    :return:
+        Dict[str, np.ndarray]: - колонки пакета и маска is_tx
+    """
+
+    columns = {name: symbols.encode_array(batch.column(name)) for name in ENCODED_FIELDS}
+
+    columns['pkt_id'] = pc.cast(batch.column('pkt_id'), pa.binary()).to_numpy(zero_copy_only=False).astype(np.bytes_)
+    columns['ts_us'] = batch.column('ts_us').to_numpy(zero_copy_only=False).astype(np.int64, copy=False)
+    columns['is_tx'] = pc.equal(batch.column('event'), 'tx').to_numpy(zero_copy_only=False)
+
+    for name in ('sinr_db', 'rssi_dbm'):
+        columns[name] = pc.fill_null(batch.column(name), np.nan).to_numpy(zero_copy_only=False)
+
+    return columns
+
+
+def take(columns: Dict[str, np.ndarray], fields: Tuple[str, ...], index) -> Dict[str, np.ndarray]:
+    return {name: columns[name][index] for name in fields}
+
+
+def concat(parts: List[Dict[str, np.ndarray]], fields: Tuple[str, ...]) -> Dict[str, np.ndarray]:
+    return {name: np.concatenate([part[name] for part in parts]) for name in fields}
+
+
+class SortedRuns:
+    """
+    Множество tx, упорядоченных по pkt_id, в виде нескольких отсортированных серий массивов (как в LSM-дереве).
+    Новые tx каждого пакета добавляются отдельной серией, а соседние серии сливаются, когда последняя становится
+    не меньше предыдущей, поэтому серий O(log n), а каждая запись пересортировывается O(log n) раз. Поиск
+    выполняется через searchsorted в каждой серии. pkt_id в сериях не повторяются
+    """
+
+    def __init__(self) -> None:
+        self._runs: List[Dict[str, np.ndarray]] = []
+        self._size = 0
+
+    def __len__(self) -> int:
+        return self._size
+
+    @property
+    def runs(self) -> List[Dict[str, np.ndarray]]:
+        return self._runs
+
+    def add(self, run: Dict[str, np.ndarray]) -> None:
+        """
+        Добавление серии
+        :param:
+            run: - колонки pkt_id и TX_FIELDS, отсортированные по pkt_id
+        """
+
+        if len(run['pkt_id']) == 0:
+            return
+
+        self._size += len(run['pkt_id'])
+        self._runs.append(run)
+
+        while len(self._runs) > 1 and len(self._runs[-2]['pkt_id']) <= len(self._runs[-1]['pkt_id']):
+            last = self._runs.pop()
+            merged = concat([self._runs.pop(), last], ('pkt_id',) + TX_FIELDS)
+            order = np.argsort(merged['pkt_id'], kind='stable')
+            self._runs.append(take(merged, ('pkt_id',) + TX_FIELDS, order))
+
+    def lookup(self, keys: np.ndarray) -> Tuple[np.ndarray, Dict[str, np.ndarray]]:
+        """
+        Поиск tx по pkt_id
+        :param:
+            keys: - искомые pkt_id
+        :return:
+            (found, fields): - маска найденных ключей и поля найденных tx (для ненайденных ключей нули)
+        """
+
+        found = np.zeros(len(keys), dtype=bool)
+        fields = {name: np.zeros(len(keys), dtype=np.int64) for name in TX_FIELDS}
+
+        for run in self._runs:
+            position, hit = search(run['pkt_id'], keys)
+            hit &= ~found
+            for name in TX_FIELDS:
+                fields[name][hit] = run[name][position[hit]]
+            found |= hit
+
+        return found, fields
+
+
+def search(sorted_keys: np.ndarray, keys: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Поиск ключей в отсортированном массиве
+    :return:
+        (position, found): - позиции ключей в sorted_keys и маска найденных ключей
+    """
+
+    if len(sorted_keys) == 0:
+        return np.zeros(len(keys), dtype=np.intp), np.zeros(len(keys), dtype=bool)
+
+    position = np.minimum(np.searchsorted(sorted_keys, keys), len(sorted_keys) - 1)
+    return position, sorted_keys[position] == keys
+
+
+class BatchMatches:
+    """
+    Результат сопоставления одного пакета: новые tx (для счетчиков tx), успешно сопоставленные пары tx/rx и
+    количество аномалий
+    """
+
+    def __init__(self, new_tx: Dict[str, np.ndarray], tx: Dict[str, np.ndarray], rx: Dict[str, np.ndarray],
+                 anomalies: Dict[str, int], removed_tx: Optional[Dict[str, np.ndarray]] = None) -> None:
+        """
+        :param:
+            new_tx: - колонки TX_FIELDS первых tx каждого pkt_id
+            tx: - колонки TX_FIELDS tx в сопоставленных парах
+            rx: - колонки RX_FIELDS rx в сопоставленных парах (в том же порядке, что и tx)
+            anomalies: - количество аномалий каждого типа в пакете
+            removed_tx: - колонки TX_FIELDS tx, учет которых отменяется (дубликаты, найденные при объединении)
+        """
+
+        self.new_tx = new_tx
+        self.removed_tx = removed_tx if removed_tx is not None else {
+            name: np.empty(0, dtype=np.int64) for name in TX_FIELDS
+        }
+        self.tx = tx
+        self.rx = rx
+        self.anomalies = anomalies
+
+    @property
+    def latency(self) -> np.ndarray:
+        return self.rx['ts_us'] - self.tx['ts_us']
+
+
+class VectorizedMatcher:
+    """
+    Колоночное сопоставление tx и rx по pkt_id для целых пакетов записей. Повторяет семантику построчного
+    калькулятора: учитывается только первый tx каждого pkt_id (остальные - duplicate_tx), rx, пришедший раньше
+    своего tx, считается rx_without_tx и ждет tx, а каждый rx сопоставляется с первым tx. Порядок записей важен
+    только для этих двух аномалий и учитывается через номера строк, все остальное - маски и searchsorted.
+
+    Состояние между пакетами: все увиденные tx (SortedRuns, как словарь tx_records построчного калькулятора) и
+    rx, tx которых еще не пришел
+    """
+
+    def __init__(self) -> None:
+        self.tx_records = SortedRuns()
+        self.rx_records = {name: np.empty(0, dtype=np.int64) for name in TX_FIELDS}
+        self.rx_records.update({name: np.empty(0, dtype=np.float64) for name in ('sinr_db', 'rssi_dbm')})
+        self.rx_records['pkt_id'] = np.empty(0, dtype=np.bytes_)
+
+    @property
+    def pending_rx(self) -> int:
+        return len(self.rx_records['pkt_id'])
+
+    def merge(self, other: 'VectorizedMatcher', code_map: np.ndarray) -> BatchMatches:
+        """
+        Перенос ожидающих tx и rx другого сопоставителя, поток которого считается продолжением потока этого.
+        Ожидающие rx этого сопоставителя сопоставляются с tx другого, а ожидающие rx другого - с tx этого (такие rx
+        больше не считаются rx_without_tx). tx с уже известным pkt_id учитываются как duplicate_tx
+        :param:
+            other: - второй сопоставитель
+            code_map: - перевод кодов src, dst и app второго сопоставителя в коды этого
+        :return:
+            BatchMatches: - пары, сопоставленные при объединении, и изменение счетчиков аномалий
+        """
+
+        def translate(columns: Dict[str, np.ndarray]) -> Dict[str, np.ndarray]:
+            return {
+                name: code_map[values] if name in ENCODED_FIELDS else values for name, values in columns.items()
+            }
+
+        anomalies = dict.fromkeys(('duplicate_tx', 'rx_without_tx', 'direction_mismatch', 'negative_latency'), 0)
+
+        pending_rx, other_rx = self.rx_records, translate(other.rx_records)
+
+        found, other_tx = other.tx_records.lookup(pending_rx['pkt_id'])
+        other_found, own_tx = self.tx_records.lookup(other_rx['pkt_id'])
+        anomalies['rx_without_tx'] = -int(np.count_nonzero(other_found))
+
+        duplicates = []
+        for run in other.tx_records.runs:
+            seen, _ = self.tx_records.lookup(run['pkt_id'])
+            duplicates.append(translate(take(run, TX_FIELDS, seen)))
+            self.tx_records.add(translate(take(run, ('pkt_id',) + TX_FIELDS, ~seen)))
+
+        removed_tx = concat(duplicates, TX_FIELDS) if duplicates else None
+        anomalies['duplicate_tx'] = len(removed_tx['ts_us']) if removed_tx is not None else 0
+
+        tx = concat([
+            translate({name: values[found] for name, values in other_tx.items()}),
+            {name: values[other_found] for name, values in own_tx.items()}
+        ], TX_FIELDS)
+        rx = concat([take(pending_rx, RX_FIELDS, found), take(other_rx, RX_FIELDS, other_found)], RX_FIELDS)
+
+        self.rx_records = concat([
+            take(pending_rx, ('pkt_id',) + RX_FIELDS, ~found),
+            take(other_rx, ('pkt_id',) + RX_FIELDS, ~other_found)
+        ], ('pkt_id',) + RX_FIELDS)
+
+        empty = {name: np.empty(0, dtype=np.int64) for name in TX_FIELDS}
+        matches = self._classify(empty, tx, rx, anomalies)
+        matches.removed_tx = removed_tx if removed_tx is not None else empty
+        return matches
+
+    def match(self, columns: Dict[str, np.ndarray]) -> BatchMatches:
+        """
+        Сопоставление пакета записей
+        :param:
+            columns: - колонки пакета (batch_columns)
+        :return:
+            BatchMatches: - новые tx, сопоставленные пары и аномалии пакета
+        """
+
+        anomalies = dict.fromkeys(('duplicate_tx', 'rx_without_tx', 'direction_mismatch', 'negative_latency'), 0)
+
+        keys = columns['pkt_id']
+        tx_rows = np.flatnonzero(columns['is_tx'])
+        rx_rows = np.flatnonzero(~columns['is_tx'])
+
+        # Первые tx каждого pkt_id, которого еще не было в предыдущих пакетах
+        seen, _ = self.tx_records.lookup(keys[tx_rows])
+        candidates = tx_rows[~seen]
+        new_keys, first = np.unique(keys[candidates], return_index=True)
+        new_rows = candidates[first]
+        anomalies['duplicate_tx'] = len(tx_rows) - len(new_rows)
+
+        # rx пакета: tx из предыдущих пакетов или первый tx этого пакета
+        rx_keys = keys[rx_rows]
+        in_state, state_tx = self.tx_records.lookup(rx_keys)
+        position, in_batch = search(new_keys, rx_keys)
+        in_batch &= ~in_state
+        tx_row = new_rows[position] if len(new_rows) else position
+
+        anomalies['rx_without_tx'] = int(np.count_nonzero(~in_state & ~(in_batch & (tx_row < rx_rows))))
+
+        # Ожидающие rx из предыдущих пакетов, tx которых пришел в этом пакете
+        pending_position, pending_found = search(new_keys, self.rx_records['pkt_id'])
+
+        tx = concat([
+            {name: state_tx[name][in_state] for name in TX_FIELDS},
+            take(columns, TX_FIELDS, tx_row[in_batch]),
+            take(columns, TX_FIELDS, new_rows[pending_position[pending_found]])
+        ], TX_FIELDS)
+        rx = concat([
+            take(columns, RX_FIELDS, rx_rows[in_state]),
+            take(columns, RX_FIELDS, rx_rows[in_batch]),
+            take(self.rx_records, RX_FIELDS, pending_found)
+        ], RX_FIELDS)
+
+        unmatched = rx_rows[~in_state & ~in_batch]
+        self.rx_records = concat([
+            take(self.rx_records, ('pkt_id',) + RX_FIELDS, ~pending_found),
+            take(columns, ('pkt_id',) + RX_FIELDS, unmatched)
+        ], ('pkt_id',) + RX_FIELDS)
+
+        new_tx = take(columns, TX_FIELDS, new_rows)
+        self.tx_records.add({'pkt_id': new_keys, **new_tx})
+
+        return self._classify(new_tx, tx, rx, anomalies)
+
+    @staticmethod
+    def _classify(new_tx: Dict[str, np.ndarray], tx: Dict[str, np.ndarray], rx: Dict[str, np.ndarray],
+                  anomalies: Dict[str, int]) -> BatchMatches:
+        """
+        Классификация пар tx/rx масками: неверное направление, отрицательная задержка, успешное сопоставление
+        """
+
+        mismatch = (tx['src'] != rx['dst']) | (tx['dst'] != rx['src'])
+        negative = ~mismatch & (rx['ts_us'] < tx['ts_us'])
+        valid = ~(mismatch | negative)
+
+        anomalies['direction_mismatch'] = int(np.count_nonzero(mismatch))
+        anomalies['negative_latency'] = int(np.count_nonzero(negative))
+
+        for name, count in anomalies.items():
+            if count:
+                logger.debug(f"Изменение счетчика {name}: {count}")
+
+        return BatchMatches(
+            new_tx=new_tx,
+            tx={name: values[valid] for name, values in tx.items()},
+            rx={name: values[valid] for name, values in rx.items()},
+            anomalies=anomalies
+        )
+
+
+def group_rows(*columns: np.ndarray) -> Tuple[List, np.ndarray]:
+    """
+    Группировка строк по значениям одной или нескольких целочисленных колонок
+    :return:
+        (keys, inverse): - ключи групп (число или кортеж чисел) и номер группы каждой строки
+    """
+
+    if len(columns) == 1:
+        keys, inverse = np.unique(columns[0], return_inverse=True)
+        return keys.tolist(), inverse.ravel()
+
+    # Номера значений в каждой колонке объединяются в одно число (смешанная система счисления), поэтому
+    # сортируется один массив int64, а не строки из нескольких колонок
+    uniques = []
+    combined = np.zeros(len(columns[0]), dtype=np.int64)
+    for column in columns:
+        values, column_inverse = np.unique(column, return_inverse=True)
+        uniques.append(values)
+        combined = combined * len(values) + column_inverse.ravel()
+
+    codes, inverse = np.unique(combined, return_inverse=True)
+
+    parts = []
+    for values in reversed(uniques):
+        parts.append(values[codes % len(values)].tolist())
+        codes = codes // len(values)
+
+    return list(zip(*reversed(parts))), inverse.ravel()
+
+
+def group_moments(inverse: np.ndarray, values: np.ndarray, groups: int) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """
+    Количество, среднее и сумма квадратов отклонений (M2) значений каждой группы, NaN пропускаются
+    :return:
+        (count, mean, m2): - массивы длины groups
+    """
+
+    valid = ~np.isnan(values)
+    inverse, values = inverse[valid], values[valid]
+
+    count = np.bincount(inverse, minlength=groups)
+    mean = np.bincount(inverse, weights=values, minlength=groups) / np.maximum(count, 1)
+    m2 = np.bincount(inverse, weights=(values - mean[inverse]) ** 2, minlength=groups)
+
+    return count, mean, m2
+
+
+def split_by_group(inverse: np.ndarray, values: np.ndarray, groups: int) -> List[np.ndarray]:
+    """
+    Разбиение значений по группам с сохранением порядка внутри группы
+    """
+
+    order = np.argsort(inverse, kind='stable')
+    bounds = np.cumsum(np.bincount(inverse, minlength=groups))[:-1]
+    return np.split(values[order], bounds)
+
+
+def group_percentiles(values: np.ndarray, counts: np.ndarray, percentiles: Sequence[float]) -> np.ndarray:
+    """
+    Перцентили значений каждой группы за одну сортировку. Значения групп идут подряд, внутри группы в любом
+    порядке. Интерполяция линейная и вычисляется так же, как в np.percentile, поэтому результат совпадает с
+    расчетом по каждой группе отдельно
+    :param:
+        values: - значения всех групп подряд
+        counts: - количество значений каждой группы
+        percentiles: - перцентили в процентах
+    :return:
+        np.ndarray: - массив (количество групп, количество перцентилей), для пустых групп 0.0
+    """
+
+    result = np.zeros((len(counts), len(percentiles)))
+
+    filled = counts > 0
+    if not filled.any():
+        return result
+
+    group_ids = np.repeat(np.arange(len(counts)), counts)
+    values = values[np.lexsort((values, group_ids))]
+
+    counts = counts[filled]
+    starts = (np.cumsum(counts) - counts)[:, None]
+    last = (counts - 1)[:, None]
+
+    virtual = last * np.true_divide(percentiles, 100)
+    previous = np.floor(virtual)
+    gamma = virtual - previous
+
+    previous = np.minimum(previous.astype(np.intp), last)
+    lower = values[starts + previous]
+    upper = values[starts + np.minimum(previous + 1, last)]
+
+    difference = upper - lower
+    result[filled] = np.where(gamma >= 0.5, upper - difference * (1 - gamma), lower + difference * gamma)
+
+    return result
@@ -0,0 +1,86 @@
+import os
+import sys
+import json
+import logging
+
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+from pathlib import Path
+from typing import Callable, Optional, TextIO, Union
+
+current_dir = os.path.dirname(os.path.abspath(__file__))
+project_root = os.path.dirname(os.path.join(current_dir, '..', '..'))
+sys.path.insert(0, project_root)
+
+from configs.interfaces import WindowSinkInterface
+
+logger = logging.getLogger(__name__)
+
+
+class ParquetWindowSink(WindowSinkInterface):
+    """
+    Приемник закрытых окон, дописывающий их row group'ами в один Parquet файл
+    """
+
+    def __init__(self, path: Union[str, Path]) -> None:
+        """
+        :param:
+            path: - путь к Parquet файлу, файл создается при первой записи
+        """
+
+        self.path = Path(path)
+        self._writer: Optional[pq.ParquetWriter] = None
+        self.rows = 0
+
+    def write(self, table: pa.Table) -> None:
+        if self._writer is None:
+            self._writer = pq.ParquetWriter(self.path, table.schema)
+            logger.info(f"Закрытые окна записываются в {self.path}")
+
+        self._writer.write_table(table)
+        self.rows += table.num_rows
+
+    def close(self) -> None:
+        if self._writer is not None:
+            self._writer.close()
+            self._writer = None
+            logger.info(f"В {self.path} записано {self.rows} строк окон")
+
+
+class NJsonWindowSink(WindowSinkInterface):
+    """
+    Приемник закрытых окон, выводящий каждую строку окна JSON объектом в поток (по умолчанию stdout)
+    """
+
+    def __init__(self, stream: Optional[TextIO] = None) -> None:
+        """
+        :param:
+            stream: - текстовый поток, None - sys.stdout
+        """
+
+        self.stream = stream
+
+    def write(self, table: pa.Table) -> None:
+        stream = self.stream if self.stream is not None else sys.stdout
+
+        for row in table.to_pylist():
+            stream.write(json.dumps(row, ensure_ascii=False) + '\n')
+        stream.flush()
+
+
+class CallbackWindowSink(WindowSinkInterface):
+    """
+    Приемник закрытых окон, передающий каждую таблицу окон в функцию
+    """
+
+    def __init__(self, callback: Callable[[pa.Table], None]) -> None:
+        """
+        :param:
+            callback: - функция, получающая таблицу закрытых окон
+        """
+
+        self.callback = callback
+
+    def write(self, table: pa.Table) -> None:
+        self.callback(table)
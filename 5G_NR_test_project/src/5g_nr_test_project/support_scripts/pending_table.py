@@ -0,0 +1,318 @@
+import os
+import sys
+
+import numpy as np
+
+from typing import Iterator, Optional
+
+current_dir = os.path.dirname(os.path.abspath(__file__))
+project_root = os.path.dirname(os.path.join(current_dir, '..', '..'))
+sys.path.insert(0, project_root)
+
+from configs.models import ParseResult, PacketRecord
+from support_scripts.symbol_table import SymbolTable
+
+EMPTY = -1
+DELETED = -2
+
+TAG_MASK = (1 << 32) - 1
+
+LIVE = 1
+MATCHED = 2
+
+ENTRY_DTYPE = np.dtype([
+    ('tag', np.uint32),
+    ('ts_us', np.int64),
+    ('bytes', np.int32),
+    ('src', np.int32),
+    ('dst', np.int32),
+    ('app', np.int32),
+    ('key_offset', np.uint32),
+    ('key_len', np.uint16),
+    ('flags', np.uint8),
+])
+
+
+class PendingPacketTable:
+    """
+    Таблица ожидающих tx на массивах NumPy с открытой адресацией. Используется калькулятором вместо словаря
+    pkt_id -> запись, когда ожидающих пакетов миллионы.
+
+    pkt_id хэшируется встроенным 64-битным hash, младшие 32 бита сохраняются как метка записи и задают
+    последовательность пробирования слотов (как в dict CPython), удаленные слоты помечаются tombstone. Слоты хранят
+    только номер записи (int32), а поля записей лежат в плотном структурированном массиве (35 байт на запись):
+    метка, ts_us, bytes, коды src/dst/app и положение pkt_id в общем байтовом буфере. Совпадение метки проверяется сравнением полного pkt_id, поэтому
+    коллизии хэша не приводят к ошибкам. Плотный массив растет в 1.25 раза, а при накоплении удаленных записей
+    таблица уплотняется, поэтому на одну ожидающую запись приходится ~35 байт полей, 5-11 байт слотов и сам pkt_id.
+
+    Хранятся только поля, нужные для сопоставления tx и rx: ts_us, src, dst, app, bytes (int32). Запись,
+    возвращаемая по ключу, собирается заново как PacketRecord с event = 'tx'.
+    """
+
+    def __init__(self, capacity: int = 1024, max_load: float = 0.75, symbols: Optional[SymbolTable] = None) -> None:
+        """
+        :param:
+            capacity: - начальное количество записей
+            max_load: - максимальная доля занятых слотов (живые записи и tombstone)
+            symbols: - общая таблица символов, если записи уже несут коды src/dst/app. Без нее таблица кодирует
+                       строки своей таблицей символов и возвращает записи со строками
+        """
+
+        self.max_load = max_load
+
+        self._encoded = symbols is not None
+        self._symbols = symbols if symbols is not None else SymbolTable()
+
+        self._set_entries(np.zeros(capacity, dtype=ENTRY_DTYPE))
+
+        self._arena = bytearray()
+        self._used = 0
+        self._size = 0
+
+        self._rehash()
+
+    def _set_entries(self, entries: np.ndarray) -> None:
+        """
+        Замена плотного массива записей и представлений его полей
+        """
+
+        self._entries = entries
+        self._tags = entries['tag']
+        self._ts_us = entries['ts_us']
+        self._bytes = entries['bytes']
+        self._src = entries['src']
+        self._dst = entries['dst']
+        self._app = entries['app']
+        self._key_offset = entries['key_offset']
+        self._key_len = entries['key_len']
+        self._flags = entries['flags']
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        for name in ('_tags', '_ts_us', '_bytes', '_src', '_dst', '_app', '_key_offset', '_key_len', '_flags', '_slots'):
+            del state[name]
+        return state
+
+    def __setstate__(self, state) -> None:
+        """
+        Восстановление после передачи в другой процесс: встроенный hash строк зависит от процесса, поэтому метки
+        живых записей считаются заново, и слоты пересобираются
+        """
+
+        self.__dict__.update(state)
+        self._set_entries(self._entries)
+
+        live = np.flatnonzero(self._flags[:self._used] & LIVE)
+        self._tags[live] = [hash(self._key(entry).decode('utf-8')) & TAG_MASK for entry in live.tolist()]
+        self._rehash()
+
+    def __len__(self) -> int:
+        return self._size
+
+    def __contains__(self, pkt_id: str) -> bool:
+        return self._find(pkt_id)[0] >= 0
+
+    def __iter__(self) -> Iterator[str]:
+        for entry in np.flatnonzero(self._flags[:self._used] & LIVE):
+            yield self._key(entry).decode('utf-8')
+
+    def keys(self) -> Iterator[str]:
+        return iter(self)
+
+    def __getitem__(self, pkt_id: str) -> PacketRecord:
+        entry = self._find(pkt_id)[0]
+        if entry < 0:
+            raise KeyError(pkt_id)
+        return self._record(entry, pkt_id)
+
+    def get(self, pkt_id: str, default=None) -> Optional[PacketRecord]:
+        entry = self._find(pkt_id)[0]
+        return self._record(entry, pkt_id) if entry >= 0 else default
+
+    def __setitem__(self, pkt_id: str, record: PacketRecord | ParseResult) -> None:
+        entry, slot = self._find(pkt_id)
+
+        if entry < 0:
+            entry, key = self._insert(pkt_id, slot)
+            tag, key_offset, key_len = hash(pkt_id) & TAG_MASK, len(self._arena), len(key)
+            self._arena += key
+        else:
+            tag, key_offset, key_len = self._tags.item(entry), self._key_offset.item(entry), self._key_len.item(entry)
+
+        if self._encoded:
+            src, dst, app = record.src, record.dst, record.app
+        else:
+            encode = self._symbols.encode
+            src, dst, app = encode(record.src), encode(record.dst), encode(record.app)
+
+        self._entries[entry] = (tag, record.ts_us, record.bytes, src, dst, app, key_offset, key_len, LIVE)
+
+    def __delitem__(self, pkt_id: str) -> None:
+        entry, slot = self._find(pkt_id)
+        if entry < 0:
+            raise KeyError(pkt_id)
+
+        self._slots[slot] = DELETED
+        self._flags[entry] = 0
+        self._size -= 1
+
+    def mark_matched(self, pkt_id: str) -> None:
+        """
+        Отметка, что для tx найдена пара (нужна при вытеснении, чтобы не считать пакет потерянным)
+        """
+
+        entry = self._find(pkt_id)[0]
+        if entry >= 0:
+            self._flags[entry] |= MATCHED
+
+    def is_matched(self, pkt_id: str) -> bool:
+        entry = self._find(pkt_id)[0]
+        return entry >= 0 and bool(self._flags.item(entry) & MATCHED)
+
+    @property
+    def nbytes(self) -> int:
+        """
+        Объем памяти, занятый массивами таблицы и буфером ключей
+        """
+
+        return self._slots.nbytes + self._entries.nbytes + len(self._arena)
+
+    def _find(self, pkt_id: str):
+        """
+        Поиск записи по pkt_id
+        :return:
+            (entry, slot): - номер записи (-1, если ключа нет) и слот, в котором запись лежит или может быть вставлена
+        """
+
+        tag = hash(pkt_id) & TAG_MASK
+        key = None
+
+        slots = self._slots
+        tags = self._tags
+        mask = self._mask
+        slot = tag & mask
+        perturb = tag
+        free_slot = -1
+
+        while True:
+            entry = slots.item(slot)
+
+            if entry == EMPTY:
+                return -1, (free_slot if free_slot >= 0 else slot)
+
+            if entry == DELETED:
+                if free_slot < 0:
+                    free_slot = slot
+            elif tags.item(entry) == tag:
+                if key is None:
+                    key = pkt_id.encode('utf-8')
+                if self._key(entry) == key:
+                    return entry, slot
+
+            perturb >>= 5
+            slot = (5 * slot + 1 + perturb) & mask
+
+    def _insert(self, pkt_id: str, slot: int):
+        """
+        Выделение новой записи под ключ pkt_id в свободном слоте
+        :return:
+            (entry, key): - номер новой записи и pkt_id в байтах
+        """
+
+        if self._used == len(self._entries) or (self._slots[slot] == EMPTY and self._filled >= self._max_filled):
+            self._grow()
+            slot = self._find(pkt_id)[1]
+
+        if self._slots[slot] == EMPTY:
+            self._filled += 1
+
+        entry = self._used
+        self._used += 1
+        self._size += 1
+        self._slots[slot] = entry
+
+        return entry, pkt_id.encode('utf-8')
+
+    def _grow(self) -> None:
+        """
+        Освобождение места: если удаленных записей много, таблица уплотняется, иначе плотный массив растет
+        в 1.25 раза. Слоты пересобираются, если номера записей изменились, слотов стало не хватать или их
+        заполнили tombstone
+        """
+
+        if self._size <= self._used * 3 // 4:
+            self._compact()
+        elif self._used == len(self._entries):
+            entries = np.zeros(max(self._used + 8, self._used * 5 // 4), dtype=ENTRY_DTYPE)
+            entries[:self._used] = self._entries[:self._used]
+            self._set_entries(entries)
+
+            if self._max_filled >= len(entries):
+                return
+
+        self._rehash()
+
+    def _compact(self) -> None:
+        """
+        Удаление из плотного массива и буфера ключей записей, которые были удалены из таблицы. Если живых записей
+        стало меньше половины, массив уменьшается, чтобы память не оставалась на уровне пика
+        """
+
+        live = np.flatnonzero(self._flags[:self._used] & LIVE)
+        count = len(live)
+
+        keys = [self._key(entry) for entry in live]
+
+        capacity = len(self._entries)
+        if count * 2 < capacity:
+            capacity = max(8, count * 5 // 4 + 8)
+
+        entries = np.zeros(capacity, dtype=ENTRY_DTYPE)
+        entries[:count] = self._entries[live]
+        self._set_entries(entries)
+
+        lengths = self._key_len[:count].astype(np.uint64)
+        self._key_offset[:count] = np.cumsum(lengths) - lengths
+        self._arena = bytearray(b''.join(keys))
+
+        self._used = self._size = count
+
+    def _rehash(self) -> None:
+        """
+        Пересборка слотов по меткам живых записей и очистка tombstone. Количество слотов выбирается так, чтобы
+        все записи плотного массива помещались в слоты с заполнением не больше max_load
+        """
+
+        capacity = 8
+        while capacity * self.max_load < len(self._entries):
+            capacity *= 2
+
+        mask = capacity - 1
+        slots = [EMPTY] * capacity
+
+        live = np.flatnonzero(self._flags[:self._used] & LIVE)
+        for entry, tag in zip(live.tolist(), self._tags[live].tolist()):
+            slot = tag & mask
+            perturb = tag
+            while slots[slot] != EMPTY:
+                perturb >>= 5
+                slot = (5 * slot + 1 + perturb) & mask
+            slots[slot] = entry
+
+        self._slots = np.array(slots, dtype=np.int32)
+        self._mask = mask
+        self._filled = len(live)
+        self._max_filled = int(capacity * self.max_load)
+
+    def _key(self, entry: int) -> bytes:
+        offset = self._key_offset.item(entry)
+        return bytes(self._arena[offset:offset + self._key_len.item(entry)])
+
+    def _record(self, entry: int, pkt_id: str) -> PacketRecord:
+        _, ts_us, size, src, dst, app, _, _, _ = self._entries.item(entry)
+
+        if not self._encoded:
+            decode = self._symbols.decode
+            src, dst, app = decode(src), decode(dst), decode(app)
+
+        return PacketRecord(ts_us=ts_us, event='tx', src=src, dst=dst, pkt_id=pkt_id, app=app, bytes=size)
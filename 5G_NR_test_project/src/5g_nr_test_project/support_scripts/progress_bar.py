@@ -1,21 +1,24 @@
 from tqdm import tqdm
 from pathlib import Path
+from typing import List, Union
 
 
 class ProgressBar:
 
     @staticmethod
-    def create_parser_progress_bar(file_path: Path) -> tqdm:
+    def create_parser_progress_bar(file_path: Union[Path, List[Path]]) -> tqdm:
         """
         Создаем строку прогресса для вывода статуса загрузки файла в консоль
         :param:
-            file_path: - путь к файлу, статус которого будет анализировать
+            file_path: - путь к файлу, статус которого будет анализировать, или список файлов, которые
+                         читаются одновременно (общая строка прогресса по сумме строк)
         :return:
             tqdm: - Тип данных для быстрого построения строки прогресса
         """
 
         try:
-            total_lines_cnt = ProgressBar.count_lines(file_path)
+            file_paths = file_path if isinstance(file_path, list) else [file_path]
+            total_lines_cnt = sum(ProgressBar.count_lines(path) for path in file_paths)
         except Exception:
             total_lines_cnt = None
 
@@ -39,3 +42,22 @@ class ProgressBar:
 
         with open(file_path, "r", encoding='utf-8') as f:
             return sum(1 for _ in f)
+
+    @staticmethod
+    def create_bytes_progress_bar(total_bytes: int, desc: str = "Parsing") -> tqdm:
+        """
+        Создаем строку прогресса по количеству обработанных байт (для параллельной обработки частями файла)
+        :param:
+            total_bytes: - общий объем данных в байтах
+            desc: - подпись строки прогресса
+        :return:
+            tqdm: - Тип данных для быстрого построения строки прогресса
+        """
+
+        return tqdm(
+            desc=desc,
+            total=total_bytes,
+            unit="B",
+            unit_scale=True,
+            ncols=100
+        )
@@ -0,0 +1,237 @@
+import math
+
+from typing import Dict, Iterable, List, Optional
+
+
+DEFAULT_RELATIVE_ACCURACY = 0.01
+DEFAULT_MAX_BUCKETS = 2048
+DEFAULT_EXACT_LIMIT = 64
+
+
+class LogMapping:
+    """
+    Отображение значений в логарифмические корзины для заданной относительной точности. Один объект
+    разделяется всеми скетчами с одинаковыми параметрами
+    """
+
+    _cache: Dict[tuple, 'LogMapping'] = {}
+
+    def __init__(self, relative_accuracy: float, max_buckets: int) -> None:
+        if not 0 < relative_accuracy < 1:
+            raise ValueError(f"Относительная точность скетча должна быть в интервале (0, 1): {relative_accuracy}")
+
+        self.relative_accuracy = relative_accuracy
+        self.max_buckets = max_buckets
+        self.gamma = (1 + relative_accuracy) / (1 - relative_accuracy)
+        self.log_gamma = math.log(self.gamma)
+
+    @classmethod
+    def get(cls, relative_accuracy: float, max_buckets: int) -> 'LogMapping':
+        key = (relative_accuracy, max_buckets)
+        if key not in cls._cache:
+            cls._cache[key] = cls(relative_accuracy, max_buckets)
+        return cls._cache[key]
+
+    def __reduce__(self):
+        # После передачи между процессами скетчи снова разделяют объект из кэша, иначе их нельзя объединить
+        return LogMapping.get, (self.relative_accuracy, self.max_buckets)
+
+    def index(self, value: float) -> int:
+        return math.ceil(math.log(value) / self.log_gamma)
+
+    def value(self, index: int) -> float:
+        return 2 * self.gamma ** index / (self.gamma + 1)
+
+
+def _interpolate(sorted_values: List[float], q: float) -> float:
+    """
+    Линейная интерполяция перцентиля по отсортированному списку (как np.percentile)
+    """
+
+    position = q * (len(sorted_values) - 1)
+    lower_rank = math.floor(position)
+    upper_rank = min(lower_rank + 1, len(sorted_values) - 1)
+
+    lower, upper = sorted_values[lower_rank], sorted_values[upper_rank]
+    return lower + (upper - lower) * (position - lower_rank)
+
+
+class LatencySketch:
+    """
+    Потоковый скетч квантилей с логарифмическими корзинами (по схеме DDSketch) для неотрицательных значений.
+
+    Значение x > 0 попадает в корзину i = ceil(log_gamma(x)), где gamma = (1 + a) / (1 - a), a - относительная
+    точность. Корзина i покрывает интервал (gamma^(i-1), gamma^i], а ее представитель 2 * gamma^i / (gamma + 1)
+    отличается от любого значения из интервала не более чем на a * x. Поэтому оценка любой порядковой статистики, а
+    значит и линейно интерполированного перцентиля (как в np.percentile), имеет относительную ошибку не больше a.
+    Нули хранятся отдельным счетчиком и возвращаются точно.
+
+    Пока в группе не больше exact_limit значений, они хранятся как есть и квантили считаются точно: большинство
+    групп (например, временные окна) маленькие, и корзины для них только увеличили бы расход памяти. После
+    превышения порога значения переносятся в корзины, и память группы больше не растет с количеством значений:
+    для a = 0.01 диапазон задержек от 1 мкс до 1000 с занимает ~1000 корзин. Если корзин становится больше
+    max_buckets, младшие корзины объединяются, и гарантия точности сохраняется только для квантилей, попадающих в
+    старшие корзины.
+
+    Скетч отвечает только за квантили: min и max хранятся точно, а среднее и стандартное отклонение ведет
+    отдельный накопитель RunningStats группы. Скетчи с одинаковыми параметрами можно объединять через merge.
+    """
+
+    __slots__ = ('_mapping', '_values', 'buckets', 'zero_count', 'count', '_min', '_max')
+
+    exact_limit = DEFAULT_EXACT_LIMIT
+
+    def __init__(self, relative_accuracy: float = DEFAULT_RELATIVE_ACCURACY,
+                 max_buckets: int = DEFAULT_MAX_BUCKETS) -> None:
+        """
+        :param:
+            relative_accuracy: - допустимая относительная ошибка квантилей, 0 < relative_accuracy < 1
+            max_buckets: - максимальное количество корзин в скетче
+        """
+
+        self._mapping = LogMapping.get(relative_accuracy, max_buckets)
+        self._values: Optional[List[float]] = []
+        self.buckets: Optional[Dict[int, int]] = None
+        self.zero_count = 0
+        self.count = 0
+        self._min = math.inf
+        self._max = -math.inf
+
+    @property
+    def relative_accuracy(self) -> float:
+        return self._mapping.relative_accuracy
+
+    def __len__(self) -> int:
+        return len(self._values) if self._values is not None else self.count
+
+    def append(self, value: float) -> None:
+        """
+        Добавление значения в скетч (интерфейс совпадает со списком задержек)
+        :param:
+            value: - неотрицательное значение задержки
+        """
+
+        if value < 0:
+            raise ValueError(f"Скетч поддерживает только неотрицательные значения: {value}")
+
+        if self._values is not None:
+            self._values.append(value)
+            if len(self._values) > self.exact_limit:
+                self._to_buckets()
+            return
+
+        self._add_to_buckets(value)
+
+    def extend(self, values: Iterable[float]) -> None:
+        for value in values:
+            self.append(value)
+
+    def _to_buckets(self) -> None:
+        """
+        Перенос точно хранимых значений в корзины
+        """
+
+        values, self._values = self._values, None
+        self.buckets = {}
+
+        for value in values:
+            self._add_to_buckets(value)
+
+    def _add_to_buckets(self, value: float) -> None:
+        self.count += 1
+
+        if value < self._min:
+            self._min = value
+        if value > self._max:
+            self._max = value
+
+        if value == 0:
+            self.zero_count += 1
+            return
+
+        index = self._mapping.index(value)
+        self.buckets[index] = self.buckets.get(index, 0) + 1
+
+        if len(self.buckets) > self._mapping.max_buckets:
+            self._collapse()
+
+    def merge(self, other: 'LatencySketch') -> None:
+        """
+        Объединение со скетчем, построенным по другой части данных
+        :param:
+            other: - скетч с теми же параметрами точности
+        """
+
+        if other._mapping is not self._mapping:
+            raise ValueError("Объединять можно только скетчи с одинаковой относительной точностью")
+
+        if other._values is not None:
+            self.extend(other._values)
+            return
+
+        if other.count == 0:
+            return
+
+        if self._values is not None:
+            self._to_buckets()
+
+        self.count += other.count
+
+        self._min = min(self._min, other._min)
+        self._max = max(self._max, other._max)
+
+        self.zero_count += other.zero_count
+        for index, bucket_count in other.buckets.items():
+            self.buckets[index] = self.buckets.get(index, 0) + bucket_count
+
+        if len(self.buckets) > self._mapping.max_buckets:
+            self._collapse()
+
+    def _collapse(self) -> None:
+        """
+        Объединение младших корзин, чтобы количество корзин не превышало max_buckets
+        """
+
+        indexes = sorted(self.buckets)
+        excess = len(indexes) - self._mapping.max_buckets + 1
+
+        collapsed = sum(self.buckets.pop(index) for index in indexes[:excess])
+        self.buckets[indexes[excess]] += collapsed
+
+    def _value_at_rank(self, rank: int, sorted_buckets) -> float:
+        """
+        Оценка порядковой статистики с номером rank (нумерация с нуля)
+        """
+
+        if rank < self.zero_count:
+            return 0.0
+
+        seen = self.zero_count
+        for index, bucket_count in sorted_buckets:
+            seen += bucket_count
+            if seen > rank:
+                return min(max(self._mapping.value(index), self._min), self._max)
+
+        return self._max
+
+    def quantile(self, q: float) -> Optional[float]:
+        """
+        Оценка квантиля с линейной интерполяцией между соседними порядковыми статистиками, как в np.percentile
+        :param:
+            q: - уровень квантиля в интервале [0, 1]
+        :return:
+            Optional[float]: - оценка квантиля или None для пустого скетча
+        """
+
+        if self._values is not None:
+            return _interpolate(sorted(self._values), q) if self._values else None
+
+        position = q * (self.count - 1)
+        lower_rank = math.floor(position)
+        upper_rank = min(lower_rank + 1, self.count - 1)
+
+        sorted_buckets = sorted(self.buckets.items())
+        lower = self._value_at_rank(lower_rank, sorted_buckets)
+        upper = self._value_at_rank(upper_rank, sorted_buckets)
+
+        return lower + (upper - lower) * (position - lower_rank)
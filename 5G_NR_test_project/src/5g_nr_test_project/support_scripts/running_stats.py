@@ -0,0 +1,87 @@
+import math
+
+from typing import Optional
+
+
+class RunningStats:
+    """
+    Онлайн-накопитель количества, среднего и дисперсии по алгоритму Уэлфорда. Хранит O(1) данных, поэтому среднее
+    и стандартное отклонение доступны в любой момент обработки без хранения самих значений. Накопители, собранные
+    по разным частям данных, объединяются через merge (формула Чана)
+    """
+
+    __slots__ = ('count', 'mean', '_m2')
+
+    def __init__(self) -> None:
+        self.count = 0
+        self.mean = 0.0
+        self._m2 = 0.0
+
+    @classmethod
+    def from_moments(cls, count: int, mean: float, m2: float) -> 'RunningStats':
+        """
+        Накопитель по уже посчитанным моментам части данных (например, векторно по пакету записей)
+        :param:
+            count: - количество значений
+            mean: - среднее значений
+            m2: - сумма квадратов отклонений от среднего
+        """
+
+        stats = cls()
+        stats.count, stats.mean, stats._m2 = count, mean, m2
+        return stats
+
+    def __len__(self) -> int:
+        return self.count
+
+    def update(self, value: float) -> None:
+        """
+        Добавление значения в накопитель
+        :param:
+            value: - новое значение
+        """
+
+        self.count += 1
+        delta = value - self.mean
+        self.mean += delta / self.count
+        self._m2 += delta * (value - self.mean)
+
+    def merge(self, other: 'RunningStats') -> None:
+        """
+        Объединение с накопителем, собранным по другой части данных
+        :param:
+            other: - второй накопитель
+        """
+
+        if other.count == 0:
+            return
+
+        count = self.count + other.count
+        delta = other.mean - self.mean
+        self._m2 += other._m2 + delta * delta * self.count * other.count / count
+        self.mean += delta * other.count / count
+        self.count = count
+
+    @property
+    def variance(self) -> float:
+        """
+        Выборочная дисперсия (как statistics.variance)
+        """
+
+        return self._m2 / (self.count - 1) if self.count > 1 else 0.0
+
+    @property
+    def std(self) -> float:
+        """
+        Выборочное стандартное отклонение (как statistics.stdev)
+        """
+
+        return math.sqrt(self.variance)
+
+    @property
+    def avg(self) -> Optional[float]:
+        """
+        Среднее или None, если значений еще не было
+        """
+
+        return self.mean if self.count > 0 else None
@@ -0,0 +1,218 @@
+import math
+import hashlib
+
+import numpy as np
+
+from typing import List, Tuple, Union
+
+
+DEFAULT_ERROR_RATE = 0.001
+DEFAULT_INITIAL_CAPACITY = 1 << 16
+
+# Во сколько раз емкость следующего фильтра больше предыдущего и во сколько раз меньше его вероятность ложного
+# срабатывания: сумма вероятностей всех фильтров не превышает error_rate
+GROWTH = 2
+TIGHTENING = 0.5
+
+
+def key_hashes(pkt_id: Union[str, bytes]) -> tuple:
+    """
+    Два 64-битных хэша pkt_id для двойного хэширования. Используется blake2b, а не встроенный hash, который
+    отличается между процессами, поэтому фильтр можно сохранить в состоянии и объединить с фильтром другого процесса
+    """
+
+    if isinstance(pkt_id, str):
+        pkt_id = pkt_id.encode('utf-8')
+    digest = hashlib.blake2b(pkt_id, digest_size=16).digest()
+    return int.from_bytes(digest[:8], 'little'), int.from_bytes(digest[8:], 'little') | 1
+
+
+def key_hashes_array(pkt_ids: List[Union[str, bytes]]) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Хэши key_hashes для списка pkt_id в виде двух массивов uint64
+    """
+
+    blake2b = hashlib.blake2b
+    digests = b''.join([
+        blake2b(pkt_id.encode('utf-8') if isinstance(pkt_id, str) else pkt_id, digest_size=16).digest()
+        for pkt_id in pkt_ids
+    ])
+    hashes = np.frombuffer(digests, dtype='<u8').reshape(-1, 2)
+    return hashes[:, 0].astype(np.uint64), hashes[:, 1] | np.uint64(1)
+
+
+class _BloomStage:
+    """
+    Фильтр Блума фиксированной емкости: m бит в bytearray и k позиций (h1 mod m + i * (h2 mod m)) mod m на ключ.
+    Позиции считаются по остаткам, чтобы построчная проверка работала с небольшими целыми, а векторная - с int64
+    """
+
+    __slots__ = ('bits', 'size', 'hash_count', 'capacity', 'count', 'error_rate')
+
+    def __init__(self, capacity: int, error_rate: float) -> None:
+        self.capacity = capacity
+        self.error_rate = error_rate
+        self.size = max(8, math.ceil(-capacity * math.log(error_rate) / math.log(2) ** 2))
+        self.hash_count = max(1, math.ceil(-math.log2(error_rate)))
+        self.bits = bytearray((self.size + 7) // 8)
+        self.count = 0
+
+    def contains(self, h1: int, h2: int) -> bool:
+        bits, size = self.bits, self.size
+        start, step = h1 % size, h2 % size
+
+        # Для нового ключа проверка обычно заканчивается на первых позициях
+        for index in range(self.hash_count):
+            position = (start + index * step) % size
+            if not bits[position >> 3] & (1 << (position & 7)):
+                return False
+        return True
+
+    def add(self, h1: int, h2: int) -> None:
+        bits, size = self.bits, self.size
+        start, step = h1 % size, h2 % size
+
+        for index in range(self.hash_count):
+            position = (start + index * step) % size
+            bits[position >> 3] |= 1 << (position & 7)
+        self.count += 1
+
+    def array_positions(self, h1: np.ndarray, h2: np.ndarray) -> np.ndarray:
+        size = np.uint64(self.size)
+        start, step = (h1 % size).astype(np.int64), (h2 % size).astype(np.int64)
+        index = np.arange(self.hash_count, dtype=np.int64)[:, None]
+        return (start[None, :] + index * step[None, :]) % self.size
+
+    def contains_array(self, h1: np.ndarray, h2: np.ndarray) -> np.ndarray:
+        positions = self.array_positions(h1, h2)
+        bits = np.frombuffer(self.bits, dtype=np.uint8)
+        return np.all(bits[positions >> 3] & (1 << (positions & 7)).astype(np.uint8), axis=0)
+
+    def add_array(self, h1: np.ndarray, h2: np.ndarray) -> None:
+        positions = self.array_positions(h1, h2).ravel()
+        bits = np.frombuffer(self.bits, dtype=np.uint8)
+        np.bitwise_or.at(bits, positions >> 3, (1 << (positions & 7)).astype(np.uint8))
+        self.count += len(h1)
+
+    @property
+    def fill_ratio(self) -> float:
+        return int.from_bytes(self.bits, 'little').bit_count() / self.size
+
+
+class SeenFilter:
+    """
+    Масштабируемый фильтр Блума (Almeida et al., 2007) для множества увиденных pkt_id: отвечает, встречался ли
+    pkt_id раньше, без хранения самих pkt_id. Ложноотрицательных ответов нет, ложноположительные - с вероятностью
+    не больше error_rate. Когда текущий фильтр заполняется до своей емкости, добавляется следующий в GROWTH раз
+    больше с вероятностью ложного срабатывания в TIGHTENING раз меньше, поэтому память растет с количеством
+    уникальных pkt_id примерно на -log2(error_rate) * 1.44 бита на ключ (около 2 байт для 0.1%, вместе с незаполненной
+    частью последнего фильтра - до 5 байт) и не зависит от размера записей и времени ожидания пары.
+
+    Фактическая вероятность ложного срабатывания оценивается по заполненности фильтров (false_positive_rate)
+    """
+
+    __slots__ = ('error_rate', 'initial_capacity', 'stages')
+
+    # Хэши ключей: по умолчанию blake2b, одинаковый во всех процессах
+    hash_key = staticmethod(key_hashes)
+    hash_keys = staticmethod(key_hashes_array)
+
+    def __init__(self, error_rate: float = DEFAULT_ERROR_RATE,
+                 initial_capacity: int = DEFAULT_INITIAL_CAPACITY) -> None:
+        if not 0 < error_rate < 1:
+            raise ValueError(f"Вероятность ложного срабатывания должна быть в интервале (0, 1): {error_rate}")
+
+        self.error_rate = error_rate
+        self.initial_capacity = initial_capacity
+        self.stages: List[_BloomStage] = []
+
+    def __len__(self) -> int:
+        return sum(stage.count for stage in self.stages)
+
+    def _stage(self) -> _BloomStage:
+        """
+        Фильтр для новых ключей: последний, а если он заполнен - новый
+        """
+
+        if not self.stages or self.stages[-1].count >= self.stages[-1].capacity:
+            number = len(self.stages)
+            self.stages.append(_BloomStage(
+                self.initial_capacity * GROWTH ** number, self.error_rate * (1 - TIGHTENING) * TIGHTENING ** number
+            ))
+        return self.stages[-1]
+
+    def __contains__(self, pkt_id: Union[str, bytes]) -> bool:
+        h1, h2 = self.hash_key(pkt_id)
+        return any(stage.contains(h1, h2) for stage in self.stages)
+
+    def add(self, pkt_id: Union[str, bytes]) -> bool:
+        """
+        Проверка и добавление одного pkt_id
+        :param:
+            pkt_id: - идентификатор пакета
+        :return:
+            bool: - True, если pkt_id (вероятно) уже встречался. Такой pkt_id повторно не добавляется
+        """
+
+        h1, h2 = self.hash_key(pkt_id)
+        if any(stage.contains(h1, h2) for stage in self.stages):
+            return True
+
+        self._stage().add(h1, h2)
+        return False
+
+    def add_many(self, pkt_ids: np.ndarray) -> np.ndarray:
+        """
+        Проверка и добавление массива pkt_id, как при добавлении по одному в порядке массива: повтор внутри массива
+        определяется точно, а первые вхождения проверяются по фильтру
+        :param:
+            pkt_ids: - массив pkt_id (строки или байтовые строки)
+        :return:
+            np.ndarray: - маска pkt_id, которые (вероятно) уже встречались раньше
+        """
+
+        seen = np.ones(len(pkt_ids), dtype=bool)
+        if len(pkt_ids) == 0:
+            return seen
+
+        _, first = np.unique(pkt_ids, return_index=True)
+        first.sort()
+
+        h1, h2 = self.hash_keys(pkt_ids[first].tolist())
+
+        known = np.zeros(len(first), dtype=bool)
+        for stage in self.stages:
+            known |= stage.contains_array(h1, h2)
+        seen[first] = known
+
+        h1, h2 = h1[~known], h2[~known]
+        while len(h1):
+            stage = self._stage()
+            size = stage.capacity - stage.count
+            stage.add_array(h1[:size], h2[:size])
+            h1, h2 = h1[size:], h2[size:]
+
+        return seen
+
+    def merge(self, other: 'SeenFilter') -> None:
+        """
+        Объединение с фильтром, собранным по другой части данных: фильтры другого добавляются к своим, поэтому
+        проверка находит ключи обоих. Вероятность ложного срабатывания объединения - по false_positive_rate
+        """
+
+        self.stages.extend(other.stages)
+
+    @property
+    def false_positive_rate(self) -> float:
+        """
+        Оценка вероятности того, что новый pkt_id будет принят за уже встречавшийся: 1 - П(1 - fill^k) по фильтрам
+        """
+
+        probability = 1.0
+        for stage in self.stages:
+            probability *= 1 - stage.fill_ratio ** stage.hash_count
+        return 1 - probability
+
+    @property
+    def nbytes(self) -> int:
+        return sum(len(stage.bits) for stage in self.stages)
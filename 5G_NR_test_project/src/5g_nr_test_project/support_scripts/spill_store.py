@@ -0,0 +1,426 @@
+import os
+import sys
+import pickle
+import sqlite3
+import logging
+
+import numpy as np
+
+from itertools import islice
+from typing import Any, Callable, Dict, Iterator, List, Optional, Set, Tuple
+
+current_dir = os.path.dirname(os.path.abspath(__file__))
+project_root = os.path.dirname(os.path.join(current_dir, '..', '..'))
+sys.path.insert(0, project_root)
+
+from support_scripts.seen_filter import SeenFilter
+
+logger = logging.getLogger(__name__)
+
+# Оценка памяти одной ожидающей записи в словаре: слот словаря, PacketRecord со __slots__ и строка pkt_id
+ENTRY_BYTES = 320
+
+# Оценка памяти элемента очереди вытеснения по времени (кортеж (ts_us, pkt_id) и слот очереди) вместе с отметкой
+# сопоставленного tx
+EXPIRY_ENTRY_BYTES = 96
+
+# Доля бюджета, которая сбрасывается на диск за один раз: запись пачкой дешевле, чем по одной записи
+SPILL_FRACTION = 0.125
+
+# Вероятность ложного срабатывания фильтра сброшенных ключей: при срабатывании выполняется лишний запрос к диску
+SPILLED_FILTER_ERROR_RATE = 0.01
+
+# Количество ключей, читаемых с диска за один запрос при обходе
+SCAN_PAGE_SIZE = 1024
+
+# Множитель для второго хэша двойного хэширования из встроенного hash (2^64 / золотое сечение)
+HASH_MULTIPLIER = 0x9E3779B97F4A7C15
+HASH_MASK = (1 << 64) - 1
+
+MISSING = object()
+
+
+def local_key_hashes(pkt_id: str) -> Tuple[int, int]:
+    """
+    Два 64-битных хэша pkt_id из встроенного hash: быстрее blake2b, но отличаются между процессами
+    """
+
+    h1 = hash(pkt_id) & HASH_MASK
+    return h1, ((h1 * HASH_MULTIPLIER) & HASH_MASK) >> 1 | 1
+
+
+def local_key_hashes_array(pkt_ids: List[str]) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Хэши local_key_hashes для списка pkt_id в виде двух массивов uint64
+    """
+
+    h1 = np.fromiter(map(hash, pkt_ids), dtype=np.int64, count=len(pkt_ids)).view(np.uint64)
+    return h1, (h1 * np.uint64(HASH_MULTIPLIER)) >> np.uint64(1) | np.uint64(1)
+
+
+class _SpilledKeys(SeenFilter):
+    """
+    Фильтр Блума ключей, перенесенных на диск. Фильтр не сохраняется и не передается в другие процессы
+    (SpillingMap создается заново при загрузке состояния), поэтому использует встроенный hash
+    """
+
+    __slots__ = ()
+
+    hash_key = staticmethod(local_key_hashes)
+    hash_keys = staticmethod(local_key_hashes_array)
+
+
+class PendingSpillStore:
+    """
+    Общий бюджет памяти для ожидающих tx и rx калькулятора и хранилище на диске (sqlite3) для записей, которые в
+    бюджет не помещаются. Каждое хранилище ожидающих записей - SpillingMap со своей таблицей в общей базе.
+
+    Когда записей в памяти во всех SpillingMap становится больше memory_limit / entry_bytes, самые старые по
+    времени добавления записи (SPILL_FRACTION бюджета) переносятся на диск пачкой, пропорционально количеству записей
+    в памяти каждой SpillingMap. База создается sqlite3 как временная (пустое имя файла): она лежит в
+    директории SQLITE_TMPDIR/TMPDIR и удаляется при закрытии соединения, поэтому временные файлы не остаются
+    после завершения процесса. Журнал и синхронизация отключены - база нужна только на время расчета.
+
+    Счетчики (stats): hits - найдено в памяти, misses - не найдено в памяти и прочитано с диска (запрос к базе),
+    spilled - перенесено на диск, on_disk - сейчас на диске
+    """
+
+    def __init__(self, memory_limit: int, entry_bytes: int = ENTRY_BYTES) -> None:
+        """
+        :param:
+            memory_limit: - бюджет памяти ожидающих записей в байтах
+            entry_bytes: - оценка памяти одной записи в памяти вместе со структурами, которые хранятся для нее вне
+                           SpillingMap (например, элементами очередей вытеснения калькулятора)
+        """
+
+        if memory_limit <= 0:
+            raise ValueError(f"Бюджет памяти ожидающих записей должен быть положительным: {memory_limit}")
+
+        self.memory_limit = memory_limit
+        self.capacity = max(1, memory_limit // entry_bytes)
+        self.maps: List['SpillingMap'] = []
+
+        self.hits = 0
+        self.misses = 0
+        self.spilled = 0
+
+        self._connection: Optional[sqlite3.Connection] = None
+
+    @property
+    def connection(self) -> sqlite3.Connection:
+        """
+        Соединение с временной базой, открывается при первом сбросе
+        """
+
+        if self._connection is None:
+            # Калькулятор не используется из нескольких потоков одновременно, но может сериализоваться не в том
+            # потоке, где обрабатывал записи (например, фоновым потоком multiprocessing.Queue)
+            self._connection = sqlite3.connect('', check_same_thread=False)
+            self._connection.execute('PRAGMA journal_mode = OFF')
+            self._connection.execute('PRAGMA synchronous = OFF')
+            for spilling_map in self.maps:
+                self._connection.execute(
+                    f'CREATE TABLE {spilling_map.table} '
+                    f'(key TEXT PRIMARY KEY, value BLOB, ts INTEGER, matched INTEGER NOT NULL) WITHOUT ROWID'
+                )
+                if spilling_map.expiry_ts is not None:
+                    self._connection.execute(f'CREATE INDEX {spilling_map.table}_ts ON {spilling_map.table} (ts)')
+        return self._connection
+
+    def new_map(self, table: str, default_factory: Optional[Callable[[], Any]] = None,
+                expiry_ts: Optional[Callable[[Any], int]] = None,
+                on_load: Optional[Callable[[str, Any], None]] = None) -> 'SpillingMap':
+        """
+        Новое хранилище ожидающих записей с таблицей table в общей базе (параметры - как у SpillingMap)
+        """
+
+        spilling_map = SpillingMap(self, table, default_factory, expiry_ts, on_load)
+        self.maps.append(spilling_map)
+        return spilling_map
+
+    def make_room(self) -> None:
+        """
+        Сброс самых старых записей на диск, если в памяти не помещается еще одна запись. Вызывается до
+        добавления записи, поэтому добавляемая запись (например, список rx, который дополняется после
+        обращения по ключу) остается в памяти
+        """
+
+        in_memory = sum(len(spilling_map.memory) for spilling_map in self.maps)
+        if in_memory < self.capacity:
+            return
+
+        count = in_memory - self.capacity + 1 + int(self.capacity * SPILL_FRACTION)
+        for spilling_map in self.maps:
+            spilling_map.spill_oldest(-(-count * len(spilling_map.memory) // in_memory))
+
+        logger.debug(f"На диск перенесено {count} ожидающих записей, всего на диске {self.on_disk}")
+
+    @property
+    def on_disk(self) -> int:
+        return sum(spilling_map.disk_size for spilling_map in self.maps)
+
+    @property
+    def stats(self) -> Dict[str, int]:
+        return {'hits': self.hits, 'misses': self.misses, 'spilled': self.spilled, 'on_disk': self.on_disk}
+
+    def add_counters(self, counters: Dict[str, int]) -> None:
+        """
+        Добавление счетчиков hits, misses и spilled другого хранилища (например, при объединении калькуляторов)
+        """
+
+        self.hits += counters['hits']
+        self.misses += counters['misses']
+        self.spilled += counters['spilled']
+
+    def close(self) -> None:
+        if self._connection is not None:
+            self._connection.close()
+            self._connection = None
+
+
+class SpillingMap:
+    """
+    Словарь pkt_id -> запись (или список записей) с частью записей на диске. Поддерживает операции словаря, которые
+    калькулятор использует для tx_records и rx_records. Записи в памяти хранятся в dict в порядке добавления,
+    поэтому самые старые записи для сброса - первые ключи словаря.
+
+    Чтение по get не переносит запись с диска в память (tx после сопоставления больше не нужен), а чтение по
+    [] для словаря со списками (default_factory, как у defaultdict) переносит, чтобы список можно было дополнять.
+    Ключи на диске отмечаются в фильтре Блума, поэтому поиск нового pkt_id обычно не обращается к диску.
+
+    Отметки сопоставленных tx (mark_matched) хранятся множеством для записей в памяти и колонкой matched для
+    записей на диске. При заданном expiry_ts записи на диске хранят время вытеснения в индексированной колонке ts
+    и выбираются по нему (pop_expired), поэтому калькулятору не нужно держать в памяти очереди вытеснения для
+    сброшенных записей
+    """
+
+    def __init__(self, store: PendingSpillStore, table: str, default_factory: Optional[Callable[[], Any]] = None,
+                 expiry_ts: Optional[Callable[[Any], int]] = None,
+                 on_load: Optional[Callable[[str, Any], None]] = None) -> None:
+        """
+        :param:
+            store: - общий бюджет памяти и база
+            table: - имя таблицы в базе
+            default_factory: - значение для отсутствующего ключа при чтении по [] (как у defaultdict)
+            expiry_ts: - время вытеснения записи (для списка rx - самое раннее ts_us), None - без вытеснения по времени
+            on_load: - вызывается с pkt_id и значением, когда запись переносится с диска обратно в память
+        """
+
+        self.store = store
+        self.table = table
+        self.default_factory = default_factory
+        self.expiry_ts = expiry_ts
+        self.on_load = on_load
+
+        self.memory: Dict[str, Any] = {}
+        self.matched: Set[str] = set()
+        self.disk_size = 0
+        self.min_disk_ts: Optional[int] = None
+        self._spilled_keys = _SpilledKeys(SPILLED_FILTER_ERROR_RATE)
+
+    def __len__(self) -> int:
+        return len(self.memory) + self.disk_size
+
+    def _read(self, pkt_id: str, remove: bool) -> Any:
+        """
+        Поиск записи сначала в памяти, затем на диске (если ключ мог быть сброшен)
+        """
+
+        if remove:
+            value = self.memory.pop(pkt_id, MISSING)
+            self.matched.discard(pkt_id)
+        else:
+            value = self.memory.get(pkt_id, MISSING)
+
+        if value is not MISSING:
+            self.store.hits += 1
+            return value
+
+        if not self.disk_size or pkt_id not in self._spilled_keys:
+            return MISSING
+
+        self.store.misses += 1
+        row = self.store.connection.execute(f'SELECT value FROM {self.table} WHERE key = ?', (pkt_id,)).fetchone()
+        if row is None:
+            return MISSING
+
+        if remove:
+            self._delete_from_disk(pkt_id)
+        return pickle.loads(row[0])
+
+    def _delete_from_disk(self, pkt_id: str) -> bool:
+        if not self.disk_size or pkt_id not in self._spilled_keys:
+            return False
+
+        deleted = self.store.connection.execute(f'DELETE FROM {self.table} WHERE key = ?', (pkt_id,)).rowcount
+        self.disk_size -= deleted
+        return bool(deleted)
+
+    def __contains__(self, pkt_id: str) -> bool:
+        return self._read(pkt_id, remove=False) is not MISSING
+
+    def get(self, pkt_id: str, default=None) -> Any:
+        value = self._read(pkt_id, remove=False)
+        return default if value is MISSING else value
+
+    def __getitem__(self, pkt_id: str) -> Any:
+        value = self.memory.get(pkt_id, MISSING)
+        if value is not MISSING:
+            self.store.hits += 1
+            return value
+
+        if self.default_factory is None:
+            value = self._read(pkt_id, remove=False)
+            if value is MISSING:
+                raise KeyError(pkt_id)
+            return value
+
+        value = self._read(pkt_id, remove=True)
+        self.store.make_room()
+        if value is MISSING:
+            self.memory[pkt_id] = value = self.default_factory()
+        else:
+            self.memory[pkt_id] = value
+            if self.on_load is not None:
+                self.on_load(pkt_id, value)
+        return value
+
+    def __setitem__(self, pkt_id: str, value: Any) -> None:
+        if pkt_id not in self.memory:
+            self._delete_from_disk(pkt_id)
+            self.store.make_room()
+
+        self.memory[pkt_id] = value
+
+    def __delitem__(self, pkt_id: str) -> None:
+        self.matched.discard(pkt_id)
+        if self.memory.pop(pkt_id, MISSING) is MISSING and not self._delete_from_disk(pkt_id):
+            raise KeyError(pkt_id)
+
+    def pop(self, pkt_id: str, default=MISSING) -> Any:
+        value = self._read(pkt_id, remove=True)
+        if value is not MISSING:
+            return value
+        if default is MISSING:
+            raise KeyError(pkt_id)
+        return default
+
+    def spill_oldest(self, count: int) -> None:
+        """
+        Перенос count самых старых записей из памяти на диск
+        """
+
+        keys = list(islice(self.memory, count))
+        if not keys:
+            return
+
+        values = [self.memory.pop(pkt_id) for pkt_id in keys]
+        expiry = [None] * len(keys) if self.expiry_ts is None else list(map(self.expiry_ts, values))
+        rows = [
+            (pkt_id, pickle.dumps(value, protocol=pickle.HIGHEST_PROTOCOL), ts, pkt_id in self.matched)
+            for pkt_id, value, ts in zip(keys, values, expiry)
+        ]
+        self.matched.difference_update(keys)
+
+        with self.store.connection:
+            self.store.connection.executemany(
+                f'INSERT INTO {self.table} (key, value, ts, matched) VALUES (?, ?, ?, ?)', rows
+            )
+
+        if self.expiry_ts is not None:
+            self.min_disk_ts = min(expiry if self.min_disk_ts is None else expiry + [self.min_disk_ts])
+
+        self._spilled_keys.add_many(np.array(keys, dtype=object))
+        self.disk_size += len(rows)
+        self.store.spilled += len(rows)
+
+    def mark_matched(self, pkt_id: str) -> None:
+        """
+        Отметка, что для tx найдена пара (нужна при вытеснении, чтобы не считать пакет потерянным). Отметка
+        записи с диска сохраняется в базе и не занимает память
+        """
+
+        if pkt_id in self.memory:
+            self.matched.add(pkt_id)
+        elif self.disk_size and pkt_id in self._spilled_keys:
+            self.store.connection.execute(f'UPDATE {self.table} SET matched = 1 WHERE key = ?', (pkt_id,))
+
+    def is_matched(self, pkt_id: str) -> bool:
+        if pkt_id in self.memory:
+            return pkt_id in self.matched
+        if not self.disk_size or pkt_id not in self._spilled_keys:
+            return False
+
+        row = self.store.connection.execute(f'SELECT matched FROM {self.table} WHERE key = ?', (pkt_id,)).fetchone()
+        return row is not None and bool(row[0])
+
+    def matched_keys(self) -> Set[str]:
+        """
+        Ключи всех отмеченных записей: в памяти и на диске
+        """
+
+        keys = set(self.matched)
+        if self.disk_size:
+            keys.update(key for key, in self.store.connection.execute(f'SELECT key FROM {self.table} WHERE matched'))
+        return keys
+
+    def pop_expired(self, cutoff: float) -> Iterator[Tuple[str, Any, bool]]:
+        """
+        Удаление с диска записей со временем вытеснения (expiry_ts) меньше cutoff. Записи выбираются по индексу ts
+        страницами, поэтому между страницами словарь можно изменять (например, вернуть в память оставшиеся rx)
+        :param:
+            cutoff: - граница времени события
+        :return:
+            Iterator[Tuple[str, Any, bool]]: - pkt_id, запись и отметка mark_matched
+        """
+
+        if self.min_disk_ts is None or not self.disk_size or self.min_disk_ts >= cutoff:
+            return
+
+        connection = self.store.connection
+        query = f'SELECT key, value, matched FROM {self.table} WHERE ts < ? ORDER BY ts LIMIT ?'
+        while True:
+            rows = connection.execute(query, (cutoff, SCAN_PAGE_SIZE)).fetchall()
+            if not rows:
+                break
+
+            connection.executemany(f'DELETE FROM {self.table} WHERE key = ?', [(pkt_id,) for pkt_id, _, _ in rows])
+            self.disk_size -= len(rows)
+            for pkt_id, value, matched in rows:
+                yield pkt_id, pickle.loads(value), bool(matched)
+
+        self.min_disk_ts = connection.execute(f'SELECT MIN(ts) FROM {self.table}').fetchone()[0]
+
+    def _disk_items(self) -> Iterator[Tuple[str, bytes]]:
+        """
+        Обход записей на диске страницами по ключу: запросы не держат курсор открытым, поэтому базу можно
+        изменять во время обхода
+        """
+
+        query = f'SELECT key, value FROM {self.table} WHERE key > ? ORDER BY key LIMIT ?'
+        rows = self.store.connection.execute(
+            f'SELECT key, value FROM {self.table} ORDER BY key LIMIT ?', (SCAN_PAGE_SIZE,)
+        ).fetchall() if self.disk_size else []
+
+        while rows:
+            yield from rows
+            if len(rows) < SCAN_PAGE_SIZE:
+                return
+            rows = self.store.connection.execute(query, (rows[-1][0], SCAN_PAGE_SIZE)).fetchall()
+
+    def __iter__(self) -> Iterator[str]:
+        yield from list(self.memory)
+        for pkt_id, _ in self._disk_items():
+            yield pkt_id
+
+    def keys(self) -> Iterator[str]:
+        return iter(self)
+
+    def items(self) -> Iterator[Tuple[str, Any]]:
+        yield from list(self.memory.items())
+        for pkt_id, value in self._disk_items():
+            yield pkt_id, pickle.loads(value)
+
+    def values(self) -> Iterator[Any]:
+        for _, value in self.items():
+            yield value
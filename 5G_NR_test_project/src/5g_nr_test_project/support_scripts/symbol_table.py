@@ -0,0 +1,83 @@
+import numpy as np
+import pyarrow as pa
+import pyarrow.compute as pc
+
+from typing import Dict, Iterable, List
+
+
+class SymbolTable:
+    """
+    Таблица символов для словарного кодирования строковых полей (src, dst, app). Каждая уникальная строка
+    получает небольшой целочисленный код, который записи несут вместо строки. Таблица общая для парсера и
+    калькулятора, коды обратно превращаются в строки только при сборке итоговых метрик
+    """
+
+    def __init__(self, symbols: Iterable[str] = ()) -> None:
+        """
+        :param:
+            symbols: - начальный набор строк (коды выдаются в порядке перечисления)
+        """
+
+        self._codes: Dict[str, int] = {}
+        self._symbols: List[str] = []
+
+        for symbol in symbols:
+            self.encode(symbol)
+
+    def __len__(self) -> int:
+        return len(self._symbols)
+
+    def __contains__(self, symbol: str) -> bool:
+        return symbol in self._codes
+
+    @property
+    def symbols(self) -> List[str]:
+        return self._symbols
+
+    def encode(self, symbol: str) -> int:
+        """
+        Код строки, новая строка получает следующий свободный код
+        :param:
+            symbol: - строка для кодирования
+        :return:
+            int: - код строки
+        """
+
+        code = self._codes.get(symbol)
+        if code is None:
+            code = self._codes[symbol] = len(self._symbols)
+            self._symbols.append(symbol)
+        return code
+
+    def decode(self, code: int) -> str:
+        """
+        Строка по коду
+        :param:
+            code: - код, выданный этой таблицей
+        :return:
+            str: - исходная строка
+        """
+
+        return self._symbols[code]
+
+    def encode_array(self, values: pa.Array | pa.ChunkedArray) -> np.ndarray:
+        """
+        Векторное кодирование строковой колонки: строки словаря колонки кодируются по одному разу, после чего
+        коды раскладываются по индексам словаря
+        :param:
+            values: - строковая колонка Arrow без null
+        :return:
+            np.ndarray: - массив кодов int32
+        """
+
+        if isinstance(values, pa.ChunkedArray):
+            values = values.combine_chunks()
+
+        encoded = pc.dictionary_encode(values)
+        dictionary_codes = np.fromiter(
+            (self.encode(symbol) for symbol in encoded.dictionary.to_pylist()),
+            dtype=np.int32,
+            count=len(encoded.dictionary)
+        )
+
+        return dictionary_codes[encoded.indices.to_numpy(zero_copy_only=False)]
@@ -0,0 +1,648 @@
+import os
+import sys
+
+import numpy as np
+
+from typing import Callable, Dict, Hashable, List, Optional, Tuple
+
+current_dir = os.path.dirname(os.path.abspath(__file__))
+project_root = os.path.dirname(os.path.join(current_dir, '..', '..'))
+sys.path.insert(0, project_root)
+
+from support_scripts.quantile_sketch import LatencySketch, DEFAULT_RELATIVE_ACCURACY
+
+# Поля ячейки окно x пара: счетчики tx/rx и моменты (количество, среднее, M2) задержки, SINR и RSSI
+FIELDS = (
+    'tx', 'rx',
+    'latency_count', 'latency_mean', 'latency_m2',
+    'sinr_count', 'sinr_mean', 'sinr_m2',
+    'rssi_count', 'rssi_mean', 'rssi_m2'
+)
+FIELD_INDEX = {name: index for index, name in enumerate(FIELDS)}
+
+# Первые поля моментов задержки, SINR и RSSI
+MOMENTS = ('latency_count', 'sinr_count', 'rssi_count')
+
+# Количество обновлений построчной обработки, которые копятся перед переносом в массивы
+BUFFER_SIZE = 65536
+
+# Плотный блок меньше этого количества ячеек не проверяется на заполненность
+DENSE_MIN_CELLS = 1 << 16
+
+# Минимальная доля занятых ячеек плотного блока, иначе хранилище переходит на разреженные ячейки
+DENSE_MIN_DENSITY = 0.25
+
+
+def merge_moments(values: np.ndarray, slots: np.ndarray, first: int, count: np.ndarray, mean: np.ndarray,
+                  m2: np.ndarray) -> None:
+    """
+    Объединение моментов (количество, среднее, M2) с моментами ячеек по формуле Чана, в том же порядке операций,
+    что и RunningStats.merge
+    :param:
+        values: - массив полей хранилища
+        slots: - различные ячейки
+        first: - номер поля количества значений (за ним идут среднее и M2)
+        count, mean, m2: - моменты добавляемых значений для каждой ячейки
+    """
+
+    self_count, self_mean = values[first, slots], values[first + 1, slots]
+    total = self_count + count
+    divisor = np.maximum(total, 1)
+    delta = mean - self_mean
+
+    values[first + 2, slots] += m2 + delta * delta * self_count * count / divisor
+    values[first + 1, slots] = self_mean + delta * count / divisor
+    values[first, slots] = total
+
+
+class WindowPairStore:
+    """
+    Хранилище метрик временных окон по парам src-dst на массивах NumPy вместо словаря накопителей на каждую
+    пару (окно, src, dst). Пара получает номер при первом появлении, окно - номер ts_us // window_size, а поля
+    ячейки (FIELDS) лежат в массиве (поле, ячейка): счетчики обновляются сложением по массивам, средние и
+    дисперсии - объединением моментов целого пакета значений.
+
+    Пока ячейки заполнены плотно, они образуют блок окна x пары, начинающийся с первого увиденного окна: номер
+    ячейки вычисляется арифметически, блок растет удвоением по окнам и по парам, и данные каждого окна лежат
+    подряд. Если занято меньше DENSE_MIN_DENSITY ячеек блока (редкие пары или разрывы во времени), хранилище
+    переходит на разреженные ячейки: номер ячейки берется из словаря (окно, пара), и память растет только с
+    количеством занятых ячеек.
+
+    Построчная обработка копит обновления в буфере и переносит их в массивы пакетами по BUFFER_SIZE. Задержки
+    для перцентилей хранятся журналом (окно, пара, значение) для exact или скетчем на ячейку для sketch.
+
+    Окна с номером меньше closed_end закрыты (close): обновления таких окон считаются опоздавшими
+    (late_records) и отбрасываются или, при keep_late, сохраняются. Ячейки закрытых окон отделяются и
+    освобождаются через split, поэтому закрытие окон можно делать на каждую запись, а выгрузку - пакетами
+        """
+
+    def __init__(self, window_size: int, latency_backend: str = 'exact',
+                 latency_accuracy: float = DEFAULT_RELATIVE_ACCURACY, keep_late: bool = False) -> None:
+        """
+        :param:
+            window_size: - размер временного окна в мкс
+            latency_backend: - хранение задержек: 'exact' (журнал значений) или 'sketch' (LatencySketch на ячейку)
+            latency_accuracy: - относительная точность скетча
+            keep_late: - сохранять обновления закрытых окон как поправки, а не отбрасывать их
+        """
+
+        self.window_size = window_size
+        self.latency_backend = latency_backend
+        self.latency_accuracy = latency_accuracy
+        self.keep_late = keep_late
+
+        self.closed_end: Optional[int] = None
+        self.emitted_end: Optional[int] = None
+        self.late_records = 0
+
+        self.pair_keys: List[Hashable] = []
+        self._pair_index: Dict[Hashable, int] = {}
+
+        self._values = np.zeros((len(FIELDS), 0))
+
+        self.dense = True
+        self._base = 0
+        self._windows = 0
+        self._pairs = 0
+
+        self._slots: Optional[Dict[Tuple[int, int], int]] = {}
+        self._cell_windows = np.zeros(0, dtype=np.int64)
+        self._cell_pairs = np.zeros(0, dtype=np.int64)
+        self._size = 0
+
+        self._latency_parts: List[Tuple[np.ndarray, np.ndarray, np.ndarray]] = []
+        self.sketches: Dict[Tuple[int, int], LatencySketch] = {}
+
+        self._count_buffer: List[Tuple] = []
+        self._matched_buffer: List[Tuple] = []
+
+        self.version = 0
+
+    def __getstate__(self) -> Dict:
+        self.flush()
+        self._compact_latencies()
+        return self.__dict__.copy()
+
+    def pair_index(self, pair_key: Hashable) -> int:
+        """
+        Номер пары (src, dst), новая пара получает следующий номер
+        """
+
+        index = self._pair_index.get(pair_key)
+        if index is None:
+            index = self._pair_index[pair_key] = len(self.pair_keys)
+            self.pair_keys.append(pair_key)
+        return index
+
+    def pair_indexes(self, src: np.ndarray, dst: np.ndarray) -> np.ndarray:
+        """
+        Номера пар для колонок кодов src и dst
+        """
+
+        radix = int(dst.max()) + 1
+        keys, inverse = np.unique(src.astype(np.int64) * radix + dst, return_inverse=True)
+
+        indexes = np.fromiter(
+            (self.pair_index((key // radix, key % radix)) for key in keys.tolist()), dtype=np.int64, count=len(keys)
+        )
+        return indexes[inverse]
+
+    def count(self, key: str, ts_us: int, pair_key: Hashable, count: int = 1) -> None:
+        """
+        Изменение счетчика tx или rx ячейки одной записью построчной обработки
+        :param:
+            key: - счетчик ('tx' или 'rx')
+            ts_us: - время, по которому выбирается окно
+            pair_key: - пара (src, dst)
+            count: - изменение счетчика
+        """
+
+        if self.closed_end is not None and ts_us // self.window_size < self.closed_end:
+            if key == 'tx' and count > 0:
+                self.late_records += 1
+            if not self.keep_late:
+                return
+
+        self._count_buffer.append((FIELD_INDEX[key], ts_us, pair_key, count))
+        if len(self._count_buffer) >= BUFFER_SIZE:
+            self.flush()
+
+    def add_matched(self, ts_us: int, pair_key: Hashable, latency: int, sinr_db: Optional[float],
+                    rssi_dbm: Optional[float]) -> None:
+        """
+        Сопоставленная пара построчной обработки: увеличивает rx ячейки и добавляет задержку, SINR и RSSI
+        """
+
+        if self.closed_end is not None and ts_us // self.window_size < self.closed_end:
+            self.late_records += 1
+            if not self.keep_late:
+                return
+
+        self._matched_buffer.append((ts_us, pair_key, latency, sinr_db, rssi_dbm))
+        if len(self._matched_buffer) >= BUFFER_SIZE:
+            self.flush()
+
+    def flush(self) -> None:
+        """
+        Перенос накопленных обновлений построчной обработки в массивы
+        """
+
+        if self._count_buffer:
+            fields, ts_us, pair_keys, counts = zip(*self._count_buffer)
+            self._count_buffer = []
+
+            self._add_counts(
+                np.array(fields, dtype=np.intp), np.array(ts_us, dtype=np.int64) // self.window_size,
+                self._pair_array(pair_keys), np.array(counts), check_late=False
+            )
+
+        if self._matched_buffer:
+            ts_us, pair_keys, latency, sinr_db, rssi_dbm = zip(*self._matched_buffer)
+            self._matched_buffer = []
+
+            self._add_matched(
+                np.array(ts_us, dtype=np.int64) // self.window_size, self._pair_array(pair_keys),
+                np.array(latency, dtype=np.float64), np.array(sinr_db, dtype=np.float64),
+                np.array(rssi_dbm, dtype=np.float64), check_late=False
+            )
+
+    def _pair_array(self, pair_keys: Tuple[Hashable, ...]) -> np.ndarray:
+        """
+        Номера пар для ключей из буфера: новые пары добавляются по одному разу, остальные берутся из словаря
+        """
+
+        for pair_key in set(pair_keys).difference(self._pair_index):
+            self.pair_index(pair_key)
+
+        return np.fromiter(map(self._pair_index.__getitem__, pair_keys), dtype=np.int64, count=len(pair_keys))
+
+    def add_counts(self, key: str, ts_us: np.ndarray, src: np.ndarray, dst: np.ndarray, sign: int = 1) -> None:
+        """
+        Счетчики tx или rx для колонок пакета записей
+        :param:
+            key: - счетчик ('tx' или 'rx')
+            ts_us, src, dst: - колонки времени и кодов src, dst
+            sign: - -1, если учет записей отменяется
+        """
+
+        if len(ts_us) == 0:
+            return
+
+        self._add_counts(
+            np.full(len(ts_us), FIELD_INDEX[key], dtype=np.intp), ts_us // self.window_size,
+            self.pair_indexes(src, dst), np.full(len(ts_us), sign)
+        )
+
+    def add_matched_columns(self, ts_us: np.ndarray, src: np.ndarray, dst: np.ndarray, latency: np.ndarray,
+                            sinr_db: np.ndarray, rssi_dbm: np.ndarray) -> None:
+        """
+        Сопоставленные пары пакета записей: rx ячеек и задержки, SINR и RSSI (NaN - нет значения)
+        """
+
+        if len(ts_us) == 0:
+            return
+
+        self._add_matched(
+            ts_us // self.window_size, self.pair_indexes(src, dst), latency.astype(np.float64), sinr_db, rssi_dbm
+        )
+
+    def _late(self, windows: np.ndarray) -> Optional[np.ndarray]:
+        """
+        Маска обновлений закрытых окон или None, если таких нет
+        """
+
+        if self.closed_end is None:
+            return None
+
+        late = windows < self.closed_end
+        return late if late.any() else None
+
+    def _add_counts(self, fields: np.ndarray, windows: np.ndarray, pairs: np.ndarray, counts: np.ndarray,
+                    check_late: bool = True) -> None:
+        late = self._late(windows) if check_late else None
+        if late is not None:
+            self.late_records += int(np.count_nonzero(late & (fields == FIELD_INDEX['tx']) & (counts > 0)))
+            if not self.keep_late:
+                fields, windows, pairs, counts = fields[~late], windows[~late], pairs[~late], counts[~late]
+                if len(windows) == 0:
+                    return
+
+        slots = self._cell_slots(windows, pairs)
+        np.add.at(self._values, (fields, slots), counts)
+        self.version += 1
+
+    def _add_matched(self, windows: np.ndarray, pairs: np.ndarray, latency: np.ndarray, sinr_db: np.ndarray,
+                     rssi_dbm: np.ndarray, check_late: bool = True) -> None:
+        late = self._late(windows) if check_late else None
+        if late is not None:
+            self.late_records += int(np.count_nonzero(late))
+            if not self.keep_late:
+                kept = ~late
+                windows, pairs, latency, sinr_db, rssi_dbm = (
+                    windows[kept], pairs[kept], latency[kept], sinr_db[kept], rssi_dbm[kept]
+                )
+                if len(windows) == 0:
+                    return
+
+        slots = self._cell_slots(windows, pairs)
+        cells, inverse = np.unique(slots, return_inverse=True)
+        self._values[FIELD_INDEX['rx'], cells] += np.bincount(inverse, minlength=len(cells))
+
+        for name, values in (('latency_count', latency), ('sinr_count', sinr_db), ('rssi_count', rssi_dbm)):
+            valid = ~np.isnan(values)
+            group, values = inverse[valid], values[valid]
+
+            count = np.bincount(group, minlength=len(cells))
+            mean = np.bincount(group, weights=values, minlength=len(cells)) / np.maximum(count, 1)
+            m2 = np.bincount(group, weights=(values - mean[group]) ** 2, minlength=len(cells))
+
+            merge_moments(self._values, cells, FIELD_INDEX[name], count, mean, m2)
+
+        if self.latency_backend == 'sketch':
+            order = np.argsort(inverse, kind='stable')
+            bounds = np.cumsum(np.bincount(inverse, minlength=len(cells)))[:-1]
+            for rows in np.split(order, bounds):
+                key = (int(windows[rows[0]]), int(pairs[rows[0]]))
+                sketch = self.sketches.get(key)
+                if sketch is None:
+                    sketch = self.sketches[key] = LatencySketch(self.latency_accuracy)
+                sketch.extend(latency[rows].tolist())
+        else:
+            self._latency_parts.append((windows, pairs, latency))
+
+        self.version += 1
+
+    def _cell_slots(self, windows: np.ndarray, pairs: np.ndarray) -> np.ndarray:
+        """
+        Номера ячеек (окно, пара) в массиве полей, недостающие ячейки добавляются
+        """
+
+        if self.dense:
+            low, high, top = int(windows.min()), int(windows.max()), int(pairs.max())
+            if self._windows == 0 or low < self._base or high >= self._base + self._windows or top >= self._pairs:
+                self._grow(low, high, top)
+
+        if self.dense:
+            return (windows - self._base) * self._pairs + pairs
+
+        return self._sparse_slots(windows, pairs)
+
+    def _grow(self, low: int, high: int, top: int) -> None:
+        """
+        Расширение плотного блока до окон [low, high] и пар [0, top] с удвоением размеров. Если занятых ячеек в
+        новом блоке слишком мало, хранилище переходит на разреженные ячейки
+        """
+
+        if self._windows == 0:
+            base, windows, pairs = low, high - low + 1, top + 1
+        else:
+            start, end = min(low, self._base), max(high + 1, self._base + self._windows)
+            windows = max(end - start, 2 * self._windows) if end - start > self._windows else self._windows
+            base = end - windows if low < self._base else start
+            pairs = max(top + 1, 2 * self._pairs) if top >= self._pairs else self._pairs
+
+        occupied = int(np.any(self._values != 0, axis=0).sum())
+        if windows * pairs > DENSE_MIN_CELLS and occupied < windows * pairs * DENSE_MIN_DENSITY:
+            self._to_sparse()
+            return
+
+        values = np.zeros((len(FIELDS), windows, pairs))
+        if self._windows:
+            offset = self._base - base
+            values[:, offset:offset + self._windows, :self._pairs] = self._values.reshape(
+                len(FIELDS), self._windows, self._pairs
+            )
+
+        self._values = values.reshape(len(FIELDS), windows * pairs)
+        self._base, self._windows, self._pairs = base, windows, pairs
+
+    def _to_sparse(self) -> None:
+        """
+        Переход с плотного блока на разреженные ячейки: переносятся только занятые ячейки
+        """
+
+        self._load_sparse(*self.cells())
+
+    def _load_sparse(self, windows: np.ndarray, pairs: np.ndarray, values: np.ndarray) -> None:
+        self.dense = False
+        self._values = values
+        self._cell_windows, self._cell_pairs = windows, pairs
+        self._size = len(windows)
+        # Словарь ячеек строится при первом добавлении: собранные хранилища (rollup, hop) только читаются
+        self._slots = None
+
+    def _sparse_slots(self, windows: np.ndarray, pairs: np.ndarray) -> np.ndarray:
+        if self._slots is None:
+            cells = zip(self._cell_windows[:self._size].tolist(), self._cell_pairs[:self._size].tolist())
+            self._slots = dict(zip(cells, range(self._size)))
+
+        radix = int(pairs.max()) + 1
+        keys, inverse = np.unique(windows * radix + pairs, return_inverse=True)
+
+        slots = np.empty(len(keys), dtype=np.int64)
+        new_cells = []
+        for position, key in enumerate(keys.tolist()):
+            cell = (key // radix, key % radix)
+            slot = self._slots.get(cell)
+            if slot is None:
+                slot = self._slots[cell] = self._size + len(new_cells)
+                new_cells.append(cell)
+            slots[position] = slot
+
+        if new_cells:
+            self._append_cells(new_cells)
+
+        return slots[inverse]
+
+    def _append_cells(self, cells: List[Tuple[int, int]]) -> None:
+        size = self._size + len(cells)
+
+        if size > self._values.shape[1]:
+            capacity = max(size, 2 * self._values.shape[1])
+            values = np.zeros((len(FIELDS), capacity))
+            values[:, :self._size] = self._values[:, :self._size]
+            self._values = values
+
+            self._cell_windows = np.resize(self._cell_windows, capacity)
+            self._cell_pairs = np.resize(self._cell_pairs, capacity)
+
+        windows, pairs = zip(*cells)
+        self._cell_windows[self._size:size] = windows
+        self._cell_pairs[self._size:size] = pairs
+        self._size = size
+
+    def cells(self) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """
+        Занятые ячейки, упорядоченные по окну и номеру пары
+        :return:
+            (windows, pairs, values): - номера окон, номера пар и поля ячеек (массив (поле, ячейка))
+        """
+
+        self.flush()
+
+        if self.dense:
+            slots = np.flatnonzero(np.any(self._values != 0, axis=0))
+            windows, pairs = np.divmod(slots, max(self._pairs, 1))
+            return windows + self._base, pairs, self._values[:, slots]
+
+        order = np.lexsort((self._cell_pairs[:self._size], self._cell_windows[:self._size]))
+        return self._cell_windows[order], self._cell_pairs[order], self._values[:, order]
+
+    @property
+    def window_range(self) -> Optional[Tuple[int, int]]:
+        """
+        Номера первого и последнего окна с занятыми ячейками или None, если ячеек нет
+        """
+
+        windows = self.cells()[0]
+        return (int(windows[0]), int(windows[-1])) if len(windows) else None
+
+    @property
+    def buffered(self) -> int:
+        """
+        Количество обновлений построчной обработки, еще не перенесенных в массивы
+        """
+
+        return len(self._count_buffer) + len(self._matched_buffer)
+
+    def close(self, end: int) -> None:
+        """
+        Закрытие окон с номером меньше end: дальнейшие обновления этих окон считаются опоздавшими
+        """
+
+        if self.closed_end is None or end > self.closed_end:
+            self.closed_end = end
+
+    def split(self) -> 'WindowPairStore':
+        """
+        Отделение закрытых окон: их ячейки и задержки переносятся в новое хранилище (с общими номерами пар) и
+        освобождаются в этом. emitted_end запоминает границу отделенных окон
+        :return:
+            WindowPairStore: - хранилище закрытых окон
+        """
+
+        self.flush()
+        end = self.closed_end if self.closed_end is not None else -sys.maxsize
+
+        closed = WindowPairStore(self.window_size, self.latency_backend, self.latency_accuracy)
+        closed.pair_keys, closed._pair_index = self.pair_keys, self._pair_index
+
+        windows, pairs, values = self.cells()
+        is_closed = windows < end
+        closed._load_sparse(windows[is_closed], pairs[is_closed], values[:, is_closed])
+
+        if self.dense:
+            if self._windows:
+                offset = min(max(end - self._base, 0), self._windows)
+                block = self._values.reshape(len(FIELDS), self._windows, self._pairs)[:, offset:]
+                self._values = block.reshape(len(FIELDS), -1).copy()
+                self._base, self._windows = self._base + offset, self._windows - offset
+        else:
+            is_open = ~is_closed
+            self._load_sparse(windows[is_open], pairs[is_open], values[:, is_open])
+
+        if self._latency_parts:
+            log_windows, log_pairs, log_values = self.latencies()
+            is_closed = log_windows < end
+            closed._latency_parts = [(log_windows[is_closed], log_pairs[is_closed], log_values[is_closed])]
+            is_open = ~is_closed
+            self._latency_parts = [(log_windows[is_open], log_pairs[is_open], log_values[is_open])]
+
+        for key in [key for key in self.sketches if key[0] < end]:
+            closed.sketches[key] = self.sketches.pop(key)
+
+        self.emitted_end = end
+        self.version += 1
+        return closed
+
+    def rollup(self, factor: int) -> 'WindowPairStore':
+        """
+        Хранилище окон в factor раз крупнее, собранное объединением ячеек этого хранилища без исходных записей:
+        счетчики складываются, моменты объединяются по формуле Чана для групп, журнал задержек переиспользуется
+        с новыми номерами окон, скетчи объединяются
+        :param:
+            factor: - во сколько раз крупное окно больше окна этого хранилища
+        :return:
+            WindowPairStore: - хранилище крупных окон (с общими номерами пар)
+        """
+
+        return self._regroup(self.window_size * factor, lambda windows: (windows // factor, np.arange(len(windows))))
+
+    def hop(self, panes: int) -> 'WindowPairStore':
+        """
+        Скользящие (hopping) окна длиной panes окон этого хранилища с шагом в одно окно. Окна хранилища служат
+        панелями: окно с номером w объединяет панели w, ..., w + panes - 1, поэтому при обработке записи
+        обновляется одна панель, а панели объединяются только при расчете итоговых метрик
+        :param:
+            panes: - длина скользящего окна в панелях
+        :return:
+            WindowPairStore: - хранилище скользящих окон. Номер окна умножается на window_size (размер панели),
+                               чтобы получить window_start
+        """
+
+        def covering(windows: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+            # Панель p входит в окна p - panes + 1, ..., p
+            shifts = np.repeat(np.arange(panes, dtype=np.int64), len(windows))
+            return np.tile(windows, panes) - shifts, np.tile(np.arange(len(windows)), panes)
+
+        return self._regroup(self.window_size, covering)
+
+    def _regroup(self, window_size: int,
+                 target: Callable[[np.ndarray], Tuple[np.ndarray, np.ndarray]]) -> 'WindowPairStore':
+        """
+        Новое хранилище, ячейки которого объединяют ячейки этого хранилища
+        :param:
+            window_size: - размер окна нового хранилища
+            target: - функция, которая по номерам окон ячеек возвращает номера новых окон и индексы исходных ячеек.
+                      Одна ячейка может входить в несколько новых окон
+        :return:
+            WindowPairStore: - хранилище с общими номерами пар
+        """
+
+        result = WindowPairStore(window_size, self.latency_backend, self.latency_accuracy)
+        result.pair_keys, result._pair_index = self.pair_keys, self._pair_index
+
+        windows, pairs, values = self.cells()
+        windows, source = target(windows)
+
+        stride = max(len(self.pair_keys), 1)
+        keys, inverse = np.unique(windows * stride + pairs[source], return_inverse=True)
+        size = len(keys)
+
+        # Поля выбираются по одному, чтобы не копировать все поля ячеек для каждого нового окна
+        merged = np.zeros((len(FIELDS), size))
+        for name in ('tx', 'rx'):
+            merged[FIELD_INDEX[name]] = np.bincount(inverse, weights=values[FIELD_INDEX[name], source], minlength=size)
+
+        for name in MOMENTS:
+            first = FIELD_INDEX[name]
+            count, mean, m2 = values[first, source], values[first + 1, source], values[first + 2, source]
+
+            total = np.bincount(inverse, weights=count, minlength=size)
+            total_mean = np.bincount(inverse, weights=count * mean, minlength=size) / np.maximum(total, 1)
+            spread = m2 + count * (mean - total_mean[inverse]) ** 2
+
+            merged[first] = total
+            merged[first + 1] = total_mean
+            merged[first + 2] = np.bincount(inverse, weights=spread, minlength=size)
+
+        result._load_sparse(keys // stride, keys % stride, merged)
+
+        if self.latency_backend == 'sketch':
+            for (window, pair), sketch in self.sketches.items():
+                for new_window in target(np.array([window], dtype=np.int64))[0]:
+                    key = (int(new_window), pair)
+                    if key not in result.sketches:
+                        result.sketches[key] = LatencySketch(self.latency_accuracy)
+                    result.sketches[key].merge(sketch)
+        else:
+            log_windows, log_pairs, log_values = self.latencies()
+            log_windows, source = target(log_windows)
+            result._latency_parts = [(log_windows, log_pairs[source], log_values[source])]
+
+        return result
+
+    def latencies(self) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """
+        Журнал задержек для latency_backend = 'exact'
+        :return:
+            (windows, pairs, values): - окно, пара и значение каждой задержки
+        """
+
+        self.flush()
+        self._compact_latencies()
+
+        if not self._latency_parts:
+            return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64), np.zeros(0)
+        return self._latency_parts[0]
+
+    def _compact_latencies(self) -> None:
+        if len(self._latency_parts) > 1:
+            self._latency_parts = [tuple(np.concatenate(part) for part in zip(*self._latency_parts))]
+
+    def merge(self, other: 'WindowPairStore', convert: Optional[Callable] = None) -> None:
+        """
+        Объединение с хранилищем, собранным по другой части данных
+        :param:
+            other: - хранилище с тем же window_size и latency_backend
+            convert: - перевод значений src и dst другого хранилища или None, если коды совпадают
+        """
+
+        # cells() сбрасывает буфер обновлений, в котором могут быть еще не учтенные пары
+        windows, pairs, values = other.cells()
+
+        pair_keys = other.pair_keys
+        if convert is not None:
+            pair_keys = [(convert(src), convert(dst)) for src, dst in pair_keys]
+        mapping = np.array([self.pair_index(pair_key) for pair_key in pair_keys], dtype=np.int64)
+
+        if len(windows):
+            pairs = mapping[pairs]
+            slots = self._cell_slots(windows, pairs)
+
+            for name in ('tx', 'rx'):
+                self._values[FIELD_INDEX[name], slots] += values[FIELD_INDEX[name]]
+
+            for name in MOMENTS:
+                first = FIELD_INDEX[name]
+                merge_moments(self._values, slots, first, values[first], values[first + 1], values[first + 2])
+
+        for windows, pairs, values in other._latency_parts:
+            self._latency_parts.append((windows, mapping[pairs], values))
+
+        for (window, pair), sketch in other.sketches.items():
+            key = (window, int(mapping[pair]))
+            if key not in self.sketches:
+                self.sketches[key] = LatencySketch(self.latency_accuracy)
+            self.sketches[key].merge(sketch)
+
+        self.late_records += other.late_records
+        self.version += 1
+
+    @property
+    def nbytes(self) -> int:
+        """
+        Память массивов полей и журнала задержек в байтах
+        """
+
+        return self._values.nbytes + sum(array.nbytes for part in self._latency_parts for array in part)
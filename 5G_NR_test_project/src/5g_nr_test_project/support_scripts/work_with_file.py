@@ -1,6 +1,8 @@
 import pandas as pd
 
+from itertools import islice, accumulate
 from pathlib import Path
+from typing import Iterator, List, Optional
 
 
 def load_metrics_from_parquet(filepath: Path) -> pd.DataFrame:
@@ -16,3 +18,33 @@ def load_metrics_from_csv(filepath: Path) -> pd.DataFrame:
     """
 
     return pd.read_csv(filepath)
+
+def iter_line_chunks(file_path: Path, start: int = 0, end: Optional[int] = None,
+                     chunk_size: int = 65536) -> Iterator[List[bytes]]:
+    """
+    Потоковое чтение файла блоками по chunk_size строк, без загрузки всего файла в память
+    :param:
+        file_path: - путь к файлу
+        start: - смещение в байтах, с которого начинается чтение (должно указывать на начало строки)
+        end: - смещение, на котором чтение останавливается. Строка, начавшаяся до end, читается целиком
+        chunk_size: - максимальное количество строк в одном блоке
+    :return:
+        Iterator[List[bytes]]: - генератор блоков строк в байтовом виде
+    """
+
+    with open(file_path, 'rb') as file:
+        file.seek(start)
+        position = start
+
+        while end is None or position < end:
+            lines = list(islice(file, chunk_size))
+            if not lines:
+                break
+
+            if end is not None:
+                line_starts = accumulate((len(line) for line in lines), initial=position)
+                in_range = sum(1 for line_start, _ in zip(line_starts, lines) if line_start < end)
+                lines = lines[:in_range]
+
+            position += sum(len(line) for line in lines)
+            yield lines
@@ -0,0 +1,199 @@
+import os
+import sys
+
+import pytest
+import pyarrow as pa
+
+from pathlib import Path
+from typing import Optional
+from pydantic import BaseModel, Field, ValidationError, field_validator
+
+current_dir = os.path.dirname(os.path.abspath(__file__))
+project_root = os.path.dirname(os.path.join(current_dir, '..', '..'))
+sys.path.insert(0, project_root)
+
+from main_scripts.parsers import NJsonParser, CsvParser
+from main_scripts.test_base_parser import TestParser
+from main_scripts.parallel_parsing import parse_parallel, split_byte_ranges
+from main_scripts.batch_validation import ColumnValidator, validate_batch
+from configs.models import ParseResult
+
+SAMPLES_DIR = Path(current_dir).parent.parent.parent / 'tests'
+
+ERROR_NDJSON_LINES = [
+    '{"ts_us": 1000, "event": "tx", "src": "car_1", "dst": "car_2", "pkt_id": "a1", "app": "BSM", "bytes": 250}',
+    'INVALID JSON LINE',
+    '',
+    '{"ts_us": "not_number", "event": "tx", "src": "car_1", "dst": "car_2", "pkt_id": "a2", "app": "BSM", "bytes": 250}',
+    '{"ts_us": 1100, "event": "invalid_event", "src": "car_1", "dst": "car_2", "pkt_id": "a3", "app": "BSM", "bytes": 250}',
+    '{"ts_us": 1200, "event": "tx", "src": "", "dst": "car_2", "pkt_id": "a4", "app": "BSM", "bytes": 250}',
+    '{"ts_us": 1300, "event": "rx", "src": "car_1", "dst": "car_2", "pkt_id": "a5", "app": "BSM", "bytes": 250, "rssi_dbm": 5}',
+]
+
+ERROR_CSV_LINES = [
+    'ts_us,event,src,dst,pkt_id,app,bytes,rssi_dbm,sinr_db,drop_reason',
+    '0,rx,car_7,car_3,pkt_000,MAP,310,-76.2,,',
+    ',,,,,,,,,',
+    ' 5 ,tx, car_1 ,car_2,p1,BSM,10,,,',
+    '-1,tx,car_1,car_2,p2,BSM,1,,,',
+    '7,tx,car_1,car_2,p3,BSM,1,-130,,',
+    'abc,tx,car_1,car_2,p4,BSM,1,,,',
+]
+
+
+def parse_serial(parser_class, file_path: Path):
+    parser = parser_class()
+    records = [record.model_dump() for record in parser.parse_data_stream(file_path)]
+    return records, parser.get_stats()
+
+
+def parse_batched(parser_class, file_path: Path, batch_size: int):
+    parser = parser_class()
+    records = [row for batch in parser.parse_batches(file_path, batch_size=batch_size) for row in batch.to_pylist()]
+    return records, parser.get_stats()
+
+
+class TestBatchParsing:
+
+    def test_ndjson_sample_matches_serial(self):
+        """Пакетный режим NDJSON дает те же записи, что и построчный"""
+        file_path = SAMPLES_DIR / 'sample_big_test.ndjson'
+
+        assert parse_batched(NJsonParser, file_path, 16) == parse_serial(NJsonParser, file_path)
+
+    def test_csv_sample_matches_serial(self):
+        """Пакетный режим CSV дает те же записи, что и построчный"""
+        file_path = SAMPLES_DIR / 'sample.csv'
+
+        assert parse_batched(CsvParser, file_path, 7) == parse_serial(CsvParser, file_path)
+
+    def test_ndjson_errors_counted(self, tmp_path):
+        """Некорректные строки NDJSON учитываются в тех же счетчиках"""
+        file_path = tmp_path / 'errors.ndjson'
+        file_path.write_text('\n'.join(ERROR_NDJSON_LINES) + '\n', encoding='utf-8')
+
+        records, stats = parse_batched(NJsonParser, file_path, 3)
+
+        assert (records, stats) == parse_serial(NJsonParser, file_path)
+        assert [record['pkt_id'] for record in records] == ['a1']
+        assert stats['validation_error_cnt'] == 4
+
+    def test_csv_errors_counted(self, tmp_path):
+        """Некорректные строки CSV учитываются в тех же счетчиках, пробелы обрезаются"""
+        file_path = tmp_path / 'errors.csv'
+        file_path.write_text('\n'.join(ERROR_CSV_LINES) + '\n', encoding='utf-8')
+
+        records, stats = parse_batched(CsvParser, file_path, 100)
+
+        assert (records, stats) == parse_serial(CsvParser, file_path)
+        assert [record['src'] for record in records] == ['car_7', 'car_1']
+        assert stats['error_cnt'] == 3
+
+    def test_batch_hook_required(self):
+        """Парсер без пакетного режима не создается: ошибка при создании, а не при первом чтении"""
+
+        class LineOnlyParser(TestParser):
+            supported_extensions = {'.txt'}
+            parse_name = 'line_only'
+
+            def parse_data_stream(self, file_path: Path):
+                return iter(())
+
+        with pytest.raises(TypeError, match='_parse_lines_batch'):
+            LineOnlyParser()
+
+
+class TestParallelParsing:
+
+    def test_ranges_aligned_to_lines(self):
+        """Диапазоны покрывают файл без пропусков и начинаются с начала строки"""
+        file_path = SAMPLES_DIR / 'sample_big_test.ndjson'
+        content = file_path.read_bytes()
+
+        ranges = split_byte_ranges(file_path, 0, 1000)
+
+        assert ranges[0][0] == 0 and ranges[-1][1] == len(content)
+        assert all(end == next_start for (_, end), (next_start, _) in zip(ranges, ranges[1:]))
+        assert all(content[start - 1:start] == b'\n' for start, _ in ranges[1:])
+
+    def test_parallel_matches_serial(self, tmp_path):
+        """Параллельный парсинг по диапазонам дает тот же поток записей и те же счетчики"""
+        error_file = tmp_path / 'errors.csv'
+        error_file.write_text('\n'.join(ERROR_CSV_LINES) + '\n', encoding='utf-8')
+
+        for parser_class, file_path in [
+            (NJsonParser, SAMPLES_DIR / 'sample_big_test.ndjson'),
+            (CsvParser, SAMPLES_DIR / 'sample.csv'),
+            (CsvParser, error_file),
+        ]:
+            parser = parser_class()
+            records = [
+                row
+                for batches in parse_parallel(parser, file_path, workers=2, batch_size=5, range_size=97)
+                for batch in batches
+                for row in batch.to_pylist()
+            ]
+
+            assert (records, parser.get_stats()) == parse_serial(parser_class, file_path)
+
+
+class ExtendedRecord(BaseModel):
+    """Модель с полями, которых нет в ParseResult, для проверки построения валидатора"""
+
+    ts_us: int = Field(..., ge=0)
+    channel: Optional[int] = Field(None, lt=8)
+    label: str = Field(..., max_length=3)
+
+    @field_validator('label')
+    @classmethod
+    def label_validator(cls, v):
+        if v.startswith('x'):
+            raise ValueError('label must not start with x')
+        return v
+
+
+def validate_by_model(model, rows):
+    accepted = []
+    for row in rows:
+        try:
+            accepted.append(model(**{key: value for key, value in row.items() if value is not None}).model_dump())
+        except ValidationError:
+            pass
+    return accepted
+
+
+class TestColumnValidator:
+
+    def test_string_columns_coerced_like_pydantic(self):
+        """Строковые колонки приводятся к типам так же, как при построчной валидации"""
+        columns = {
+            'ts_us': ['1_000', '5', 'x', ' 7', '9', '-3'],
+            'event': ['tx', 'rx', 'tx', 'tx', 'tx', 'tx'],
+            'src': ['car_1'] * 6,
+            'dst': ['car_2'] * 6,
+            'pkt_id': ['p'] * 6,
+            'app': ['BSM'] * 6,
+            'bytes': ['1', '2', '3', '4', '5.0', '6'],
+            'rssi_dbm': ['-1', None, '-200', 'nan', '-5', '-1'],
+        }
+        table = pa.table(columns)
+
+        batch, invalid_cnt = validate_batch(table)
+
+        assert batch.to_pylist() == validate_by_model(ParseResult, table.to_pylist())
+        assert invalid_cnt == 3
+
+    def test_validator_follows_model_fields(self):
+        """Правила валидатора строятся по полям модели, включая field_validator и запрет лишних полей"""
+        validator = ColumnValidator(ExtendedRecord)
+        table = pa.table({
+            'ts_us': [1, -1, 2, 3, 4],
+            'channel': [1, 2, 9, None, 3],
+            'label': ['ab', 'ab', 'ab', 'xyz', 'abcd'],
+        })
+
+        batch, invalid_cnt = validator.validate(table)
+
+        assert validator.schema.names == ['ts_us', 'channel', 'label']
+        assert batch.to_pylist() == validate_by_model(ExtendedRecord, table.to_pylist())
+        assert invalid_cnt == 4
@@ -0,0 +1,1424 @@
+import os
+import sys
+import json
+import math
+import collections
+import pickle
+import statistics
+
+import numpy as np
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.parquet as pq
+import pytest
+
+from pathlib import Path
+
+current_dir = os.path.dirname(os.path.abspath(__file__))
+project_root = os.path.dirname(os.path.join(current_dir, '..', '..'))
+sys.path.insert(0, project_root)
+
+from configs.models import ParseResult, PacketRecord, LatencyStats
+from main_scripts.parsers import NJsonParser
+from main_scripts.batch_validation import records_to_batch
+from main_scripts.export import export_comprehensive
+from main_scripts import external_sort
+from main_scripts.external_sort import ExternalSortMetrics, parse_memory_size
+from main_scripts.input_merge import collect_input_files, merge_batches
+from main_scripts import processor
+from main_scripts.processor import MetricsCalculator, EXPIRY_QUEUE_FACTOR
+from main_scripts.partitioned_metrics import PartitionedMetricsCalculator, partition_of
+from main_scripts.vectorized_engine import group_percentiles
+from main_scripts.window_sinks import CallbackWindowSink, ParquetWindowSink
+from support_scripts.quantile_sketch import LatencySketch
+from support_scripts.running_stats import RunningStats
+from support_scripts.seen_filter import SeenFilter
+from support_scripts.spill_store import PendingSpillStore, ENTRY_BYTES
+from support_scripts import pending_table
+from support_scripts.pending_table import PendingPacketTable
+from support_scripts.symbol_table import SymbolTable
+from support_scripts import window_store
+from support_scripts.window_store import WindowPairStore, FIELD_INDEX
+from tests.test_data import RAW_TEST_DATA
+
+SAMPLES_DIR = Path(current_dir).parent.parent.parent / 'tests'
+SAMPLE_FILE = SAMPLES_DIR / 'sample_big_test.ndjson'
+
+
+def reference_result(window_size: int = 1000000):
+    """Эталонный расчет: построчный парсинг в ParseResult и поштучная обработка"""
+    calculator = MetricsCalculator(window_size=window_size)
+
+    for record in NJsonParser().parse_data_stream(SAMPLE_FILE):
+        calculator.process_record(record)
+
+    return calculator.get_metrics_result()
+
+
+def assert_results_close(result, expected, path=()):
+    """Сравнение итоговых метрик с допуском на порядок суммирования float"""
+    if hasattr(result, 'model_dump'):
+        result, expected = result.model_dump(), expected.model_dump()
+
+    if isinstance(result, dict):
+        assert result.keys() == expected.keys(), path
+        for key in result:
+            assert_results_close(result[key], expected[key], path + (key,))
+    elif isinstance(result, float) and isinstance(expected, float):
+        assert math.isclose(result, expected, rel_tol=1e-9, abs_tol=1e-9), path
+    else:
+        assert result == expected, path
+
+
+class TestPacketRecord:
+
+    def test_round_trip(self):
+        """Преобразование PacketRecord <-> ParseResult не теряет данных"""
+        for raw in RAW_TEST_DATA:
+            model = ParseResult(**raw)
+            record = PacketRecord.from_parse_result(model)
+
+            assert record.to_parse_result() == model
+            assert PacketRecord(**record.to_parse_result().model_dump()) == record
+
+    def test_records_match_models(self):
+        """Калькулятор дает одинаковый результат для PacketRecord и ParseResult"""
+        calculator = MetricsCalculator()
+        for record in NJsonParser().parse_records(SAMPLE_FILE, batch_size=50):
+            calculator.process_record(record)
+
+        assert calculator.get_metrics_result() == reference_result()
+
+    def test_matched_pair_is_subscriptable(self):
+        """Сопоставленная пара доступна и по атрибутам, и по ключам"""
+        calculator = MetricsCalculator()
+        calculator.process_record(PacketRecord(**RAW_TEST_DATA[0]))
+        matched_pair = calculator.process_record(PacketRecord(**RAW_TEST_DATA[1]))
+
+        assert matched_pair['latency'] == matched_pair.latency == 200
+        assert matched_pair.get('sinr_db') == 17.5
+
+
+class TestLatencySketch:
+
+    def test_quantiles_within_relative_accuracy(self):
+        """Перцентили скетча отличаются от np.percentile не более чем на заданную относительную ошибку"""
+        rng = np.random.default_rng(0)
+        values = np.concatenate([rng.lognormal(7, 1.5, 20000).astype(int), np.zeros(50, dtype=int)])
+
+        sketch = LatencySketch(relative_accuracy=0.01)
+        sketch.extend(values.tolist())
+
+        for q in (0.01, 0.5, 0.95, 0.999):
+            expected = np.percentile(values, q * 100)
+            assert abs(sketch.quantile(q) - expected) <= 0.01 * expected + 1e-9
+
+    def test_merge_equals_single_sketch(self):
+        """Объединение скетчей частей данных совпадает со скетчем всех данных"""
+        values = list(range(0, 5000, 3))
+
+        whole = LatencySketch()
+        whole.extend(values)
+
+        left, right = LatencySketch(), LatencySketch()
+        left.extend(values[::2])
+        right.extend(values[1::2])
+        left.merge(right)
+
+        assert left.buckets == whole.buckets and left.count == whole.count
+        assert left.quantile(0.95) == whole.quantile(0.95)
+
+    def test_sketch_backend_matches_exact(self):
+        """Бэкенд sketch меняет только перцентили latency и только в пределах точности"""
+        calculator = MetricsCalculator(latency_backend='sketch', latency_accuracy=0.01)
+        for record in NJsonParser().parse_data_stream(SAMPLE_FILE):
+            calculator.process_record(record)
+
+        result, expected = calculator.get_metrics_result(), reference_result()
+
+        for group in ('by_pair', 'by_app', 'by_window'):
+            assert getattr(result, group).keys() == getattr(expected, group).keys()
+
+            for key, metrics in getattr(result, group).items():
+                expected_metrics = getattr(expected, group)[key]
+                stats, expected_stats = metrics.latency_stats, expected_metrics.latency_stats
+
+                assert metrics.pdr_metrics == expected_metrics.pdr_metrics
+                assert stats.count == expected_stats.count
+                assert math.isclose(stats.mean, expected_stats.mean)
+                assert math.isclose(stats.std, expected_stats.std, abs_tol=1e-9)
+                assert abs(stats.p50 - expected_stats.p50) <= 0.01 * expected_stats.p50 + 1e-9
+                assert abs(stats.p95 - expected_stats.p95) <= 0.01 * expected_stats.p95 + 1e-9
+
+
+class TestRunningStats:
+
+    def test_matches_statistics(self):
+        """Онлайн-накопитель дает те же среднее и стандартное отклонение, что и statistics, в том числе после merge"""
+        values = [250.0, 90.0, 1e6 + 0.5, 1e6 + 1.5, 17.25, 0.0]
+
+        stats, left, right = RunningStats(), RunningStats(), RunningStats()
+        for value in values:
+            stats.update(value)
+        for value in values[:2]:
+            left.update(value)
+        for value in values[2:]:
+            right.update(value)
+        left.merge(right)
+
+        for accumulator in (stats, left):
+            assert accumulator.count == len(values)
+            assert math.isclose(accumulator.mean, statistics.mean(values))
+            assert math.isclose(accumulator.std, statistics.stdev(values))
+
+    def test_live_means_in_curr_stats(self):
+        """Средние latency, SINR и RSSI доступны во время обработки, SINR по приложениям считается"""
+        calculator = MetricsCalculator()
+        for raw in RAW_TEST_DATA[:2]:
+            calculator.process_record(PacketRecord(**raw))
+
+        curr_stats = calculator.get_curr_stats()
+        assert (curr_stats['latency_mean'], curr_stats['sinr_avg'], curr_stats['rssi_avg']) == (200, 17.5, -67)
+
+        app_metrics = calculator.get_metrics_result().by_app['BSM']
+        assert (app_metrics.sinr_avg, app_metrics.sinr_count, app_metrics.rssi_avg) == (17.5, 1, -67)
+
+
+def packet(ts_us: int, event: str, pkt_id: str, src: str = 'car_1', dst: str = 'car_2') -> PacketRecord:
+    if event == 'rx':
+        src, dst = dst, src
+    return PacketRecord(ts_us=ts_us, event=event, src=src, dst=dst, pkt_id=pkt_id, app='BSM', bytes=100)
+
+
+class TestMatchTimeout:
+
+    def test_large_timeout_keeps_metrics(self):
+        """Время ожидания больше длительности записи не меняет метрики"""
+        calculator = MetricsCalculator(match_timeout_us=10 ** 12)
+        for record in NJsonParser().parse_data_stream(SAMPLE_FILE):
+            calculator.process_record(record)
+        calculator.flush_pending()
+
+        result, expected = calculator.get_metrics_result(), reference_result()
+
+        assert (result.overall, result.by_pair, result.by_window) == (expected.overall, expected.by_pair, expected.by_window)
+        assert calculator.get_curr_stats()['pending_tx'] == calculator.get_curr_stats()['pending_rx'] == 0
+
+    def test_expired_records_are_evicted(self):
+        """Просроченный tx считается потерянным, rx без пары учитывается только при вытеснении"""
+        calculator = MetricsCalculator(match_timeout_us=1000)
+
+        for record in [
+            packet(0, 'tx', 'lost'),
+            packet(400, 'rx', 'early'),
+            packet(300, 'tx', 'early'),
+            packet(450, 'tx', 'ok'),
+            packet(600, 'rx', 'ok'),
+            packet(5000, 'tx', 'next'),
+            packet(5100, 'rx', 'lost'),
+        ]:
+            calculator.process_record(record)
+
+        assert calculator.anomalies['lost_tx'] == 1
+        assert calculator.anomalies['rx_without_tx'] == 0
+        assert set(calculator.tx_records) == {'next'}
+
+        calculator.flush_pending()
+
+        assert calculator.anomalies['lost_tx'] == 2
+        assert calculator.anomalies['rx_without_tx'] == 1
+        assert calculator.success_cnt == 2
+        assert not calculator.tx_records and not calculator.rx_records
+
+    def test_pending_memory_is_bounded(self):
+        """Количество ожидающих записей ограничено окном ожидания, а не длиной потока"""
+        calculator = MetricsCalculator(match_timeout_us=5000)
+        max_pending = 0
+
+        for i in range(20000):
+            calculator.process_record(packet(i * 100, 'tx', f'p{i}'))
+            if i % 10:
+                calculator.process_record(packet(i * 100 + 250, 'rx', f'p{i}'))
+
+            max_pending = max(max_pending, len(calculator.tx_records) + len(calculator._tx_expiry))
+
+        calculator.flush_pending()
+
+        assert max_pending <= 2 * (5000 // 100 + 2)
+        assert calculator.anomalies['lost_tx'] == 2000
+
+
+class TestPendingPacketTable:
+
+    def test_matches_dict(self):
+        """Таблица на массивах ведет себя как словарь при вставках, удалениях и повторном использовании ключей"""
+        rng = np.random.default_rng(0)
+        table, expected = PendingPacketTable(capacity=1), {}
+
+        for i, (op, key) in enumerate(zip(rng.random(30000), rng.integers(0, 3000, 30000))):
+            pkt_id = f"p{key}"
+
+            if op < 0.6:
+                table[pkt_id] = expected[pkt_id] = packet(i, 'tx', pkt_id, src=f"car_{i % 7}")
+            elif op < 0.9:
+                assert (pkt_id in table) == (pkt_id in expected)
+                if pkt_id in expected:
+                    del table[pkt_id], expected[pkt_id]
+            else:
+                assert table.get(pkt_id) == expected.get(pkt_id)
+
+        assert len(table) == len(expected) and set(table) == set(expected)
+        assert all(table[pkt_id] == record for pkt_id, record in expected.items())
+
+    def test_hash_collisions_compare_full_key(self, monkeypatch):
+        """При полном совпадении хэшей ключи различаются по полному pkt_id"""
+        monkeypatch.setattr(pending_table, 'hash', lambda pkt_id: 42, raising=False)
+
+        table = PendingPacketTable()
+        records = {f"p{i}": packet(i, 'tx', f"p{i}") for i in range(50)}
+        for pkt_id, record in records.items():
+            table[pkt_id] = record
+        del table['p7']
+
+        assert len(table) == 49 and 'p7' not in table
+        assert all(table[pkt_id] == record for pkt_id, record in records.items() if pkt_id != 'p7')
+
+    def test_bytes_per_pending_packet(self):
+        """На ожидающий пакет приходится меньше 64 байт"""
+        table = PendingPacketTable()
+        for i in range(100000):
+            table[f"pkt_{i:09d}"] = packet(i, 'tx', f"pkt_{i:09d}")
+
+        assert table.nbytes / len(table) < 64
+
+    def test_array_store_matches_reference(self):
+        """Калькулятор с хранилищем array дает те же метрики, в том числе при вытеснении"""
+        result = MetricsCalculator(pending_store='array')
+        for record in NJsonParser().parse_data_stream(SAMPLE_FILE):
+            result.process_record(record)
+
+        assert result.get_metrics_result() == reference_result()
+
+        calculators = [MetricsCalculator(match_timeout_us=500000, pending_store=store) for store in ('dict', 'array')]
+        for record in NJsonParser().parse_records(SAMPLE_FILE):
+            for calculator in calculators:
+                calculator.process_record(record)
+
+        for calculator in calculators:
+            calculator.flush_pending()
+
+        assert calculators[0].get_metrics_result() == calculators[1].get_metrics_result()
+
+
+class TestSymbolTable:
+
+    def test_encode_array_matches_encode(self):
+        """Векторное кодирование колонки выдает те же коды, что и поштучное, и пополняет таблицу"""
+        symbols = SymbolTable(['car_2'])
+        column = pa.chunked_array([['car_1', 'car_2'], ['car_3', 'car_1']])
+
+        codes = symbols.encode_array(column)
+
+        assert codes.tolist() == [1, 0, 2, 1]
+        assert [symbols.decode(code) for code in codes] == column.to_pylist()
+        assert symbols.encode('car_3') == 2 and len(symbols) == 3
+
+    def test_encoded_records_match_reference(self):
+        """Калькулятор на кодах src/dst/app дает те же метрики со строковыми ключами"""
+        for pending_store in ('dict', 'array'):
+            symbols = SymbolTable()
+            calculator = MetricsCalculator(pending_store=pending_store, symbols=symbols)
+
+            for record in NJsonParser().parse_records(SAMPLE_FILE, batch_size=64, symbols=symbols):
+                assert isinstance(record.src, int) and isinstance(record.app, int)
+                calculator.process_record(record)
+
+            assert calculator.get_metrics_result() == reference_result()
+
+        calculator = MetricsCalculator(symbols=SymbolTable())
+        for batch in NJsonParser().parse_batches(SAMPLE_FILE, batch_size=64):
+            calculator.process_batch(batch)
+
+        assert calculator.get_metrics_result() == reference_result()
+
+
+class TestVectorizedEngine:
+
+    def test_matches_reference(self):
+        """Колоночный движок дает те же метрики и аномалии, что и построчный, при любом размере пакета"""
+        expected = MetricsCalculator()
+        for record in NJsonParser().parse_data_stream(SAMPLE_FILE):
+            expected.process_record(record)
+
+        for batch_size in (1, 7, 64, 100000):
+            calculator = MetricsCalculator(engine='vectorized')
+            for batch in NJsonParser().parse_batches(SAMPLE_FILE, batch_size=batch_size):
+                calculator.process_batch(batch)
+
+            assert_results_close(calculator.get_metrics_result(), expected.get_metrics_result())
+
+            stats, expected_stats = calculator.get_curr_stats(), expected.get_curr_stats()
+            for key in ('processed_cnt', 'sucess_cnt', 'pending_tx', 'pending_rx', 'anomalies'):
+                assert stats[key] == expected_stats[key]
+
+    def test_order_within_and_across_batches(self):
+        """rx до своего tx, дубликаты tx и неверное направление учитываются так же, как при построчной обработке"""
+        records = [
+            packet(100, 'rx', 'a'),
+            packet(50, 'tx', 'a'),
+            packet(60, 'tx', 'a'),
+            packet(200, 'rx', 'b'),
+            packet(300, 'rx', 'a'),
+            packet(150, 'tx', 'b'),
+            packet(400, 'tx', 'c'),
+            packet(500, 'rx', 'c', src='car_3'),
+            packet(350, 'rx', 'c'),
+            packet(600, 'rx', 'd'),
+        ]
+        rows = [{name: getattr(record, name) for name in PacketRecord.__slots__} for record in records]
+
+        expected = MetricsCalculator()
+        for record in records:
+            expected.process_record(record)
+
+        for split in range(1, len(rows)):
+            calculator = MetricsCalculator(engine='vectorized')
+            calculator.process_batch(records_to_batch(rows[:split]))
+            calculator.process_batch(records_to_batch(rows[split:]))
+
+            assert calculator.anomalies == expected.anomalies
+            assert calculator.success_cnt == expected.success_cnt
+            assert_results_close(calculator.get_metrics_result(), expected.get_metrics_result())
+
+    def test_unsupported_modes(self):
+        """Колоночный движок принимает только пакеты и не поддерживает вытеснение по времени"""
+        with pytest.raises(ValueError):
+            MetricsCalculator(engine='vectorized', match_timeout_us=1000)
+
+        with pytest.raises(RuntimeError):
+            MetricsCalculator(engine='vectorized').process_record(packet(0, 'tx', 'a'))
+
+
+class TestPartitionedMetrics:
+
+    def test_matches_serial(self):
+        """Расчет по секциям pkt_id в нескольких процессах дает те же аномалии, PDR и метрики"""
+        for options in ({}, {'match_timeout_us': 300000}, {'engine': 'vectorized', 'latency_backend': 'sketch'}):
+            serial = MetricsCalculator(symbols=SymbolTable(), **options)
+            partitioned = PartitionedMetricsCalculator(3, **options)
+
+            for batch in NJsonParser().parse_batches(SAMPLE_FILE, batch_size=16):
+                serial.process_batch(batch)
+                partitioned.process_batch(batch)
+
+            merged = partitioned.result()
+
+            # Ожидающие записи вытеснены по watermark всего потока еще до flush_pending, как при последовательном
+            # расчете (иначе сохраненное состояние отличалось бы)
+            for flushed in (False, True):
+                if flushed:
+                    for calculator in (serial, merged):
+                        calculator.flush_pending()
+
+                stats, expected_stats = merged.get_curr_stats(), serial.get_curr_stats()
+                for key in ('processed_cnt', 'sucess_cnt', 'pending_tx', 'pending_rx', 'anomalies'):
+                    assert stats[key] == expected_stats[key]
+
+            assert_results_close(merged.get_metrics_result(), serial.get_metrics_result())
+
+    def test_stable_partitions(self):
+        """Номер секции не зависит от процесса и пакета, в котором встретился pkt_id"""
+        pkt_ids = pa.array([f"pkt_{i}" for i in range(1000)])
+        partitions = partition_of(pkt_ids, 4)
+
+        assert partitions.tolist() == partition_of(pkt_ids[::-1], 4)[::-1].tolist()
+        assert set(partitions.tolist()) == {0, 1, 2, 3}
+
+    def test_pickle_and_merge_with_other_symbols(self):
+        """Калькулятор переживает pickle, а merge переводит коды другой таблицы символов"""
+        records = list(NJsonParser().parse_data_stream(SAMPLE_FILE))
+        parts = partition_of(pa.array([record.pkt_id for record in records]), 2)
+
+        left = MetricsCalculator(symbols=SymbolTable(['car_9']))
+        right = MetricsCalculator(pending_store='array', symbols=SymbolTable())
+        for record, part in zip(records, parts.tolist()):
+            calculator = left if part == 0 else right
+            calculator.process_record(PacketRecord(
+                **{**record.model_dump(), **{name: calculator.symbols.encode(getattr(record, name))
+                                             for name in ('src', 'dst', 'app')}}
+            ))
+
+        left = pickle.loads(pickle.dumps(left))
+        left.merge(pickle.loads(pickle.dumps(right)))
+
+        expected = MetricsCalculator()
+        for record in records:
+            expected.process_record(record)
+
+        stats, expected_stats = left.get_curr_stats(), expected.get_curr_stats()
+        for key in ('processed_cnt', 'sucess_cnt', 'pending_tx', 'pending_rx', 'anomalies'):
+            assert stats[key] == expected_stats[key]
+
+        assert_results_close(left.get_metrics_result(), expected.get_metrics_result())
+
+
+class TestCalculatorState:
+
+    def test_save_load_round_trip(self, tmp_path):
+        """Сохраненное и загруженное состояние дает те же метрики и продолжает обработку"""
+        records = list(NJsonParser().parse_data_stream(SAMPLE_FILE))
+        calculator = MetricsCalculator(pending_store='array', symbols=SymbolTable())
+        for record in records[:100]:
+            calculator.process_record(PacketRecord(**{**record.model_dump(), **{
+                name: calculator.symbols.encode(getattr(record, name)) for name in ('src', 'dst', 'app')
+            }}))
+
+        calculator.save_state(tmp_path / 'part.state')
+        loaded = MetricsCalculator.load_state(tmp_path / 'part.state')
+        assert_results_close(loaded.get_metrics_result(), calculator.get_metrics_result())
+
+        for record in records[100:]:
+            loaded.process_record(PacketRecord(**{**record.model_dump(), **{
+                name: loaded.symbols.encode(getattr(record, name)) for name in ('src', 'dst', 'app')
+            }}))
+        assert_results_close(loaded.get_metrics_result(), reference_result())
+
+    def test_merge_matches_pending_across_parts(self, tmp_path):
+        """Части потока, объединенные через состояния, дают метрики последовательной обработки всего потока"""
+        rows = [record.model_dump(mode='json') for record in NJsonParser().parse_data_stream(SAMPLE_FILE)]
+
+        for options in ({}, {'engine': 'vectorized'}, {'match_timeout_us': 30000000, 'pending_store': 'array'}):
+            expected = MetricsCalculator(symbols=SymbolTable(), **options)
+            expected.process_batch(records_to_batch(rows))
+            expected.flush_pending()
+
+            for split in (1, 57, 120, 197):
+                paths = []
+                for index, part in enumerate((rows[:split], rows[split:])):
+                    calculator = MetricsCalculator(symbols=SymbolTable(), **options)
+                    calculator.process_batch(records_to_batch(part))
+                    paths.append(tmp_path / f"part_{index}.state")
+                    calculator.save_state(paths[-1])
+
+                merged = MetricsCalculator.load_state(paths[0])
+                merged.merge(MetricsCalculator.load_state(paths[1]))
+                merged.flush_pending()
+
+                stats, expected_stats = merged.get_curr_stats(), expected.get_curr_stats()
+                for key in ('processed_cnt', 'sucess_cnt', 'pending_tx', 'pending_rx', 'anomalies'):
+                    assert stats[key] == expected_stats[key]
+
+                assert_results_close(merged.get_metrics_result(), expected.get_metrics_result())
+
+    def test_merge_warns_on_tx_repeated_across_parts(self, caplog):
+        """tx, повторенный во второй части, учитывается как duplicate_tx, а о расхождении с последовательным
+        расчетом пишется предупреждение"""
+        parts = ([packet(100, 'tx', 'p')], [packet(500, 'rx', 'p'), packet(600, 'tx', 'p')])
+
+        for options in ({}, {'engine': 'vectorized'}):
+            expected = MetricsCalculator(symbols=SymbolTable(), **options)
+            calculators = [MetricsCalculator(symbols=SymbolTable(), **options) for _ in parts]
+            for calculator, records in zip(calculators, parts):
+                rows = [{name: getattr(record, name) for name in PacketRecord.__slots__} for record in records]
+                calculator.process_batch(records_to_batch(rows))
+                expected.process_batch(records_to_batch(rows))
+
+            merged = calculators[0]
+            with caplog.at_level('WARNING', logger=processor.logger.name):
+                merged.merge(calculators[1])
+
+            assert merged.anomalies['duplicate_tx'] == expected.anomalies['duplicate_tx'] == 1
+            assert merged.accumulated_data['overall']['tx'] == expected.accumulated_data['overall']['tx'] == 1
+            assert '1 дубликатов TX' in caplog.text
+            caplog.clear()
+
+            # Ограничение merge: rx второй части остается сопоставленным с ее копией tx (latency -100 вместо 400)
+            assert merged.anomalies['negative_latency'] == 1 and expected.anomalies['negative_latency'] == 0
+
+    def test_rejects_foreign_files(self, tmp_path):
+        """Загрузка файла, который не является состоянием калькулятора, и объединение несовместимых состояний"""
+        path = tmp_path / 'other.pkl'
+        path.write_bytes(pickle.dumps({'format': 'other'}))
+
+        with pytest.raises(ValueError):
+            MetricsCalculator.load_state(path)
+
+        with pytest.raises(ValueError):
+            MetricsCalculator(window_size=1000).merge(MetricsCalculator(window_size=2000))
+
+
+class TestMetricsSnapshot:
+
+    def test_unchanged_result_is_reused(self):
+        """Повторный расчет без новых записей возвращает тот же результат, а после flush_pending - те же таблицы"""
+        calculator = MetricsCalculator(match_timeout_us=30000000)
+        for record in NJsonParser().parse_records(SAMPLE_FILE):
+            calculator.process_record(record)
+
+        result = calculator.get_columnar_result()
+        assert calculator.get_columnar_result() is result
+        assert calculator.get_metrics_result() is calculator.get_metrics_result()
+
+        calculator.flush_pending()
+        flushed = calculator.get_columnar_result()
+
+        assert flushed is not result
+        assert flushed.anomalies['lost_tx'] >= result.anomalies['lost_tx']
+        assert flushed.by_window is result.by_window
+
+    def test_incremental_snapshots_match_full_result(self):
+        """Промежуточные расчеты пересчитывают только измененные группы и не меняют итоговый результат"""
+        records = list(NJsonParser().parse_records(SAMPLE_FILE))
+        calculator = MetricsCalculator()
+
+        for start in range(0, len(records), 40):
+            for record in records[start:start + 40]:
+                calculator.process_record(record)
+            snapshot = calculator.get_metrics_result()
+
+        assert_results_close(snapshot, reference_result())
+
+        last = records[-1]
+        calculator.process_record(PacketRecord(
+            ts_us=last.ts_us, event='tx', src=last.src, dst=last.dst, pkt_id='snapshot_extra', app=last.app,
+            bytes=last.bytes
+        ))
+        result = calculator.get_metrics_result()
+
+        assert result.by_pair[(last.src, last.dst)].pdr_metrics.tx_count == (
+            snapshot.by_pair[(last.src, last.dst)].pdr_metrics.tx_count + 1
+        )
+        assert sum(result.by_pair[key] != metrics for key, metrics in snapshot.by_pair.items()) == 1
+
+
+class TestColumnarResult:
+
+    def test_tables_match_models(self):
+        """Таблицы колоночного результата и модели MetricsResult содержат одни и те же метрики"""
+        calculator = MetricsCalculator(percentiles=(90, 99.9))
+        for record in NJsonParser().parse_records(SAMPLE_FILE):
+            calculator.process_record(record)
+
+        columnar = calculator.get_columnar_result()
+        result = columnar.to_metrics_result()
+
+        assert columnar.by_window.num_rows == len(result.by_window)
+        assert columnar.by_pair.column_names[:3] == ['src', 'dst', 'app']
+        assert 'latency_p99.9' in columnar.by_app.column_names
+
+        for row in columnar.by_pair.to_pylist():
+            metrics = result.by_pair[(row['src'], row['dst'])]
+            assert row['tx_count'] == metrics.pdr_metrics.tx_count
+            assert row['latency_p90'] == metrics.latency_stats.percentiles['p90']
+            assert row['rssi_avg'] == metrics.rssi_avg
+
+        restored = type(columnar).from_metrics_result(result)
+        for name in ('overall', 'by_pair', 'by_app', 'by_window'):
+            assert getattr(restored, name).equals(getattr(columnar, name))
+
+        assert calculator.get_summary() == {
+            'overall_pdr': result.overall.pdr_metrics.pdr,
+            'overall_latency_mean': result.overall.latency_stats.mean,
+            'unique_pairs': len(result.by_pair),
+            'unique_apps': len(result.by_app),
+            'time_windows': len(result.by_window)
+        }
+
+    def test_export_from_tables(self, tmp_path):
+        """Выгрузка колоночного результата совпадает с выгрузкой модели MetricsResult"""
+        calculator = MetricsCalculator()
+        for record in NJsonParser().parse_records(SAMPLE_FILE):
+            calculator.process_record(record)
+
+        columnar_files = export_comprehensive(calculator.get_columnar_result(), tmp_path / 'columnar')
+        model_files = export_comprehensive(calculator.get_metrics_result(), tmp_path / 'model')
+
+        assert columnar_files.keys() == model_files.keys()
+        for name, path in columnar_files.items():
+            if name.endswith('_csv'):
+                assert path.read_text() == model_files[name].read_text()
+
+
+class TestVectorizedFinalization:
+
+    PERCENTILES = (0, 50, 90, 95, 99, 99.9, 100)
+
+    def test_group_percentiles_match_numpy(self):
+        """Перцентили всех групп за одну сортировку совпадают с np.percentile по каждой группе"""
+        rng = np.random.default_rng(3)
+        counts = rng.integers(0, 50, 200)
+        groups = [rng.integers(-1000, 1000000, count).astype(np.float64) for count in counts]
+
+        result = group_percentiles(np.concatenate(groups), counts, self.PERCENTILES)
+
+        for values, row in zip(groups, result):
+            expected = [np.percentile(values, percentile) if len(values) else 0.0 for percentile in self.PERCENTILES]
+            assert row.tolist() == expected
+
+    def test_configured_percentiles(self):
+        """Дополнительные перцентили групп совпадают с LatencyStats.create по списку задержек группы"""
+        calculator = MetricsCalculator(percentiles=(90, 99, 99.9))
+        for record in NJsonParser().parse_records(SAMPLE_FILE):
+            calculator.process_record(record)
+
+        result = calculator.get_metrics_result()
+        for (src, dst), metrics in result.by_pair.items():
+            data = calculator.accumulated_data['by_pair'][(src, dst)]
+            expected = LatencyStats.create(data['latency'], data['latency_stats'], (90, 99, 99.9))
+
+            assert metrics.latency_stats == expected
+            if expected.count:
+                assert set(metrics.latency_stats.percentiles) == {'p90', 'p99', 'p99.9'}
+
+        default = reference_result()
+        assert all(not metrics.latency_stats.percentiles for metrics in default.by_window.values())
+        assert result.overall.latency_stats.p95 == default.overall.latency_stats.p95
+
+    def test_sketch_percentiles(self):
+        """Для sketch дополнительные перцентили берутся из скетча с той же точностью"""
+        exact = MetricsCalculator(percentiles=(99,))
+        sketch = MetricsCalculator(latency_backend='sketch', percentiles=(99,))
+        for record in NJsonParser().parse_records(SAMPLE_FILE):
+            exact.process_record(record)
+            sketch.process_record(record)
+
+        expected = exact.get_metrics_result().overall.latency_stats.percentiles['p99']
+        result = sketch.get_metrics_result().overall.latency_stats.percentiles['p99']
+        assert math.isclose(result, expected, rel_tol=0.02)
+
+        with pytest.raises(ValueError):
+            MetricsCalculator(percentiles=(101,))
+
+
+class TestWindowPairStore:
+
+    @staticmethod
+    def columns(rng, size, window_span):
+        """Случайные сопоставленные пары по window_span окнам размера 1000 и 50 парам"""
+        ts_us = rng.integers(0, window_span * 1000, size)
+        sinr = np.where(rng.random(size) < 0.2, np.nan, rng.normal(20, 5, size))
+        return (
+            ts_us, rng.integers(0, 10, size), rng.integers(0, 5, size), rng.integers(0, 100000, size), sinr,
+            rng.normal(-80, 5, size)
+        )
+
+    @staticmethod
+    def fill(store, columns):
+        ts_us, src, dst = columns[:3]
+        store.add_counts('tx', ts_us, src, dst)
+        store.add_matched_columns(*columns)
+
+    def test_sparse_layout_matches_dense(self, monkeypatch):
+        """Разреженные ячейки дают те же счетчики, моменты и задержки, что и плотный блок"""
+        columns = self.columns(np.random.default_rng(5), 2000, 40)
+        ts_us, src, dst, latency = columns[:4]
+
+        dense = WindowPairStore(1000)
+        self.fill(dense, columns)
+
+        monkeypatch.setattr(window_store, 'DENSE_MIN_CELLS', 0)
+        monkeypatch.setattr(window_store, 'DENSE_MIN_DENSITY', 2.0)
+        sparse = WindowPairStore(1000)
+        self.fill(sparse, columns)
+
+        assert dense.dense and not sparse.dense
+
+        windows, pairs, values = sparse.cells()
+        for result, expected in zip(sparse.cells(), dense.cells()):
+            np.testing.assert_allclose(result, expected)
+
+        keys = [(int(window), sparse.pair_keys[pair]) for window, pair in zip(windows, pairs)]
+        expected = {}
+        for key in zip((ts_us // 1000).tolist(), zip(src.tolist(), dst.tolist())):
+            expected[key] = expected.get(key, 0) + 1
+        assert dict(zip(keys, values[FIELD_INDEX['tx']].tolist())) == expected
+        assert np.array_equal(values[FIELD_INDEX['tx']], values[FIELD_INDEX['rx']])
+        assert sorted(sparse.latencies()[2].tolist()) == sorted(latency.tolist())
+
+    def test_sparse_pairs_do_not_allocate_dense_block(self):
+        """Пары, каждая из которых активна в одном окне, и разрывы во времени не раздувают память"""
+        store = WindowPairStore(1000)
+        for pair in range(2000):
+            store.count('tx', pair * 1000, (pair, pair + 1))
+            store.add_matched(pair * 1000, (pair, pair + 1), 10, None, -80.0)
+        store.count('tx', 10 ** 15, (0, 1))
+
+        windows, pairs, values = store.cells()
+
+        assert not store.dense
+        assert len(windows) == 2001
+        assert store.nbytes < 2001 * len(window_store.FIELDS) * 8 * 4
+        assert values[FIELD_INDEX['sinr_count']].sum() == 0
+        assert values[FIELD_INDEX['rssi_mean'], :-1].tolist() == [-80.0] * 2000
+
+    def test_merge_and_pickle(self):
+        """Объединение хранилищ частей данных равно хранилищу всех данных, в том числе после pickle"""
+        rng = np.random.default_rng(7)
+        whole, first, second = WindowPairStore(1000), WindowPairStore(1000), WindowPairStore(1000)
+
+        for part in (first, second):
+            columns = self.columns(rng, 500, 20)
+            self.fill(part, columns)
+            self.fill(whole, columns)
+
+        first = pickle.loads(pickle.dumps(first))
+        first.merge(pickle.loads(pickle.dumps(second)))
+
+        result, expected = first.cells(), whole.cells()
+        np.testing.assert_array_equal(result[0], expected[0])
+        np.testing.assert_array_equal(result[2][FIELD_INDEX['tx']], expected[2][FIELD_INDEX['tx']])
+        np.testing.assert_allclose(result[2], expected[2])
+        assert sorted(first.latencies()[2].tolist()) == sorted(whole.latencies()[2].tolist())
+
+
+class TestWindowClosing:
+
+    @pytest.fixture(autouse=True)
+    def emit_every_update(self, monkeypatch):
+        """Выгрузка закрытых окон на каждый сдвиг watermark, чтобы маленький пример проходил через поправки"""
+        monkeypatch.setattr(processor, 'WINDOW_EMIT_UPDATES', 1)
+
+    @staticmethod
+    def window_rows(table):
+        return {(row.pop('window_start'), row.pop('src'), row.pop('dst')): row for row in table.to_pylist()}
+
+    @staticmethod
+    def run(engine='record', **options):
+        tables = []
+        calculator = MetricsCalculator(engine=engine, window_sink=CallbackWindowSink(tables.append), **options)
+
+        if engine == 'vectorized':
+            for batch in NJsonParser().parse_batches(SAMPLE_FILE, batch_size=50):
+                calculator.process_batch(batch)
+        else:
+            for record in NJsonParser().parse_records(SAMPLE_FILE):
+                calculator.process_record(record)
+
+        open_cells = len(calculator.window_store.cells()[0])
+        calculator.flush_pending()
+        return calculator, pa.concat_tables(tables), open_cells
+
+    @pytest.mark.parametrize('engine', ['record', 'vectorized'])
+    def test_closed_windows_match_full_result(self, engine):
+        """Без опоздавших записей закрытые окна совпадают с окнами расчета без закрытия, а в памяти остаются
+        только открытые окна"""
+        calculator, emitted, open_cells = self.run(engine, allowed_lateness_us=1000000)
+        expected = MetricsCalculator()
+        for record in NJsonParser().parse_records(SAMPLE_FILE):
+            expected.process_record(record)
+        expected = expected.get_columnar_result()
+
+        assert calculator.anomalies['late_records'] == 0
+        assert not any(emitted.column('correction').to_pylist())
+        assert_results_close(
+            self.window_rows(emitted.drop_columns(['correction'])), self.window_rows(expected.by_window)
+        )
+        assert open_cells < expected.by_window.num_rows
+        assert calculator.get_columnar_result().by_window.num_rows == 0
+
+        result, expected = calculator.get_metrics_result(), expected.to_metrics_result()
+        assert_results_close(result.overall, expected.overall)
+        assert_results_close({key: value.model_dump() for key, value in result.by_pair.items()},
+                             {key: value.model_dump() for key, value in expected.by_pair.items()})
+
+    def test_late_records_and_corrections(self):
+        """Опоздавшие записи считаются в late_records и отбрасываются из окон или выгружаются поправками"""
+        dropped, dropped_rows, _ = self.run(allowed_lateness_us=0)
+        corrected, corrected_rows, _ = self.run(allowed_lateness_us=0, emit_corrections=True)
+        expected = reference_result()
+
+        late_records = dropped.anomalies['late_records']
+        assert late_records > 0
+        assert corrected.anomalies['late_records'] == late_records
+        assert not any(dropped_rows.column('correction').to_pylist())
+        assert any(corrected_rows.column('correction').to_pylist())
+
+        totals = {}
+        for row in corrected_rows.to_pylist():
+            key = (row['window_start'], row['src'], row['dst'])
+            tx, rx = totals.get(key, (0, 0))
+            totals[key] = (tx + row['tx_count'], rx + row['rx_count'])
+
+        assert totals == {
+            key: (metrics.pdr_metrics.tx_count, metrics.pdr_metrics.rx_count)
+            for key, metrics in expected.by_window.items()
+        }
+        assert sum(dropped_rows.column('rx_count').to_pylist()) < sum(rx for _, rx in totals.values())
+
+    def test_parquet_sink_and_options(self, tmp_path):
+        """Parquet приемник дописывает все закрытые окна в один файл, закрытие окон требует приемник"""
+        path = tmp_path / 'windows.parquet'
+        sink = ParquetWindowSink(path)
+        calculator = MetricsCalculator(allowed_lateness_us=0, window_sink=sink)
+        for record in NJsonParser().parse_records(SAMPLE_FILE):
+            calculator.process_record(record)
+        calculator.flush_pending()
+        sink.close()
+
+        assert pq.read_table(path).num_rows == sink.rows > 0
+
+        with pytest.raises(ValueError):
+            MetricsCalculator(allowed_lateness_us=0)
+
+        with pytest.raises(ValueError):
+            calculator.merge(MetricsCalculator())
+
+
+class TestWindowRollups:
+
+    @staticmethod
+    def calculate(**options):
+        calculator = MetricsCalculator(**options)
+        for record in NJsonParser().parse_records(SAMPLE_FILE):
+            calculator.process_record(record)
+        return calculator.get_columnar_result()
+
+    @pytest.mark.parametrize('latency_backend', ['exact', 'sketch'])
+    def test_rollups_match_single_resolution(self, latency_backend):
+        """Крупные окна, собранные из мелких ячеек, совпадают с расчетом с этим размером окна"""
+        window_sizes = (100000, 1000000, 5000000)
+        result = self.calculate(window_size=window_sizes, latency_backend=latency_backend, percentiles=(99,))
+
+        assert tuple(result.by_window_size) == window_sizes
+        assert result.by_window_size[100000] is result.by_window
+
+        for window_size, table in result.by_window_size.items():
+            expected = self.calculate(window_size=window_size, latency_backend=latency_backend, percentiles=(99,))
+            assert table.column_names == expected.by_window.column_names
+            assert_results_close(
+                TestWindowClosing.window_rows(table), TestWindowClosing.window_rows(expected.by_window)
+            )
+
+    def test_export_and_options(self, tmp_path):
+        """Каждый размер окна выгружается отдельной таблицей, размеры должны быть кратны наименьшему"""
+        exported = export_comprehensive(self.calculate(window_size=(1000000, 2000000)), tmp_path)
+
+        assert {'metrics_windows_parquet', 'metrics_windows_1000000_parquet',
+                'metrics_windows_2000000_parquet'} <= exported.keys()
+        assert not self.calculate().by_window_size
+
+        with pytest.raises(ValueError):
+            MetricsCalculator(window_size=(1000000, 1500000))
+
+        with pytest.raises(ValueError):
+            MetricsCalculator(window_size=(1000000, 2000000), allowed_lateness_us=0,
+                              window_sink=CallbackWindowSink(print))
+
+
+class TestHoppingWindows:
+
+    @staticmethod
+    def calculate(shift=0, **options):
+        calculator = MetricsCalculator(**options)
+        for record in NJsonParser().parse_records(SAMPLE_FILE):
+            record.ts_us += shift
+            calculator.process_record(record)
+        return calculator
+
+    @pytest.mark.parametrize('latency_backend', ['exact', 'sketch'])
+    def test_panes_match_shifted_tumbling_windows(self, latency_backend):
+        """Скользящие окна, собранные из панелей, совпадают с неперекрывающимися окнами со сдвинутым началом"""
+        options = dict(window_size=1000000, latency_backend=latency_backend, percentiles=(99,))
+        calculator = self.calculate(window_hop_us=250000, **options)
+        tumbling = self.calculate(window_size=250000, latency_backend=latency_backend)
+
+        # Запись обновляет одну панель: ячеек столько же, сколько у окон размером в шаг
+        assert len(calculator.window_store.cells()[0]) == len(tumbling.window_store.cells()[0])
+
+        expected = {}
+        for shift in range(0, 1000000, 250000):
+            rows = TestWindowClosing.window_rows(self.calculate(shift, **options).get_columnar_result().by_window)
+            expected.update({(start - shift, src, dst): row for (start, src, dst), row in rows.items()})
+
+        result = TestWindowClosing.window_rows(calculator.get_columnar_result().by_window)
+        assert_results_close(result, expected)
+
+    def test_sizes_and_options(self):
+        """Каждый размер строится из тех же панелей, размеры должны быть кратны шагу"""
+        result = self.calculate(window_size=(1000000, 2000000), window_hop_us=500000).get_columnar_result()
+
+        for window_size, table in result.by_window_size.items():
+            starts = np.unique(table.column('window_start').to_numpy())
+            assert not np.any(starts % 500000) and np.any(starts % window_size)
+            expected = self.calculate(window_size=window_size, window_hop_us=500000).get_columnar_result()
+            assert table.equals(expected.by_window)
+
+        with pytest.raises(ValueError):
+            MetricsCalculator(window_size=1000000, window_hop_us=300000)
+
+        with pytest.raises(ValueError):
+            MetricsCalculator(window_size=1000000, window_hop_us=500000, allowed_lateness_us=0,
+                              window_sink=CallbackWindowSink(print))
+
+
+class TestGroupBy:
+
+    GROUP_BY = (('src',), ('app', 'window'), ('dst', 'app', 'window'))
+
+    @staticmethod
+    def calculate(engine='record', **options):
+        calculator = MetricsCalculator(engine=engine, **options)
+        if engine == 'vectorized':
+            for batch in NJsonParser().parse_batches(SAMPLE_FILE, batch_size=50):
+                calculator.process_batch(batch)
+        else:
+            for record in NJsonParser().parse_records(SAMPLE_FILE):
+                calculator.process_record(record)
+        return calculator
+
+    @staticmethod
+    def group_rows(table):
+        keys = [name for name in table.column_names if name in ('src', 'dst', 'app', 'window_start', 'drop_reason')]
+        return {tuple(row.pop(key) for key in keys): row for row in table.to_pylist()}
+
+    def test_groupings_match_across_engines(self):
+        """Пользовательские группировки совпадают для обоих движков, rx каждого уровня в сумме равен overall"""
+        record = self.calculate(group_by=self.GROUP_BY).get_columnar_result()
+        vectorized = self.calculate('vectorized', group_by=self.GROUP_BY).get_columnar_result()
+
+        assert tuple(record.by_group) == self.GROUP_BY
+        assert record.by_group[('app', 'window')].column_names[:2] == ['app', 'window_start']
+
+        overall = record.overall.to_pylist()[0]
+        for fields, table in record.by_group.items():
+            assert_results_close(self.group_rows(table), self.group_rows(vectorized.by_group[fields]))
+            assert table.column('tx_count').to_numpy().sum() == overall['tx_count']
+            assert table.column('rx_count').to_numpy().sum() == overall['rx_count']
+
+        for table in (record.by_pair, record.by_app, record.by_window):
+            assert table.column('rx_count').to_numpy().sum() == overall['rx_count']
+
+    def test_rx_counted_in_tx_groups(self):
+        """rx учитывается в группе своего tx: PDR пары не превышает 1, а без группировок результат тот же"""
+        calculator = self.calculate(group_by=[['src', 'dst'], ['window']])
+        result = calculator.get_columnar_result()
+
+        pairs = self.group_rows(result.by_pair)
+        assert all(row['rx_count'] <= row['tx_count'] for row in pairs.values())
+        assert_results_close(
+            self.group_rows(result.by_group[('src', 'dst')]), {key[:2]: row for key, row in pairs.items()}
+        )
+
+        windows = self.group_rows(result.by_group[('window',)])
+        for (window_start,), row in windows.items():
+            window = pc.equal(result.by_window.column('window_start'), window_start)
+            assert row['rx_count'] == pc.sum(pc.filter(result.by_window.column('rx_count'), window)).as_py()
+
+        default = self.calculate().get_columnar_result()
+        assert result.by_pair.equals(default.by_pair) and not default.by_group
+
+    def test_matched_rx_in_tx_groups_and_window(self):
+        """Сопоставленный rx учитывается один раз в группах и окне своего tx, хотя записан с обратной парой
+        src-dst и пришел в следующем окне"""
+        records = (packet(900000, 'tx', 'a'), packet(1100000, 'rx', 'a'), packet(950000, 'tx', 'b'))
+        rows = [{name: getattr(record, name) for name in PacketRecord.__slots__} for record in records]
+
+        for engine in ('record', 'vectorized'):
+            calculator = MetricsCalculator(engine=engine, window_size=1000000, group_by=[['src'], ['window']])
+            calculator.process_batch(records_to_batch(rows))
+            result = calculator.get_columnar_result()
+
+            for table, key in ((result.by_pair, ('car_1', 'car_2', 'N/A')), (result.by_app, ('BSM',)),
+                               (result.by_window, (0, 'car_1', 'car_2', 'N/A')),
+                               (result.by_group[('src',)], ('car_1',)), (result.by_group[('window',)], (0,))):
+                counts = {group_key: (row['tx_count'], row['rx_count'], row['pdr'])
+                          for group_key, row in self.group_rows(table).items()}
+                assert counts == {key: (2, 1, 0.5)}, engine
+
+    def test_options_state_and_export(self, tmp_path):
+        """Группировки проверяются, переживают сохранение состояния и выгружаются отдельными таблицами"""
+        calculator = self.calculate(group_by=[['dst', 'app', 'window'], ['src']])
+        restored = pickle.loads(pickle.dumps(calculator))
+        restored.process_record(packet(1000, 'tx', 'restored', src='car_99'))
+
+        result = restored.get_columnar_result()
+        groups = self.group_rows(result.by_group[('dst', 'app', 'window')])
+        assert sum(row['tx_count'] for row in groups.values()) == restored.accumulated_data['overall']['tx']
+        assert self.group_rows(result.by_group[('src',)])[('car_99',)]['tx_count'] == 1
+
+        exported = export_comprehensive(result, tmp_path)
+        assert {'metrics_group_by_dst_app_window_parquet', 'metrics_group_by_src_parquet'} <= exported.keys()
+
+        # drop_reason есть только в записях rx, а ключ группы берется из tx, поэтому группировка по нему отклоняется
+        # для всех движков и хранилищ ожидающих tx
+        for options in ({}, {'pending_store': 'array'}, {'engine': 'vectorized'}):
+            for group_by in ([['pkt_id']], [['src', 'src']], [[]], [['drop_reason']], [['src', 'drop_reason']]):
+                with pytest.raises(ValueError):
+                    MetricsCalculator(group_by=group_by, **options)
+
+
+class TestSeenFilter:
+
+    def test_error_rate_and_growth(self):
+        """Ложноотрицательных ответов нет, доля ложных срабатываний не больше заданной при росте фильтра"""
+        seen = SeenFilter(0.01, initial_capacity=1000)
+        false_positives = sum(seen.add(f'pkt_{i}') for i in range(20000))
+        assert all(seen.add(f'pkt_{i}') for i in range(20000))
+        assert false_positives <= 200 and len(seen) == 20000 - false_positives and len(seen.stages) > 3
+
+        false_positives = sum(seen.add(f'new_{i}') for i in range(20000))
+        assert false_positives / 20000 <= 0.015
+        assert seen.false_positive_rate <= 0.01
+        assert seen.nbytes < 20000 * 8
+
+        with pytest.raises(ValueError):
+            SeenFilter(0)
+
+    def test_add_many_and_merge(self):
+        """Векторное добавление отвечает как добавление по одному, объединение находит ключи обоих фильтров"""
+        rng = np.random.default_rng(7)
+        pkt_ids = np.array([f'p{i}'.encode() for i in rng.integers(0, 3000, 5000)], dtype=np.bytes_)
+
+        single, vectorized = SeenFilter(1e-6, initial_capacity=500), SeenFilter(1e-6, initial_capacity=500)
+        expected = [single.add(pkt_id) for pkt_id in pkt_ids[:2500].tolist()]
+        seen = np.concatenate([vectorized.add_many(pkt_ids[:1000]), vectorized.add_many(pkt_ids[1000:2500])])
+        assert seen.tolist() == expected
+
+        other = SeenFilter(1e-6, initial_capacity=500)
+        other.add_many(pkt_ids[2500:])
+        vectorized.merge(pickle.loads(pickle.dumps(other)))
+        assert vectorized.add_many(np.unique(pkt_ids)).all()
+
+    def test_duplicate_rx_across_engines(self):
+        """Повторный rx учитывается как duplicate_rx и не меняет метрики в обоих движках"""
+        records = list(NJsonParser().parse_records(SAMPLE_FILE))
+        duplicates = [record for record in records if record.event == 'rx'][:20]
+        stream = records + [packet(record.ts_us + 10, 'rx', record.pkt_id) for record in duplicates]
+        rows = [{name: getattr(record, name) for name in PacketRecord.__slots__} for record in stream]
+
+        expected = reference_result()
+        for engine in MetricsCalculator.ENGINES:
+            calculator = MetricsCalculator(engine=engine, duplicate_filter_error_rate=0.001)
+            if engine == 'vectorized':
+                for start in range(0, len(rows), 60):
+                    calculator.process_batch(records_to_batch(rows[start:start + 60]))
+            else:
+                for record in stream:
+                    calculator.process_record(record)
+
+            assert calculator.anomalies['duplicate_rx'] == 20
+            assert calculator.success_cnt == expected.success_cnt
+            assert_results_close(calculator.get_metrics_result().by_pair, expected.by_pair)
+            assert list(calculator.get_curr_stats()['anomaly_error_rates']) == ['duplicate_rx']
+
+    def test_duplicate_tx_after_eviction(self, tmp_path):
+        """С фильтром дубликат tx находится после вытеснения первого tx, оценка ошибки выгружается с аномалиями"""
+        records = [packet(0, 'tx', 'a'), packet(100, 'rx', 'a'), packet(5000, 'tx', 'b'), packet(6000, 'tx', 'a'),
+                   packet(6100, 'rx', 'a')]
+
+        without_filter = MetricsCalculator(match_timeout_us=1000)
+        calculator = MetricsCalculator(match_timeout_us=1000, duplicate_filter_error_rate=0.001)
+        for record in records[:3]:
+            without_filter.process_record(record)
+            calculator.process_record(record)
+
+        calculator = pickle.loads(pickle.dumps(calculator))
+        for record in records[3:]:
+            without_filter.process_record(record)
+            calculator.process_record(record)
+
+        assert without_filter.anomalies['duplicate_tx'] == 0
+        assert (calculator.anomalies['duplicate_tx'], calculator.anomalies['duplicate_rx']) == (1, 1)
+        assert calculator.success_cnt == 1
+
+        result = calculator.get_columnar_result()
+        assert set(result.anomaly_error_rates) == {'duplicate_tx', 'duplicate_rx'}
+
+        export_comprehensive(result, tmp_path)
+        anomalies = pq.read_table(tmp_path / 'metrics_anomalies.parquet').to_pylist()
+        rates = {row['anomaly_type']: row['false_positive_rate'] for row in anomalies}
+        assert rates['duplicate_tx'] == result.anomaly_error_rates['duplicate_tx'] and rates['lost_tx'] is None
+
+        with pytest.raises(ValueError):
+            MetricsCalculator(duplicate_filter_error_rate=1)
+
+
+class TestSortedInput:
+
+    @staticmethod
+    def window_rows(table):
+        return {(row.pop('window_start'), row.pop('src'), row.pop('dst')): row for row in table.to_pylist()}
+
+    def test_windows_close_after_match_timeout(self):
+        """Для упорядоченного потока окна закрываются по match_timeout_us, не дожидаясь allowed_lateness_us,
+        а результат совпадает с расчетом без признака"""
+        runs = {}
+        for sorted_input in (False, True):
+            tables = []
+            calculator = MetricsCalculator(
+                match_timeout_us=500000, allowed_lateness_us=10 ** 7, window_sink=CallbackWindowSink(tables.append),
+                sorted_input=sorted_input
+            )
+            for record in NJsonParser().parse_records(SAMPLE_FILE):
+                calculator.process_record(record)
+
+            closed_end = calculator.window_store.closed_end
+            calculator.flush_pending()
+            runs[sorted_input] = (calculator, pa.concat_tables(tables), closed_end)
+
+        (general, general_rows, general_closed), (ordered, ordered_rows, ordered_closed) = runs[False], runs[True]
+
+        # Последняя запись - 11.35 с: окна до 1 с закрыты по allowed_lateness_us, до 10 с - по match_timeout_us
+        assert (general_closed, ordered_closed) == (1, 10)
+        assert ordered.ordered and isinstance(ordered._tx_expiry, collections.deque)
+        assert ordered.anomalies.pop('out_of_order_records') == 0
+        assert ordered.anomalies == general.anomalies and general.anomalies['late_records'] == 0
+        assert_results_close(self.window_rows(ordered_rows), self.window_rows(general_rows))
+
+    def test_fallback_on_out_of_order_records(self):
+        """Запись не по порядку учитывается, очереди вытеснения переходят на кучи без потери порядка вытеснения"""
+        records = [
+            packet(0, 'tx', 'a'),
+            packet(100, 'tx', 'b'),
+            packet(2000, 'tx', 'c'),
+            packet(50, 'rx', 'a'),
+            packet(60, 'tx', 'd'),
+            packet(2100, 'rx', 'c'),
+            packet(5000, 'tx', 'e'),
+            packet(900, 'rx', 'e'),
+        ]
+
+        expected = MetricsCalculator(match_timeout_us=1000)
+        calculator = MetricsCalculator(match_timeout_us=1000, sorted_input=True)
+        for record in records:
+            expected.process_record(record)
+            calculator.process_record(record)
+
+        assert not calculator.ordered and isinstance(calculator._tx_expiry, list)
+        assert calculator.anomalies.pop('out_of_order_records') == 3
+        assert calculator.anomalies == expected.anomalies
+        assert set(calculator.tx_records) == set(expected.tx_records) == {'e'}
+
+        rows = [{name: getattr(record, name) for name in PacketRecord.__slots__} for record in records]
+        for split in (2, 4, 7):
+            vectorized = MetricsCalculator(engine='vectorized', sorted_input=True)
+            vectorized.process_batch(records_to_batch(rows[:split]))
+            vectorized.process_batch(records_to_batch(rows[split:]))
+            assert vectorized.anomalies['out_of_order_records'] == 3
+
+        partitioned = PartitionedMetricsCalculator(2, sorted_input=True, match_timeout_us=1000)
+        partitioned.process_batch(records_to_batch(rows))
+        result = partitioned.result()
+        assert result.anomalies.pop('out_of_order_records') == 3
+        assert result.anomalies == expected.anomalies
+
+
+class TestInputMerge:
+
+    @staticmethod
+    def split_by_vehicle(directory):
+        """Лог каждой машины: tx лежат в файле отправителя, rx - в файле получателя"""
+        lines = {}
+        for line in SAMPLE_FILE.read_text(encoding='utf-8').splitlines(keepends=True):
+            row = json.loads(line)
+            lines.setdefault(row['src'] if row.get('event') == 'tx' else row.get('dst'), []).append(line)
+
+        for vehicle, vehicle_lines in lines.items():
+            (directory / f'{vehicle}.ndjson').write_text(''.join(vehicle_lines), encoding='utf-8')
+        return len(lines)
+
+    @pytest.mark.parametrize('batch_size', [3, 16, 8192])
+    def test_merged_stream_is_sorted_and_complete(self, tmp_path, batch_size):
+        """Слияние выдает все записи всех файлов по возрастанию ts_us, держа в памяти по блоку на файл"""
+        files = self.split_by_vehicle(tmp_path)
+        batches = list(merge_batches(collect_input_files([tmp_path]), batch_size=batch_size))
+        merged = pa.Table.from_batches(batches)
+        expected = pa.Table.from_batches(list(NJsonParser().parse_batches(SAMPLE_FILE)))
+
+        ts_us = merged.column('ts_us').to_pylist()
+        assert ts_us == sorted(ts_us)
+        assert sorted(map(str, merged.to_pylist())) == sorted(map(str, expected.to_pylist()))
+        assert max(batch.num_rows for batch in batches) <= files * batch_size
+
+    @pytest.mark.parametrize('engine', ['record', 'vectorized'])
+    def test_metrics_match_single_file(self, tmp_path, engine):
+        """Метрики по логам отдельных машин совпадают с метриками общего файла"""
+        self.split_by_vehicle(tmp_path)
+        (tmp_path / 'notes.txt').write_text('не лог', encoding='utf-8')
+
+        calculator = MetricsCalculator(engine=engine)
+        for batch in merge_batches(collect_input_files([tmp_path]), batch_size=10):
+            calculator.process_batch(batch)
+
+        assert_results_close(calculator.get_metrics_result(), reference_result())
+
+        with pytest.raises(ValueError):
+            collect_input_files([tmp_path / 'notes.txt'])
+
+        (tmp_path / 'empty').mkdir()
+        with pytest.raises(ValueError):
+            collect_input_files([tmp_path / 'empty'])
+
+
+class TestExternalSort:
+
+    @staticmethod
+    def run_external(memory_limit, batches, tmp_path, **options):
+        external = ExternalSortMetrics(memory_limit, temp_dir=tmp_path, **options)
+        for batch in batches:
+            external.process_batch(batch)
+
+        spilled = len(external.runs)
+        calculator = external.result()
+        assert not external.temp_path.exists()
+        return calculator, spilled
+
+    @pytest.mark.parametrize('engine', ['record', 'vectorized'])
+    @pytest.mark.parametrize('memory_limit', [2000, 20000, 1 << 30])
+    def test_matches_in_memory_engine(self, tmp_path, engine, memory_limit):
+        """Слияние серий по pkt_id дает те же метрики и аномалии, что и обработка всего потока в памяти"""
+        batches = NJsonParser().parse_batches(SAMPLE_FILE, batch_size=7)
+        calculator, spilled = self.run_external(memory_limit, batches, tmp_path, engine=engine)
+
+        assert (spilled > 1) == (memory_limit < 1 << 30)
+        assert_results_close(calculator.get_metrics_result(), reference_result())
+        assert not calculator.tx_records and not calculator.rx_records
+
+    def test_multi_pass_merge_of_shuffled_stream(self, tmp_path, monkeypatch):
+        """Записи не по порядку ts_us: при слиянии группами сохраняется порядок записей внутри pkt_id"""
+        table = pa.Table.from_batches(list(NJsonParser().parse_batches(SAMPLE_FILE)))
+        table = table.take(pa.array(np.random.default_rng(0).permutation(table.num_rows)))
+        batches = table.to_batches(max_chunksize=5)
+
+        expected = MetricsCalculator(engine='vectorized')
+        for batch in batches:
+            expected.process_batch(batch)
+
+        monkeypatch.setattr(external_sort, 'RUN_BLOCK_ROWS', 3)
+        calculator, spilled = self.run_external(1000, batches, tmp_path, engine='vectorized')
+
+        assert spilled > 2
+        assert_results_close(calculator.get_metrics_result(), expected.get_metrics_result())
+        assert calculator.anomalies == expected.anomalies
+
+    def test_options(self):
+        """Размер памяти задается с единицами, параметры, зависящие от порядка по ts_us, не поддерживаются"""
+        assert parse_memory_size('1048576') == 1 << 20
+        assert parse_memory_size('512M') == parse_memory_size('512MiB') == 512 << 20
+        assert parse_memory_size('1.5g') == 3 << 29
+
+        for value in ['', 'много', '-1K', '0']:
+            with pytest.raises(ValueError):
+                parse_memory_size(value)
+
+        with pytest.raises(ValueError):
+            ExternalSortMetrics(1 << 20, match_timeout_us=1000)
+        with pytest.raises(ValueError):
+            ExternalSortMetrics(0)
+
+
+class TestPendingSpill:
+
+    def test_spilling_map_operations(self):
+        """Записи на диске находятся, удаляются и обходятся как записи в памяти, списки переносятся в память"""
+        store = PendingSpillStore(4 * ENTRY_BYTES)
+        tx_records = store.new_map('tx_records')
+        rx_records = store.new_map('rx_records', default_factory=list)
+
+        for index in range(20):
+            tx_records[f'pkt_{index}'] = index
+        rx_records['pkt_0'].append('rx_0')
+        rx_records['pkt_1'].append('rx_1')
+
+        in_memory = len(tx_records.memory) + len(rx_records.memory)
+        assert 0 < in_memory <= 4
+        assert store.spilled == store.on_disk == len(tx_records) + len(rx_records) - in_memory
+        assert len(tx_records) == 20 and len(rx_records) == 2
+
+        assert tx_records.get('pkt_0') == 0 and 'pkt_0' not in tx_records.memory
+        assert 'pkt_5' in tx_records and 'pkt_missing' not in tx_records
+        assert sorted(tx_records.values()) == list(range(20))
+
+        rx_records['pkt_0'].append('rx_0_duplicate')
+        assert rx_records.pop('pkt_0') == ['rx_0', 'rx_0_duplicate']
+        assert rx_records.pop('pkt_0', None) is None
+
+        del tx_records['pkt_3']
+        tx_records['pkt_4'] = 'updated'
+        assert tx_records['pkt_4'] == 'updated' and len(tx_records) == 19
+        with pytest.raises(KeyError):
+            del tx_records['pkt_3']
+
+        assert store.stats['misses'] > 0 and store.stats['hits'] > 0
+        store.close()
+
+    @pytest.mark.parametrize('pending_memory_limit', [1, 3000])
+    @pytest.mark.parametrize('match_timeout_us', [None, 150000])
+    def test_matches_in_memory_calculator(self, pending_memory_limit, match_timeout_us):
+        """Перенос ожидающих записей на диск не меняет сопоставление, аномалии и ожидающие записи"""
+        calculator = MetricsCalculator(pending_memory_limit=pending_memory_limit, match_timeout_us=match_timeout_us)
+        expected = MetricsCalculator(match_timeout_us=match_timeout_us)
+
+        for record in NJsonParser().parse_data_stream(SAMPLE_FILE):
+            calculator.process_record(record)
+            expected.process_record(record)
+
+        stats, expected_stats = calculator.get_curr_stats(), expected.get_curr_stats()
+        for name in ('anomalies', 'pending_tx', 'pending_rx', 'sucess_cnt'):
+            assert stats[name] == expected_stats[name], name
+        assert 'pending_spill' not in expected_stats
+        assert stats['pending_spill']['spilled'] > 0 or match_timeout_us is not None
+
+        calculator.flush_pending()
+        expected.flush_pending()
+        assert_results_close(calculator.get_metrics_result(), expected.get_metrics_result())
+
+    @pytest.mark.parametrize('match_timeout_us', [500000, 10 ** 9])
+    def test_resident_bounded_with_timeout(self, match_timeout_us):
+        """При match_timeout_us очереди вытеснения и отметки пар хранятся только для записей в памяти, поэтому
+        их размер ограничен бюджетом, а записи на диске вытесняются по времени с теми же аномалиями"""
+        records = []
+        for index in range(3000):
+            records.append(packet(index * 1000, 'tx', f'pkt_{index}'))
+            if index % 3 == 0:
+                records.append(packet(index * 1000 + 500, 'rx', f'pkt_{index}'))
+            elif index % 3 == 1:
+                records.append(packet(index * 1000 + 500, 'rx', f'orphan_{index}'))
+
+        calculator = MetricsCalculator(pending_memory_limit=100 * ENTRY_BYTES, match_timeout_us=match_timeout_us)
+        expected = MetricsCalculator(match_timeout_us=match_timeout_us)
+        capacity = calculator._spill_store.capacity
+
+        for record in records:
+            calculator.process_record(record)
+            expected.process_record(record)
+
+            tx_records, rx_records = calculator.tx_records, calculator.rx_records
+            assert len(tx_records.memory) + len(rx_records.memory) <= capacity
+            assert len(calculator._tx_expiry) + len(calculator._rx_expiry) <= EXPIRY_QUEUE_FACTOR * capacity + 1
+            assert len(tx_records.matched) <= len(tx_records.memory) and not calculator._matched_tx
+
+        assert calculator._spill_store.spilled > 0
+
+        calculator.flush_pending()
+        expected.flush_pending()
+        assert calculator.anomalies == expected.anomalies
+        assert calculator.anomalies['lost_tx'] == 2000 and calculator.anomalies['rx_without_tx'] == 1000
+        assert len(calculator.tx_records) == len(calculator.rx_records) == 0
+        assert_results_close(calculator.get_metrics_result(), expected.get_metrics_result())
+
+    def test_state_and_merge(self):
+        """Записи на диске сохраняются в состоянии, а счетчики складываются при объединении"""
+        batches = list(NJsonParser().parse_batches(SAMPLE_FILE, batch_size=16))
+        half = len(batches) // 2
+
+        first, second = (MetricsCalculator(symbols=SymbolTable(), pending_memory_limit=2000) for _ in range(2))
+        for batch in batches[:half]:
+            first.process_batch(batch)
+        for batch in batches[half:]:
+            second.process_batch(batch)
+
+        restored = pickle.loads(pickle.dumps(first))
+        assert restored.get_curr_stats()['pending_tx'] == first.get_curr_stats()['pending_tx']
+        assert restored._spill_store.spilled == first._spill_store.spilled > 0
+
+        spilled = first._spill_store.spilled + second._spill_store.spilled
+        restored.merge(second)
+
+        assert restored.get_curr_stats()['pending_spill']['spilled'] >= spilled
+        assert_results_close(restored.get_metrics_result(), reference_result())
+
+        with pytest.raises(ValueError):
+            MetricsCalculator(pending_memory_limit=2000, engine='vectorized')
+        with pytest.raises(ValueError):
+            MetricsCalculator(pending_memory_limit=0)